@@ -1,11 +1,32 @@
-from flask import Flask, request, make_response, session
+from flask import Flask, Response, request, make_response, session, g, stream_with_context
 from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_restful import Api, Resource
 from models import db, Menu_item, Order_Item, Order, Restaurant, User, bcrypt
+from serializers import restaurant_summary, restaurant_full, menu_item_full, order_full, user_full
+from cache import response_cache, MemoryBackend
+from hashing import password_hasher, HasherBusy
+from orders import (place_orders, parse_delivery_time, change_status, BatchError, InvalidTransition,
+                    VersionConflict, CLIENT_TRANSITIONS)
+from menus import import_menu, parse_csv, MenuImportError
+from stats import record_orders, forget_orders, forget_order_lines, restaurant_stats, default_window, parse_day
+from search import search_index
+from geo import geocoder, geo_index, valid_coordinates
+from profiling import profiler
+from db_pool import engine_options, pool_metrics
+from replicas import replica_router
+from ratelimit import rate_limiter
+from events import order_events
+from sessions import server_sessions
+from encoding import FastJSONProvider, compressor
 import os
+import base64
+import hmac
+from datetime import datetime
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from functools import wraps
+from werkzeug.http import http_date, is_resource_modified, quote_etag, unquote_etag
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,31 +35,274 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URI")
 app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
-
-CORS(app, resources={r"/*": {"origins": "*", "supports_credentials": True}})
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+    pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    pre_ping=os.environ.get("DB_POOL_PRE_PING", "1").lower() in ("1", "true"),
+    statement_timeout_ms=int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0)),
+)
+app.config['DATABASE_REPLICA_URIS'] = [uri for uri in os.environ.get("DATABASE_REPLICA_URIS", "").split(",") if uri]
+app.config['REPLICA_STRATEGY'] = os.environ.get("REPLICA_STRATEGY", "round_robin")
+app.config['READ_YOUR_WRITES_SECONDS'] = int(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+app.config['REPLICA_RETRY_SECONDS'] = int(os.environ.get("REPLICA_RETRY_SECONDS", 30))
+app.config['RESPONSE_CACHE_ENABLED'] = os.environ.get("RESPONSE_CACHE_ENABLED", "1").lower() in ("1", "true")
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+app.config['RESPONSE_CACHE_PATH'] = os.environ.get("RESPONSE_CACHE_PATH")
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get("PASSWORD_HASH_QUEUE", 16))
+# Off by default. Each worker caches roles for itself, so with a TTL a deleted or
+# re-roled user keeps their old role in the other workers for up to that long
+app.config['ROLE_CACHE_TTL'] = int(os.environ.get("ROLE_CACHE_TTL", 0))
+app.config['SEARCH_REFRESH_SECONDS'] = int(os.environ.get("SEARCH_REFRESH_SECONDS", 5))
+app.config['GEOCODER_CENTER'] = tuple(float(part) for part in os.environ.get("GEOCODER_CENTER", "-1.2864,36.8172").split(","))
+app.config['GEOCODER_RADIUS_KM'] = float(os.environ.get("GEOCODER_RADIUS_KM", 25))
+app.config['GEO_CELL_KM'] = float(os.environ.get("GEO_CELL_KM", 2))
+app.config['GEO_REFRESH_SECONDS'] = int(os.environ.get("GEO_REFRESH_SECONDS", 5))
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true")
+app.config['RATE_LIMIT_PER_SECOND'] = float(os.environ.get("RATE_LIMIT_PER_SECOND", 10))
+app.config['RATE_LIMIT_BURST'] = float(os.environ.get("RATE_LIMIT_BURST", 50))
+app.config['RATE_LIMIT_PATH'] = os.environ.get("RATE_LIMIT_PATH")
+# Tokens per request by "METHOD endpoint" or endpoint, anything else costs 1
+app.config['RATE_LIMIT_COSTS'] = {
+    'login': 10,
+    'signup': 10,
+    'GET restaurantresource': 2,
+    'search': 2,
+    'nearbyrestaurants': 2,
+    'restaurantstats': 3,
+    'userordersbatch': 10,
+    'PUT restaurantmenu': 10,
+    'PATCH restaurantmenu': 10,
+    'events': 5,
+}
+# cookie keeps signed cookie sessions, memory or sqlite keep them server-side behind an opaque id
+app.config['SESSION_BACKEND'] = os.environ.get("SESSION_BACKEND", "cookie")
+app.config['SESSION_TTL'] = int(os.environ.get("SESSION_TTL", 86400))
+app.config['SESSION_PATH'] = os.environ.get("SESSION_PATH")
+app.config['SESSION_MAX_ENTRIES'] = int(os.environ.get("SESSION_MAX_ENTRIES", 100000))
+app.config['EVENTS_PATH'] = os.environ.get("EVENTS_PATH")
+app.config['EVENTS_MAX'] = int(os.environ.get("EVENTS_MAX", 10000))
+app.config['EVENTS_HEARTBEAT_SECONDS'] = int(os.environ.get("EVENTS_HEARTBEAT_SECONDS", 15))
+app.config['EVENTS_STREAM_SECONDS'] = int(os.environ.get("EVENTS_STREAM_SECONDS", 300))
+app.config['EVENTS_POLL_SECONDS'] = int(os.environ.get("EVENTS_POLL_SECONDS", 25))
+# Compact JSON for production, JSON_COMPACT=0 pretty-prints for reading responses by hand
+app.config['JSON_COMPACT'] = os.environ.get("JSON_COMPACT", "1").lower() in ("1", "true")
+# orjson when installed, stdlib otherwise
+app.config['JSON_ENCODER'] = os.environ.get("JSON_ENCODER", "orjson")
+app.config['COMPRESS_ENABLED'] = os.environ.get("COMPRESS_ENABLED", "1").lower() in ("1", "true")
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+# Level 1 gets most of level 6's savings for under half the CPU
+app.config['COMPRESS_LEVEL'] = int(os.environ.get("COMPRESS_LEVEL", 1))
+app.config['PROFILING_ENABLED'] = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true")
+app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get("PROFILING_SAMPLE_RATE", 0.01))
+app.config['PROFILING_N_PLUS_ONE'] = int(os.environ.get("PROFILING_N_PLUS_ONE", 5))
+app.config['METRICS_ENABLED'] = os.environ.get("METRICS_ENABLED", "1").lower() in ("1", "true")
+# Lets a scraper read /metrics with "Authorization: Bearer <token>", without it only admins can
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+
+app.json = FastJSONProvider(app)
+app.json.compact = app.config['JSON_COMPACT']
+
+# Response headers cross-origin scripts may read: the page cursor, cache
+# validators, profiling timings and the rate limiter's back-off
+EXPOSE_HEADERS = ['X-Next-Cursor', 'ETag', 'Last-Modified', 'Server-Timing', 'Retry-After']
+CORS(app, resources={r"/*": {"origins": "*", "supports_credentials": True}}, expose_headers=EXPOSE_HEADERS)
 
 migrate = Migrate(app, db)
 api = Api(app)
+
+# Resources returning plain dicts go through app.json as make_response does,
+# rather than flask-restful's own stdlib encoder
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    response = app.json.response(data)
+    response.status_code = code
+    response.headers.extend(headers or {})
+    return response
+
+replica_router.init_app(app)
+server_sessions.init_app(app)
 db.init_app(app)
+profiler.init_app(app)
+pool_metrics.init_app(app, db, profiler)
+rate_limiter.init_app(app, profiler)
 bcrypt.init_app(app)
+response_cache.init_app(app)
+password_hasher.init_app(app)
+search_index.init_app(app)
+geocoder.init_app(app)
+geo_index.init_app(app)
+order_events.init_app(app)
+compressor.init_app(app)
+
+# Optional short lived user_id -> role cache (ROLE_CACHE_TTL) so most authorization
+# checks skip the database. Invalidation only reaches this worker's copy
+role_cache = MemoryBackend(max_entries=4096)
+
+# The logged in user, loaded at most once per request and kept on flask.g
+def current_user():
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = User.query.get(user_id) if user_id is not None else None
+    return g.current_user
+
+def current_role():
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    ttl = app.config['ROLE_CACHE_TTL']
+    if 'current_user' not in g and ttl:
+        role = role_cache.get(f'role:{user_id}')
+        if role is not None:
+            return role
+
+    user = current_user()
+    if user is None:
+        return None
+    if ttl:
+        role_cache.set(f'role:{user_id}', user.role, ttl)
+    return user.role
 
 # Decorator for role-based access control
 def role_required(required_role):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
+            role = current_role()
+            if role is None:
                 return make_response({"error": "You are not logged in"}, 401)
 
-            user = User.query.get(session['user_id'])
-            if user.role != required_role:
+            if role != required_role:
                 return make_response({"error": "Access forbidden: insufficient permissions"}, 403)
 
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def metrics_access(f):
+    # Scrapers present METRICS_TOKEN, anyone else needs an admin session
+    admin_only = role_required('admin')(f)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = app.config['METRICS_TOKEN']
+        offered = request.headers.get('Authorization', '').encode()
+        if token and hmac.compare_digest(offered, f'Bearer {token}'.encode()):
+            return f(*args, **kwargs)
+        return admin_only(*args, **kwargs)
+    return decorated_function
+
+if 'metrics' in app.view_functions:
+    app.view_functions['metrics'] = metrics_access(app.view_functions['metrics'])
+
+# Keyset pagination helpers, the cursor is an opaque token wrapping the last id of a page
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+
+def page_size(limit):
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return min(limit, MAX_PAGE_SIZE)
+
+# Eager loading plans matching what the serializers walk for each model, so a
+# serialized response costs a fixed number of queries whatever the row count
+RESTAURANT_LOAD = (
+    selectinload(Restaurant.orders),
+    selectinload(Restaurant.menu_items).selectinload(Menu_item.order_items).joinedload(Order_Item.order),
+)
+MENU_ITEM_LOAD = (
+    joinedload(Menu_item.restaurant).selectinload(Restaurant.orders),
+    selectinload(Menu_item.order_items).joinedload(Order_Item.order),
+)
+
+# Cached catalog responses are stored as (body, status, headers)
+def cached_response(key, build):
+    # Cache fills read the primary, a lagging replica would be served until the TTL
+    with replica_router.primary():
+        body, status, headers = response_cache.get_or_set(key, build)
+    # Conditional GET is answered from the stored validators, the body is never encoded
+    if status == 200 and 'ETag' in headers:
+        etag, _ = unquote_etag(headers['ETag'])
+        if not is_resource_modified(request.environ, etag=etag, last_modified=headers.get('Last-Modified')):
+            return make_response('', 304, headers)
+    return make_response(body, status, headers)
+
+def restaurant_validators(kind, restaurant_id, version, updated_at):
+    headers = {'ETag': quote_etag(f'{kind}-{restaurant_id}-{version}')}
+    if updated_at:
+        headers['Last-Modified'] = http_date(updated_at)
+    return headers
+
+def bump_restaurant_version(restaurant_id):
+    Restaurant.query.filter(Restaurant.id == restaurant_id).update(
+        {Restaurant.version: Restaurant.version + 1, Restaurant.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+
+# Detail and menu entries are keyed by the restaurant's version, read from the
+# primary on every request. Writes bump it in their own commit, so every worker
+# moves to the new key at once, and a fill that read the old rows can only land
+# under the old key, which nobody asks for any more. Old entries age out by TTL.
+def restaurant_cache_key(kind, restaurant_id):
+    with replica_router.primary():
+        version = db.session.query(Restaurant.version).filter(Restaurant.id == restaurant_id).scalar()
+    return f'{kind}:{restaurant_id}:v{version}'
+
+def invalidate_restaurant(restaurant_id):
+    response_cache.bump('restaurants')
+    search_index.reindex_restaurant(restaurant_id)
+    geo_index.reindex_restaurant(restaurant_id)
+
+def hasher_busy(e):
+    return make_response({"error": str(e)}, 503, {'Retry-After': '1'})
+
+# Streaming mode for order histories, asked for with ?stream=1 (one JSON document)
+# or Accept: application/x-ndjson (one order per line). Rows are read in batches
+# with yield_per, a server-side cursor on PostgreSQL, so memory stays flat.
+STREAM_BATCH_SIZE = 500
+
+def stream_format():
+    if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+def stream_response(fmt, envelope, key, rows, to_dict):
+    def dumps(obj):
+        return app.json.dumps(obj, indent=None, separators=(',', ':'))
+
+    def generate():
+        if fmt == 'ndjson':
+            for row in rows:
+                yield dumps(to_dict(row)) + '\n'
+            return
+        yield dumps(envelope)[:-1] + f',"{key}":['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + dumps(to_dict(row))
+        yield ']}'
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), 200, mimetype=mimetype)
+
 class Running_Test(Resource):
     def get(self):
         return f'<h2>I am working</h2>'
@@ -67,18 +331,20 @@ class Signup(Resource):
             db.session.add(user)
             db.session.commit()
             session["user_id"] = user.id
-            return make_response(user.to_dict(), 201)
+            return make_response(user_full(user), 201)
         except IntegrityError:
             return {"error": "Username already exists"}, 422
+        except HasherBusy as e:
+            return hasher_busy(e)
         except Exception as e:
             print(e)
             return make_response({"error": str(e)}, 422)
 
 class CheckSession(Resource):
     def get(self):
-        if 'user_id' in session:
-            user = User.query.get(session["user_id"])
-            return make_response(user.to_dict(), 200)
+        user = current_user()
+        if user is not None:
+            return make_response(user_full(user), 200)
         return make_response({"error": "You are not logged in"}, 401)
 
 class Login(Resource):
@@ -88,7 +354,11 @@ class Login(Resource):
             return {"error": "Missing required fields"}, 422
         
         user = User.query.filter_by(email=data["email"]).first()
-        if user and user.authenticate(data["password"]):
+        try:
+            authenticated = user is not None and user.authenticate(data["password"])
+        except HasherBusy as e:
+            return hasher_busy(e)
+        if authenticated:
             session["user_id"] = user.id
             return make_response({'email': f"{user.email} has logged in"}, 201)
         return make_response({"error": "Username or password incorrect"}, 401)
@@ -101,16 +371,69 @@ class Logout(Resource):
 class RestaurantResource(Resource):
     def get(self, id=None):
         if id is None:
-            restaurants = [restaurant.to_dict(rules=('-menu_items', "-orders",)) for restaurant in Restaurant.query.all()]
-            return make_response(restaurants, 200)
+            limit = page_size(request.args.get('limit'))
+            if limit is None:
+                return make_response({"error": "limit must be a positive integer"}, 422)
+
+            after_id = None
+            if request.args.get('cursor'):
+                after_id = decode_cursor(request.args['cursor'])
+                if after_id is None:
+                    return make_response({"error": "Invalid cursor"}, 422)
+            cuisine = request.args.get('cuisine') or None
+            rating = request.args.get('rating') or None
+
+            key = f"{response_cache.namespace('restaurants')}:{limit}:{after_id}:{cuisine}:{rating}"
+            return cached_response(key, lambda: self.list_page(limit, after_id, cuisine, rating))
+        return cached_response(restaurant_cache_key('restaurant', id), lambda: self.detail(id))
+
+    def list_page(self, limit, after_id, cuisine, rating):
+        query = Restaurant.query
+        if cuisine:
+            query = query.filter(Restaurant.cuisine == cuisine)
+        if rating:
+            query = query.filter(Restaurant.rating == rating)
+        if after_id is not None:
+            query = query.filter(Restaurant.id > after_id)
+
+        # Fetch one extra row to know whether there is a next page without a COUNT
+        page = query.order_by(Restaurant.id).limit(limit + 1).all()
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        headers = {'X-Next-Cursor': encode_cursor(page[-1].id)} if has_more else {}
+        return restaurant_summary.many(page), 200, headers
+
+    def detail(self, id):
         restaurant = Restaurant.query.get(id)
         if not restaurant:
-            return make_response({"message": "Restaurant not found"}, 404)
-        return make_response(restaurant.to_dict(rules=('-menu_items', "-orders",)), 200)
+            return {"message": "Restaurant not found"}, 404, {}
+        headers = restaurant_validators('restaurant', restaurant.id, restaurant.version, restaurant.updated_at)
+        return restaurant_summary(restaurant), 200, headers
+
+    @staticmethod
+    def coordinates(data):
+        # Explicit latitude/longitude win, otherwise the address is geocoded.
+        # Returns (latitude, longitude), None when there is nothing to set, or an error response
+        if 'latitude' in data or 'longitude' in data:
+            try:
+                point = float(data['latitude']), float(data['longitude'])
+            except (KeyError, TypeError, ValueError):
+                return make_response({"error": "latitude and longitude must both be numbers"}, 422)
+            if not valid_coordinates(*point):
+                return make_response({"error": "latitude and longitude are out of range"}, 422)
+            return point
+        if 'address' in data:
+            return geocoder.geocode(data['address']) or (None, None)
+        return None
 
     @role_required('restaurant_owner')
     def post(self):
         data = request.get_json()
+        point = self.coordinates(data)
+        if isinstance(point, Response):
+            return point
+        latitude, longitude = point or (None, None)
         new_restaurant = Restaurant(
             name=data['name'],
             address=data['address'],
@@ -118,10 +441,13 @@ class RestaurantResource(Resource):
             menu=data['menu'],
             rating=data['rating'],
             reviews=data['reviews'],
+            latitude=latitude,
+            longitude=longitude,
         )
         db.session.add(new_restaurant)
         db.session.commit()
-        return make_response(new_restaurant.to_dict(), 201)
+        invalidate_restaurant(new_restaurant.id)
+        return make_response(restaurant_full(new_restaurant), 201)
 
     @role_required('restaurant_owner')
     def patch(self, id):
@@ -130,13 +456,65 @@ class RestaurantResource(Resource):
             return make_response({"message": "Restaurant not found"}, 404)
 
         data = request.get_json()
+        point = self.coordinates(data)
+        if isinstance(point, Response):
+            return point
         # Update only the fields provided in the request
         for field in ['name', 'address', 'cuisine', 'menu', 'rating', 'reviews']:
             if field in data:
                 setattr(restaurant, field, data[field])
+        if point is not None:
+            restaurant.latitude, restaurant.longitude = point
+        restaurant.version = Restaurant.version + 1
+        restaurant.updated_at = datetime.utcnow()
 
         db.session.commit()
-        return make_response(restaurant.to_dict(), 200)
+        invalidate_restaurant(id)
+        restaurant = Restaurant.query.options(*RESTAURANT_LOAD).populate_existing().get(id)
+        return make_response(restaurant_full(restaurant), 200)
+
+DEFAULT_RADIUS_KM = 5
+MAX_RADIUS_KM = 50
+
+class NearbyRestaurants(Resource):
+    # GET /restaurants/nearby?lat=&lon= (or ?address=) &radius_km=5&limit=50&cuisine=
+    def get(self):
+        if request.args.get('lat') or request.args.get('lon'):
+            try:
+                origin = float(request.args['lat']), float(request.args['lon'])
+            except (KeyError, ValueError):
+                return make_response({"error": "lat and lon must both be numbers"}, 422)
+            if not valid_coordinates(*origin):
+                return make_response({"error": "lat and lon are out of range"}, 422)
+        else:
+            origin = geocoder.geocode(request.args.get('address'))
+            if origin is None:
+                return make_response({"error": "Pass lat and lon, or an address"}, 422)
+        try:
+            radius_km = float(request.args.get('radius_km', DEFAULT_RADIUS_KM))
+        except ValueError:
+            radius_km = None
+        if radius_km is None or not 0 < radius_km <= MAX_RADIUS_KM:
+            return make_response({"error": f"radius_km must be between 0 and {MAX_RADIUS_KM}"}, 422)
+        limit = page_size(request.args.get('limit'))
+        if limit is None:
+            return make_response({"error": "limit must be a positive integer"}, 422)
+
+        geo_index.refresh()
+        hits = geo_index.nearby(*origin, radius_km, limit, request.args.get('cuisine') or None)
+        restaurants = {
+            restaurant.id: restaurant
+            for restaurant in Restaurant.query.filter(Restaurant.id.in_([restaurant_id for _, restaurant_id in hits]))
+        } if hits else {}
+        results = [
+            dict(restaurant_summary(restaurants[restaurant_id]), distance_km=round(distance, 3))
+            for distance, restaurant_id in hits if restaurant_id in restaurants
+        ]
+        return make_response({
+            'origin': {'latitude': origin[0], 'longitude': origin[1]},
+            'radius_km': radius_km,
+            'restaurants': results,
+        }, 200)
 
 class UserOrders(Resource):
     def get(self):
@@ -144,21 +522,33 @@ class UserOrders(Resource):
             return make_response({"error": "You are not logged in"}, 401)
         
         user_id = session['user_id']
-        orders = Order.query.filter_by(user_id=user_id).all()
-        
+        query = db.session.query(
+            Order.id, Order.status, Order.version, Order.total_price, Order.delivery_time, Order.delivery_address
+        ).filter(Order.user_id == user_id).order_by(Order.id)
+
+        fmt = stream_format()
+        if fmt:
+            if query.first() is None:
+                return make_response({"message": "No orders found for this user"}, 404)
+            return stream_response(fmt, {'user_id': user_id}, 'orders', query.yield_per(STREAM_BATCH_SIZE), self.order_dict)
+
+        orders = query.all()
         if not orders:
             return make_response({"message": "No orders found for this user"}, 404)
 
-        orders_list = [
-            {
-                'id': order.id,
-                'status': order.status,
-                'total_price': order.total_price,
-                'delivery_time': order.delivery_time,
-                'delivery_address': order.delivery_address
-            } for order in orders
-        ]
+        orders_list = [self.order_dict(order) for order in orders]
         return make_response({'user_id': user_id, 'orders': orders_list}, 200)
+
+    @staticmethod
+    def order_dict(order):
+        return {
+            'id': order.id,
+            'status': order.status,
+            'version': order.version,
+            'total_price': order.total_price,
+            'delivery_time': order.delivery_time,
+            'delivery_address': order.delivery_address
+        }
     
     @role_required('client')  # Ensure that only clients can place orders
     def post(self):
@@ -172,7 +562,10 @@ class UserOrders(Resource):
                 return make_response({"error": f"Missing required field: {field}"}, 422)
 
         total_price = data['total_price']
-        delivery_time = data['delivery_time']
+        try:
+            delivery_time = parse_delivery_time(data['delivery_time'])
+        except ValueError as e:
+            return make_response({"error": f"Invalid delivery_time: {e}"}, 422)
         delivery_address = data['delivery_address']
         restaurant_id = data['restaurant_id']
 
@@ -186,9 +579,62 @@ class UserOrders(Resource):
         )
 
         db.session.add(new_order)
+        db.session.flush()
+        record_orders([(new_order.restaurant_id, new_order.delivery_time, new_order.status, new_order.total_price)])
         db.session.commit()
+        order_events.order_event('order.created', new_order)
+
+        return make_response(order_full(new_order), 201)
+
+class UserOrdersBatch(Resource):
+    @role_required('client')
+    def post(self):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'orders' not in data:
+            return make_response({"error": "Missing required field: orders"}, 422)
+
+        try:
+            results, order_ids = place_orders(session['user_id'], data['orders'])
+        except BatchError as e:
+            return make_response({"error": str(e)}, 422)
 
-        return make_response(new_order.to_dict(), 201)
+        status = 201 if order_ids else 422
+        return make_response({'created': len(order_ids), 'results': results}, status)
+
+class OrderStatus(Resource):
+    # PATCH {"status": "Preparing", "version": 3}. version is optional; when given,
+    # the change only applies if nobody has touched the order since that version
+    def patch(self, order_id):
+        role = current_role()
+        if role is None:
+            return make_response({"error": "You are not logged in"}, 401)
+        if role not in ('client', 'restaurant_owner', 'admin'):
+            return make_response({"error": "Access forbidden: insufficient permissions"}, 403)
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('status'), str):
+            return make_response({"error": "Missing required field: status"}, 422)
+        version = data.get('version')
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+            return make_response({"error": "version must be an integer"}, 422)
+
+        # Clients can only cancel their own orders, owners and admins drive the kitchen flow
+        options = {'transitions': CLIENT_TRANSITIONS, 'user_id': session['user_id']} if role == 'client' else {}
+        try:
+            order = change_status(order_id, data['status'], version, **options)
+        except InvalidTransition as e:
+            return make_response({"error": str(e)}, 422)
+        except VersionConflict as e:
+            current = e.current
+            return make_response({
+                "error": str(e),
+                "status": current.status if current else None,
+                "version": current.version if current else None,
+            }, 409)
+        if order is None:
+            return make_response({"error": "Order not found"}, 404)
+
+        return make_response({key: order[key] for key in ('id', 'status', 'version')}, 200)
 
 class AdminResource(Resource):
     @role_required('admin')
@@ -197,10 +643,25 @@ class AdminResource(Resource):
         if not user:
             return make_response({"error": "User not found"}, 404)
 
+        # Their orders go with them, and out of the restaurants' rollups
+        forget_orders(Order.user_id == user_id)
         db.session.delete(user)
         db.session.commit()
+        role_cache.delete(f'role:{user_id}')
+        # Signs the user out everywhere rather than leaving live sessions for a deleted id
+        server_sessions.revoke_user(user_id)
         return make_response({}, 204)
 
+class AdminCache(Resource):
+    @role_required('admin')
+    def get(self):
+        return make_response(response_cache.info(), 200)
+
+class AdminPool(Resource):
+    @role_required('admin')
+    def get(self):
+        return make_response(pool_metrics.status(), 200)
+
 class MenuItemResource(Resource):
     @role_required('restaurant_owner')
     def patch(self, menu_item_id):
@@ -217,9 +678,12 @@ class MenuItemResource(Resource):
             menu_item.description = data['description']
         if 'image' in data:
             menu_item.image = data['image']
+        bump_restaurant_version(menu_item.restaurant_id)
 
         db.session.commit()
-        return make_response(menu_item.to_dict(), 200)
+        search_index.reindex_restaurant(menu_item.restaurant_id)
+        menu_item = Menu_item.query.options(*MENU_ITEM_LOAD).populate_existing().get(menu_item_id)
+        return make_response(menu_item_full(menu_item), 200)
 
     @role_required('restaurant_owner')
     def delete(self, menu_item_id):
@@ -227,16 +691,67 @@ class MenuItemResource(Resource):
         if not menu_item:
             return make_response({"error": "Menu item not found"}, 404)
 
+        restaurant_id = menu_item.restaurant_id
+        forget_order_lines(Order_Item.menu_item_id == menu_item_id)
         db.session.delete(menu_item)
+        bump_restaurant_version(restaurant_id)
         db.session.commit()
+        search_index.reindex_restaurant(restaurant_id)
         return make_response({}, 204)
 
 class RestaurantMenu(Resource):
     def get(self, restaurant_id):
-        restaurant = Restaurant.query.get(restaurant_id)  
+        return cached_response(restaurant_cache_key('menu', restaurant_id), lambda: self.menu(restaurant_id))
+
+    # PUT replaces the whole menu, PATCH only creates and updates the items it lists.
+    # Either takes a JSON array, a text/csv body or a CSV upload in the file field;
+    # ?dry_run=1 reports the changes without applying them
+    @role_required('restaurant_owner')
+    def put(self, restaurant_id):
+        return self.import_menu(restaurant_id, replace=True)
+
+    @role_required('restaurant_owner')
+    def patch(self, restaurant_id):
+        return self.import_menu(restaurant_id, replace=False)
+
+    def import_menu(self, restaurant_id, replace):
+        if not db.session.query(Restaurant.id).filter(Restaurant.id == restaurant_id).first():
+            return make_response({"error": "Restaurant not found"}, 404)
+        dry_run = request.args.get('dry_run', '').lower() in ('1', 'true')
+        try:
+            summary = import_menu(restaurant_id, self.upload(), replace, dry_run)
+        except MenuImportError as e:
+            return make_response({"error": str(e), "errors": e.errors}, 422)
+        if dry_run or not (summary['created'] or summary['updated'] or summary['deleted']):
+            return make_response(dict(summary, dry_run=dry_run), 200)
+
+        bump_restaurant_version(restaurant_id)
+        db.session.commit()
+        search_index.reindex_restaurant(restaurant_id)
+        return make_response(dict(summary, dry_run=False), 200)
+
+    @staticmethod
+    def upload():
+        upload = request.files.get('file')
+        if upload is None and request.mimetype != 'text/csv':
+            data = request.get_json(silent=True)
+            return data.get('menu_items') if isinstance(data, dict) else data
+        try:
+            text = upload.read().decode('utf-8') if upload is not None else request.get_data().decode('utf-8')
+        except UnicodeDecodeError:
+            raise MenuImportError("CSV must be UTF-8")
+        return parse_csv(text)
+
+    def menu(self, restaurant_id):
+        restaurant = db.session.query(
+            Restaurant.id, Restaurant.name, Restaurant.version, Restaurant.updated_at
+        ).filter(Restaurant.id == restaurant_id).first()
         if not restaurant:
-            return {'message': 'There is no menu for this restaurant yet'}, 404
+            return {'message': 'There is no menu for this restaurant yet'}, 404, {}
         
+        items = db.session.query(
+            Menu_item.id, Menu_item.name, Menu_item.description, Menu_item.price, Menu_item.image
+        ).filter(Menu_item.restaurant_id == restaurant_id).order_by(Menu_item.id)
         menu_items = [
             {
                 'id': item.id,
@@ -245,29 +760,31 @@ class RestaurantMenu(Resource):
                 'price': item.price,
                 'image': item.image
             }
-            for item in restaurant.menu_items
+            for item in items
         ]
         
-        return make_response({
+        return {
             'restaurant_id': restaurant.id,
             'restaurant_name': restaurant.name,
             'menu_items': menu_items
-        }, 200)
+        }, 200, restaurant_validators('menu', restaurant.id, restaurant.version, restaurant.updated_at)
 
 class RestaurantOrders(Resource):
     def get(self, restaurant_id):
-        restaurant = Restaurant.query.get(restaurant_id)
+        restaurant = db.session.query(Restaurant.id, Restaurant.name).filter(Restaurant.id == restaurant_id).first()
         if not restaurant:
             return {"message": "There is no order in the restaurant yet"}, 404
         
-        orders = [
-            {'id': order.id,
-             'status': order.status,
-             'delivery_time': order.delivery_time,
-             'deliver_address': order.delivery_address
-            }
-            for order in restaurant.orders 
-        ]
+        rows = db.session.query(
+            Order.id, Order.status, Order.version, Order.delivery_time, Order.delivery_address
+        ).filter(Order.restaurant_id == restaurant_id).order_by(Order.id)
+
+        fmt = stream_format()
+        if fmt:
+            envelope = {'restaurant_id': restaurant.id, 'restaurant_name': restaurant.name}
+            return stream_response(fmt, envelope, 'orders', rows.yield_per(STREAM_BATCH_SIZE), self.order_dict)
+
+        orders = [self.order_dict(order) for order in rows]
         
         return make_response(
             {
@@ -277,21 +794,133 @@ class RestaurantOrders(Resource):
             }, 200
         )
 
+    @staticmethod
+    def order_dict(order):
+        return {'id': order.id,
+                'status': order.status,
+                'version': order.version,
+                'delivery_time': order.delivery_time,
+                'deliver_address': order.delivery_address
+               }
+
+class RestaurantStats(Resource):
+    @role_required('restaurant_owner')
+    def get(self, restaurant_id):
+        if not db.session.query(Restaurant.id).filter(Restaurant.id == restaurant_id).first():
+            return make_response({"message": "Restaurant not found"}, 404)
+
+        start, end = default_window()
+        try:
+            if request.args.get('from'):
+                start = parse_day(request.args['from'])
+            if request.args.get('to'):
+                end = parse_day(request.args['to'])
+            top = int(request.args.get('top', 5))
+        except ValueError:
+            return make_response({"error": "from/to must be YYYY-MM-DD and top an integer"}, 422)
+        if start > end or not 1 <= top <= 50:
+            return make_response({"error": "Invalid window or top"}, 422)
+
+        return make_response(restaurant_stats(restaurant_id, start, end, top), 200)
+
+class Search(Resource):
+    def get(self):
+        query = request.args.get('q', '').strip()
+        if not query:
+            return make_response({"error": "Missing search query q"}, 422)
+        doc_type = request.args.get('type')
+        if doc_type not in (None, 'restaurant', 'menu_item'):
+            return make_response({"error": "type must be restaurant or menu_item"}, 422)
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        except ValueError:
+            return make_response({"error": "limit must be an integer"}, 422)
+
+        search_index.refresh()
+        return make_response({'query': query, 'results': search_index.search(query, limit, doc_type)}, 200)
+
+# Pushes order.created events (and status changes) to the logged in client, and to
+# owners or admins for each ?restaurant_id=, so they can stop polling the order lists
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+class Events(Resource):
+    def get(self):
+        role = current_role() if request.args.get('restaurant_id') else None
+        subscription, error = self.subscription(session.get('user_id'), role, request)
+        if error:
+            return make_response(*error)
+        # Nothing in the stream touches the database, the session is released on return
+        return Response(order_events.stream(*subscription), 200, mimetype='text/event-stream',
+                        headers=EVENT_STREAM_HEADERS)
+
+    @staticmethod
+    def subscription(user_id, role, request):
+        # Returns ((channels, after_id), None) or (None, (body, status))
+        if user_id is None:
+            return None, ({"error": "You are not logged in"}, 401)
+        channels = {f'user:{user_id}'}
+        restaurant_ids = request.args.getlist('restaurant_id')
+        if restaurant_ids:
+            if role not in ('restaurant_owner', 'admin'):
+                return None, ({"error": "Access forbidden: insufficient permissions"}, 403)
+            if not all(restaurant_id.isdigit() for restaurant_id in restaurant_ids):
+                return None, ({"error": "restaurant_id must be an integer"}, 422)
+            channels.update(f'restaurant:{int(restaurant_id)}' for restaurant_id in restaurant_ids)
+
+        # EventSource sends Last-Event-ID on reconnect, ?last_event_id= resumes a fresh connection
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if not last_event_id:
+            return (channels, order_events.log.latest_id()), None
+        if not last_event_id.isdigit():
+            return None, ({"error": "Last-Event-ID must be an event id"}, 422)
+        return (channels, int(last_event_id)), None
+
+    @staticmethod
+    def poll_timeout(request):
+        try:
+            return min(max(float(request.args.get('timeout', order_events.poll_seconds)), 0), order_events.poll_seconds)
+        except ValueError:
+            return None
+
+class EventsPoll(Resource):
+    def get(self):
+        role = current_role() if request.args.get('restaurant_id') else None
+        subscription, error = Events.subscription(session.get('user_id'), role, request)
+        if error:
+            return make_response(*error)
+        timeout = Events.poll_timeout(request)
+        if timeout is None:
+            return make_response({"error": "timeout must be a number of seconds"}, 422)
+        # Don't hold a pooled connection while waiting
+        db.session.close()
+        events, last_event_id, reset = order_events.poll(*subscription, timeout)
+        return make_response({'events': events, 'last_event_id': last_event_id, 'reset': reset}, 200)
+
 class ClearSession(Resource):
     def delete(self):
-        session['user_id'] = None
-        return {}, 204 
+        # Emptied, the session is dropped rather than stored again with a null user
+        session.clear()
+        return {}, 204
 
 api.add_resource(MenuItemResource, '/menu/item/<int:menu_item_id>')#Restaurant_owner
 api.add_resource(UserOrders, '/user/orders')
+api.add_resource(UserOrdersBatch, '/user/orders/batch')
+api.add_resource(OrderStatus, '/orders/<int:order_id>')
 api.add_resource(AdminResource, '/admin/user/<int:user_id>')#Admin
+api.add_resource(AdminCache, '/admin/cache')#Admin
+api.add_resource(AdminPool, '/admin/pool')#Admin
 api.add_resource(RestaurantMenu, '/restaurant/<int:restaurant_id>/menu')    
 api.add_resource(RestaurantOrders, '/restaurant/<int:restaurant_id>/order')    
+api.add_resource(RestaurantStats, '/restaurant/<int:restaurant_id>/stats')#Restaurant_owner
 api.add_resource(RestaurantResource, '/restaurants', '/restaurants/<int:id>')
+api.add_resource(NearbyRestaurants, '/restaurants/nearby')
 api.add_resource(Logout, "/logout", endpoint="logout")   
 api.add_resource(Login, "/login", endpoint="login")
 api.add_resource(CheckSession, "/check_session", endpoint="check_session")
 api.add_resource(Signup, '/signup')
+api.add_resource(Search, '/search')
+api.add_resource(Events, '/events')
+api.add_resource(EventsPoll, '/events/poll')
 api.add_resource(Running_Test, '/')
 api.add_resource(ClearSession, '/clear_session')
 
@@ -0,0 +1,405 @@
+# ASGI entry point, served with: uvicorn asgi:application --workers 4
+# The read endpoints below run as coroutines on SQLAlchemy's asyncio engine, so a
+# request waiting on the database or on a slow client parks on the event loop
+# instead of holding a thread, and one worker can keep thousands of connections
+# open. Every other route, and streamed order histories, is passed to the Flask
+# app through asgiref's WSGI adapter, which runs it on a thread pool. The async
+# handlers share the response cache, ETags, sessions, replica routing and JSON
+# encoding with the Flask app, so both modes give the same answers. The order
+# event stream and long-poll are served here too, parked on the event loop
+# instead of each holding a thread for minutes.
+# Needs aiosqlite for SQLite or asyncpg for PostgreSQL.
+import asyncio
+import re
+import signal
+import time
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.http import is_resource_modified, unquote_etag
+from app import (app, decode_cursor, encode_cursor, page_size, restaurant_validators, role_cache,
+                 EVENT_STREAM_HEADERS, EXPOSE_HEADERS, Events, RestaurantOrders, UserOrders)
+from cache import response_cache
+from encoding import compressor
+from events import order_events
+from ratelimit import rate_limiter
+from models import Menu_item, Order, Restaurant, User
+from replicas import replica_router
+from serializers import restaurant_summary
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+def async_url(uri):
+    scheme, rest = uri.split('://', 1)
+    driver = ASYNC_DRIVERS.get(scheme.split('+', 1)[0])
+    if driver is None:
+        raise ValueError(f'No asyncio driver known for {scheme}')
+    return f'{driver}://{rest}'
+
+def async_engine_options(options):
+    # Same pool settings on the asyncio flavour of QueuePool
+    options = dict(options)
+    if 'poolclass' in options:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    connect_args = options.pop('connect_args', {})
+    if 'options' in connect_args:
+        # asyncpg takes server settings rather than libpq's -c options
+        settings = dict(part[3:].split('=', 1) for part in connect_args['options'].split(' -c ') if part)
+        options['connect_args'] = {'server_settings': settings}
+    return options
+
+class AsyncDatabase:
+    def __init__(self):
+        self.sessions = {}
+        self.engines = {}
+
+    def start(self):
+        options = async_engine_options(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        uris = {None: app.config['SQLALCHEMY_DATABASE_URI']}
+        uris.update({key: app.config['SQLALCHEMY_BINDS'][key] for key in replica_router.keys})
+        for key, uri in uris.items():
+            self.engines[key] = create_async_engine(async_url(uri), **options)
+            self.sessions[key] = async_sessionmaker(self.engines[key], expire_on_commit=False)
+
+    async def stop(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+        self.engines.clear()
+        self.sessions.clear()
+
+    def session(self, request, read_only=True):
+        # Same rules as RoutingSession: reads go to a replica unless this client wrote recently
+        if not self.engines:
+            self.start()
+        key = None
+        if read_only and replica_router.keys:
+            wrote_at = request.session.get('wrote_at')
+            if wrote_at is None or time.time() - wrote_at >= replica_router.window:
+                key = replica_router.choose(self.engines)
+        return self.sessions[key]()
+
+database = AsyncDatabase()
+
+def build_environ(scope):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+class Request:
+    def __init__(self, scope):
+        self.environ = build_environ(scope)
+        self.flask_request = app.request_class(self.environ)
+        self.args = self.flask_request.args
+        self._session = None
+
+    @property
+    def session(self):
+        # Loaded through the app's own session interface, only when a handler needs it
+        if self._session is None:
+            with app.app_context():
+                self._session = app.session_interface.open_session(app, self.flask_request) or {}
+        return self._session
+
+    def wants_stream(self):
+        accept = self.flask_request.accept_mimetypes
+        if accept.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+            return True
+        return self.args.get('stream', '').lower() in ('1', 'true')
+
+def json_response(request, body, status=200, headers=None):
+    with app.app_context():
+        response = app.json.response(body)
+    response.status_code = status
+    return finish(request, response, headers)
+
+def finish(request, response, headers=None):
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    # Same headers flask-cors adds for the Flask routes
+    origin = request.environ.get('HTTP_ORIGIN')
+    if origin:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Expose-Headers'] = ', '.join(EXPOSE_HEADERS)
+        response.headers.add('Vary', 'Origin')
+    # Gzipped on the same terms as the Flask routes' responses
+    return compressor.compress(response, request.flask_request.accept_encodings)
+
+async def cached_response(request, key, build):
+    # Cache fills read the primary, as in app.cached_response
+    entry = response_cache.get(key)
+    if entry is None:
+        async with database.session(request, read_only=False) as session:
+            entry = await build(session)
+        response_cache.set(key, entry)
+    body, status, headers = entry
+    if status == 200 and 'ETag' in headers:
+        etag, _ = unquote_etag(headers['ETag'])
+        if not is_resource_modified(request.environ, etag=etag, last_modified=headers.get('Last-Modified')):
+            return finish(request, app.response_class(status=304), headers)
+    return json_response(request, body, status, headers)
+
+async def restaurant_cache_key(request, kind, restaurant_id):
+    # Versioned like app.restaurant_cache_key, the version read from the primary
+    async with database.session(request, read_only=False) as session:
+        version = await session.scalar(select(Restaurant.version).where(Restaurant.id == restaurant_id))
+    return f'{kind}:{restaurant_id}:v{version}'
+
+# Handlers return a response, or None to let the Flask app answer instead
+
+async def restaurants_list(request):
+    limit = page_size(request.args.get('limit'))
+    if limit is None:
+        return json_response(request, {"error": "limit must be a positive integer"}, 422)
+    after_id = None
+    if request.args.get('cursor'):
+        after_id = decode_cursor(request.args['cursor'])
+        if after_id is None:
+            return json_response(request, {"error": "Invalid cursor"}, 422)
+    cuisine = request.args.get('cuisine') or None
+    rating = request.args.get('rating') or None
+
+    async def build(session):
+        stmt = select(Restaurant)
+        if cuisine:
+            stmt = stmt.where(Restaurant.cuisine == cuisine)
+        if rating:
+            stmt = stmt.where(Restaurant.rating == rating)
+        if after_id is not None:
+            stmt = stmt.where(Restaurant.id > after_id)
+        page = (await session.scalars(stmt.order_by(Restaurant.id).limit(limit + 1))).all()
+        has_more = len(page) > limit
+        page = page[:limit]
+        headers = {'X-Next-Cursor': encode_cursor(page[-1].id)} if has_more else {}
+        return restaurant_summary.many(page), 200, headers
+
+    key = f"{response_cache.namespace('restaurants')}:{limit}:{after_id}:{cuisine}:{rating}"
+    return await cached_response(request, key, build)
+
+async def restaurant_detail(request, restaurant_id):
+    async def build(session):
+        restaurant = await session.get(Restaurant, restaurant_id)
+        if not restaurant:
+            return {"message": "Restaurant not found"}, 404, {}
+        headers = restaurant_validators('restaurant', restaurant.id, restaurant.version, restaurant.updated_at)
+        return restaurant_summary(restaurant), 200, headers
+
+    return await cached_response(request, await restaurant_cache_key(request, 'restaurant', restaurant_id), build)
+
+async def restaurant_menu(request, restaurant_id):
+    async def build(session):
+        restaurant = (await session.execute(
+            select(Restaurant.id, Restaurant.name, Restaurant.version, Restaurant.updated_at)
+            .where(Restaurant.id == restaurant_id)
+        )).first()
+        if not restaurant:
+            return {'message': 'There is no menu for this restaurant yet'}, 404, {}
+        items = await session.execute(
+            select(Menu_item.id, Menu_item.name, Menu_item.description, Menu_item.price, Menu_item.image)
+            .where(Menu_item.restaurant_id == restaurant_id).order_by(Menu_item.id)
+        )
+        return {
+            'restaurant_id': restaurant.id,
+            'restaurant_name': restaurant.name,
+            'menu_items': [dict(item._mapping) for item in items],
+        }, 200, restaurant_validators('menu', restaurant.id, restaurant.version, restaurant.updated_at)
+
+    return await cached_response(request, await restaurant_cache_key(request, 'menu', restaurant_id), build)
+
+async def restaurant_orders(request, restaurant_id):
+    if request.wants_stream():
+        return None
+    async with database.session(request) as session:
+        restaurant = (await session.execute(
+            select(Restaurant.id, Restaurant.name).where(Restaurant.id == restaurant_id)
+        )).first()
+        if not restaurant:
+            return json_response(request, {"message": "There is no order in the restaurant yet"}, 404)
+        rows = await session.execute(
+            select(Order.id, Order.status, Order.version, Order.delivery_time, Order.delivery_address)
+            .where(Order.restaurant_id == restaurant_id).order_by(Order.id)
+        )
+        orders = [RestaurantOrders.order_dict(order) for order in rows]
+    return json_response(request, {
+        'restaurant_id': restaurant.id,
+        'restaurant_name': restaurant.name,
+        'orders': orders,
+    })
+
+async def user_orders(request):
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        return json_response(request, {"error": "You are not logged in"}, 401)
+    if request.wants_stream():
+        return None
+    async with database.session(request) as session:
+        rows = (await session.execute(
+            select(Order.id, Order.status, Order.version, Order.total_price, Order.delivery_time, Order.delivery_address)
+            .where(Order.user_id == user_id).order_by(Order.id)
+        )).all()
+    if not rows:
+        return json_response(request, {"message": "No orders found for this user"}, 404)
+    return json_response(request, {'user_id': user_id, 'orders': [UserOrders.order_dict(order) for order in rows]})
+
+async def user_role(request, user_id):
+    role = role_cache.get(f'role:{user_id}') if app.config['ROLE_CACHE_TTL'] else None
+    if role is None:
+        async with database.session(request) as session:
+            role = await session.scalar(select(User.role).where(User.id == user_id))
+        if role is not None and app.config['ROLE_CACHE_TTL']:
+            role_cache.set(f'role:{user_id}', role, app.config['ROLE_CACHE_TTL'])
+    return role
+
+async def event_subscription(request):
+    user_id = request.session.get('user_id')
+    role = await user_role(request, user_id) if user_id is not None and request.args.get('restaurant_id') else None
+    return Events.subscription(user_id, role, request.flask_request)
+
+async def events_stream(request):
+    subscription, error = await event_subscription(request)
+    if error:
+        return json_response(request, *error)
+    response = finish(request, app.response_class(status=200, mimetype='text/event-stream'), EVENT_STREAM_HEADERS)
+    return StreamingResponse(response, order_events.astream(*subscription))
+
+async def events_poll(request):
+    subscription, error = await event_subscription(request)
+    if error:
+        return json_response(request, *error)
+    timeout = Events.poll_timeout(request.flask_request)
+    if timeout is None:
+        return json_response(request, {"error": "timeout must be a number of seconds"}, 422)
+    events, last_event_id, reset = await order_events.apoll(*subscription, timeout)
+    return json_response(request, {'events': events, 'last_event_id': last_event_id, 'reset': reset})
+
+class StreamingResponse:
+    # Headers from a Flask response, body from an async iterator of str chunks
+    def __init__(self, response, chunks):
+        self.response = response
+        self.chunks = chunks
+
+# Pattern, handler and the Flask endpoint it stands in for, which sets its rate limit cost
+ROUTES = [
+    (re.compile(r'/restaurants'), restaurants_list, 'restaurantresource'),
+    (re.compile(r'/restaurants/(\d+)'), restaurant_detail, 'restaurantresource'),
+    (re.compile(r'/restaurant/(\d+)/menu'), restaurant_menu, 'restaurantmenu'),
+    (re.compile(r'/restaurant/(\d+)/order'), restaurant_orders, 'restaurantorders'),
+    (re.compile(r'/user/orders'), user_orders, 'userorders'),
+    (re.compile(r'/events'), events_stream, 'events'),
+    (re.compile(r'/events/poll'), events_poll, 'eventspoll'),
+]
+
+def rate_limited(request, endpoint):
+    if not rate_limiter.enabled:
+        return None
+    wait = rate_limiter.admit(request.session.get('user_id'), request.environ.get('REMOTE_ADDR'), 'GET', endpoint)
+    if wait is None:
+        return None
+    return json_response(request, {"error": "Too many requests, slow down"}, 429,
+                         {'Retry-After': rate_limiter.retry_after(wait)})
+
+class Application:
+    def __init__(self, flask_app):
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, handler, endpoint in ROUTES:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    request = Request(scope)
+                    response = rate_limited(request, endpoint)
+                    if response is None:
+                        response = await handler(request, *(int(group) for group in match.groups()))
+                    if isinstance(response, StreamingResponse):
+                        return await self.stream(response, receive, send)
+                    if response is not None:
+                        return await self.send(response, send)
+                    break
+        await self.wsgi(scope, receive, send)
+
+    async def send(self, response, send):
+        await self.start(response, send)
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def start(self, response, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+
+    async def stream(self, streaming, receive, send):
+        # Sends chunks as they come until the iterator ends or the client goes away
+        await self.start(streaming.response, send)
+
+        async def pump():
+            async for chunk in streaming.chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await streaming.chunks.aclose()
+        if tasks[0] in done:
+            tasks[0].result()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                database.start()
+                self.close_streams_on_exit()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                order_events.close()
+                await database.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def close_streams_on_exit():
+        # The server waits for open connections to finish before it sends
+        # lifespan.shutdown, and an event stream lasts EVENTS_STREAM_SECONDS.
+        # Its exit signal handler is wrapped so the streams end first
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handler = signal.getsignal(signum)
+            if callable(handler):
+                def close_then(signum, frame, handler=handler):
+                    order_events.close()
+                    handler(signum, frame)
+                signal.signal(signum, close_then)
+
+application = Application(app)
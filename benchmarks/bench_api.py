@@ -0,0 +1,370 @@
+# End-to-end benchmark over the API routes.
+# Seeds a throwaway database with seed.py's generator, then drives every route
+# in-process through the Flask test client (which also counts SQL statements per
+# request) or over HTTP against a local gunicorn. Results are written as JSON and
+# can be compared with an earlier run to catch regressions:
+#   python -m benchmarks.bench_api --orders 20000 --output before.json
+#   python -m benchmarks.bench_api --orders 20000 --output after.json --compare before.json
+#   python -m benchmarks.bench_api --server gunicorn --gunicorn-workers 4 --concurrency 8
+# DELETE routes are left out, they would eat the dataset the other routes read.
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+DEFAULT_THRESHOLD = 20.0
+
+def parse_args(argv=None):
+    from seed import parse_count
+
+    parser = argparse.ArgumentParser(description='Benchmark every API route')
+    parser.add_argument('--server', choices=['inprocess', 'gunicorn'], default='inprocess')
+    parser.add_argument('--users', type=parse_count, default=1000)
+    parser.add_argument('--restaurants', type=parse_count, default=200)
+    parser.add_argument('--menu-items', type=parse_count, default=4000)
+    parser.add_argument('--orders', type=parse_count, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--auth-requests', type=int, default=20, help='timed requests for /login and /signup')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads, gunicorn only')
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--routes', help='comma separated substrings, only matching routes run')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='earlier results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed p95 growth in percent before a route counts as regressed')
+    return parser.parse_args(argv)
+
+# Route definitions: (name, method, role, auth, build) where build(ctx, i) gives
+# the path and JSON body of the i-th request
+def restaurant_id(ctx, i):
+    return ctx['restaurant_ids'][i % len(ctx['restaurant_ids'])]
+
+def new_order(ctx, i):
+    rid = ctx['order_restaurant']
+    return {
+        'restaurant_id': rid,
+        'total_price': 25,
+        'delivery_time': (datetime.utcnow() + timedelta(hours=1)).isoformat(),
+        'delivery_address': 'Benchmark Street 1',
+        'items': [{'menu_item_id': ctx['order_item'], 'quantity': 1 + i % 3}],
+    }
+
+ROUTES = [
+    ('GET /', 'GET', None, False, lambda ctx, i: ('/', None)),
+    ('GET /restaurants', 'GET', None, False,
+     lambda ctx, i: ('/restaurants?limit=50', None)),
+    ('GET /restaurants/<id>', 'GET', None, False,
+     lambda ctx, i: (f'/restaurants/{restaurant_id(ctx, i)}', None)),
+    ('GET /restaurants/nearby', 'GET', None, False,
+     lambda ctx, i: (f"/restaurants/nearby?lat={ctx['geo_center'][0] + (i % 50 - 25) / 500}"
+                     f"&lon={ctx['geo_center'][1] + (i % 40 - 20) / 500}&radius_km=3&limit=20", None)),
+    ('GET /restaurant/<id>/menu', 'GET', None, False,
+     lambda ctx, i: (f'/restaurant/{restaurant_id(ctx, i)}/menu', None)),
+    ('GET /restaurant/<id>/order', 'GET', None, False,
+     lambda ctx, i: (f'/restaurant/{restaurant_id(ctx, i)}/order', None)),
+    ('GET /restaurant/<id>/stats', 'GET', 'restaurant_owner', False,
+     lambda ctx, i: (f'/restaurant/{restaurant_id(ctx, i)}/stats', None)),
+    ('GET /search', 'GET', None, False,
+     lambda ctx, i: (f"/search?q={ctx['search_terms'][i % len(ctx['search_terms'])]}", None)),
+    ('GET /check_session', 'GET', 'client', False, lambda ctx, i: ('/check_session', None)),
+    ('GET /user/orders', 'GET', 'client', False, lambda ctx, i: ('/user/orders', None)),
+    ('POST /user/orders', 'POST', 'client', False, lambda ctx, i: ('/user/orders', new_order(ctx, i))),
+    ('POST /user/orders/batch', 'POST', 'client', False,
+     lambda ctx, i: ('/user/orders/batch', {'orders': [new_order(ctx, i + n) for n in range(10)]})),
+    ('PATCH /restaurants/<id>', 'PATCH', 'restaurant_owner', False,
+     lambda ctx, i: (f'/restaurants/{restaurant_id(ctx, i)}', {'rating': str(1 + i % 5)})),
+    # Each Pending order moves to Preparing once, the route needs as many Pending orders as requests
+    ('PATCH /orders/<id>', 'PATCH', 'restaurant_owner', False,
+     lambda ctx, i: (f"/orders/{ctx['pending_order_ids'][i % len(ctx['pending_order_ids'])]}",
+                     {'status': 'Preparing'})),
+    ('PATCH /restaurant/<id>/menu', 'PATCH', 'restaurant_owner', False,
+     lambda ctx, i: (f'/restaurant/{restaurant_id(ctx, i)}/menu',
+                     [{'name': f"bench {ctx['run']} {i} {n}", 'price': 5 + n, 'image': 'bench.jpg'} for n in range(20)])),
+    ('PATCH /menu/item/<id>', 'PATCH', 'restaurant_owner', False,
+     lambda ctx, i: (f"/menu/item/{ctx['menu_item_ids'][i % len(ctx['menu_item_ids'])]}", {'price': 5 + i % 40})),
+    ('POST /login', 'POST', None, True,
+     lambda ctx, i: ('/login', {'email': ctx['emails']['client'], 'password': ctx['password']})),
+    ('POST /signup', 'POST', None, True,
+     lambda ctx, i: ('/signup', {'name': 'Bench', 'email': f"bench-{ctx['run']}-{i}@example.com",
+                                 'password': ctx['password'], 'role': 'client'})),
+]
+
+def percentile(ordered, p):
+    # Nearest rank
+    if not ordered:
+        return None
+    return ordered[max(int(round(p / 100 * len(ordered))) - 1, 0)]
+
+def summarize(latencies, statuses, queries, elapsed):
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(ordered), 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 50), 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 95), 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 99), 3) if ordered else None,
+        'queries_per_request': round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+class InProcessClient:
+    # Flask test client, one per role so each keeps its own session cookie
+    def __init__(self, app, engine):
+        self.app = app
+        self.engine = engine
+        self.clients = {}
+
+    def session(self, role):
+        if role not in self.clients:
+            self.clients[role] = self.app.test_client()
+        return self.clients[role]
+
+    def request(self, role, method, path, body):
+        from query_budget import count_queries
+
+        client = self.session(role)
+        with count_queries(self.engine) as counter:
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+        return response.status_code, elapsed, counter.count
+
+class HttpClient:
+    # urllib against a running server, SQL runs in another process so queries are not counted
+    def __init__(self, base):
+        self.base = base
+        self.openers = {}
+
+    def session(self, role):
+        if role not in self.openers:
+            self.openers[role] = urllib.request.build_opener(
+                urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        return self.openers[role]
+
+    def request(self, role, method, path, body):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with self.session(role).open(req) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        return status, time.perf_counter() - start, None
+
+def run_route(client, ctx, route, count, warmup, concurrency):
+    name, method, role, _, build = route
+    for i in range(warmup):
+        client.request(role, method, *build(ctx, -1 - i))
+
+    latencies, queries, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def worker(indexes):
+        for i in indexes:
+            status, elapsed, query_count = client.request(role, method, *build(ctx, i))
+            with lock:
+                latencies.append(elapsed * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+                if query_count is not None:
+                    queries.append(query_count)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(worker, [range(n, count, concurrency) for n in range(concurrency)]))
+    else:
+        worker(range(count))
+    return summarize(latencies, statuses, queries, time.perf_counter() - start)
+
+def seed_dataset(app, args):
+    from models import db, Menu_item, Order, Restaurant, User
+    from seed import seed_database
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_database(args.users, args.restaurants, args.menu_items, args.orders,
+                      max_items=3, seed=42, chunk_size=10000, workers=None, password='password')
+
+        # The busiest client and the owner used for the authenticated routes
+        client_id = db.session.query(Order.user_id).join(User, User.id == Order.user_id) \
+            .filter(User.role == 'client').limit(1).scalar()
+        owner = User.query.filter_by(role='restaurant_owner').first()
+        if client_id is None or owner is None:
+            raise SystemExit('The dataset needs at least one client with orders and one restaurant owner')
+        order_item = Menu_item.query.filter(Menu_item.restaurant_id.isnot(None)).first()
+        return {
+            'run': int(time.time()),
+            'password': 'password',
+            'emails': {'client': db.session.get(User, client_id).email, 'restaurant_owner': owner.email},
+            'restaurant_ids': [row.id for row in db.session.query(Restaurant.id).order_by(Restaurant.id).limit(500)],
+            'menu_item_ids': [row.id for row in db.session.query(Menu_item.id).order_by(Menu_item.id).limit(500)],
+            'search_terms': [name[:4] for name, in db.session.query(Menu_item.name).limit(50) if name],
+            'pending_order_ids': [row.id for row in db.session.query(Order.id).filter(Order.status == 'Pending')
+                                  .order_by(Order.id).limit(10000)],
+            'geo_center': app.config['GEOCODER_CENTER'],
+            'order_restaurant': order_item.restaurant_id,
+            'order_item': order_item.id,
+        }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(workers):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('gunicorn exited during startup, is it installed? (pip install gunicorn)')
+        try:
+            urllib.request.urlopen(base + '/').read()
+            return process, base
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn did not start within 30 s')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current, threshold):
+    regressions = []
+    for name, now in current['routes'].items():
+        before = previous.get('routes', {}).get(name)
+        if not before:
+            continue
+        if before.get('p95_ms') and now.get('p95_ms'):
+            growth = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+            if growth > threshold:
+                regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {now['p95_ms']} ms (+{growth:.0f}%)")
+        if before.get('queries_per_request') is not None and now.get('queries_per_request') is not None:
+            if now['queries_per_request'] > before['queries_per_request']:
+                regressions.append(f"{name}: {before['queries_per_request']} -> {now['queries_per_request']} queries per request")
+        if now['errors'] > before.get('errors', 0):
+            regressions.append(f"{name}: {before.get('errors', 0)} -> {now['errors']} errors")
+    return regressions
+
+def print_table(results):
+    print(f"{'route':32} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>6} {'errors':>6}")
+    for name, row in results['routes'].items():
+        queries = row['queries_per_request']
+        print(f"{name:32} {row['rps'] or 0:8.1f} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f} "
+              f"{'-' if queries is None else queries:>6} {row['errors']:6}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault('DATABASE_URI', f'sqlite:///{tempfile.mkdtemp()}/bench_api.db')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # One client drives every request, the limiter would turn most of them away
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    if args.no_cache:
+        os.environ['RESPONSE_CACHE_ENABLED'] = '0'
+
+    from app import app
+    from models import db
+    from hashing import password_hasher
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    started = time.perf_counter()
+    ctx = seed_dataset(app, args)
+    print(f'seeded in {time.perf_counter() - started:.1f} s')
+
+    process = None
+    if args.server == 'gunicorn':
+        process, base = start_gunicorn(args.gunicorn_workers)
+        client = HttpClient(base)
+        concurrency = args.concurrency
+    else:
+        with app.app_context():
+            client = InProcessClient(app, db.engine)
+        concurrency = 1
+
+    routes = ROUTES
+    if args.routes:
+        wanted = args.routes.split(',')
+        routes = [route for route in ROUTES if any(part in route[0] for part in wanted)]
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'server': args.server,
+            'gunicorn_workers': args.gunicorn_workers if args.server == 'gunicorn' else None,
+            'concurrency': concurrency,
+            'python': platform.python_version(),
+            'database': os.environ['DATABASE_URI'].split(':', 1)[0],
+            'response_cache': not args.no_cache,
+            'dataset': {'users': args.users, 'restaurants': args.restaurants,
+                        'menu_items': args.menu_items, 'orders': args.orders},
+        },
+        'routes': {},
+    }
+    try:
+        for role in ('client', 'restaurant_owner'):
+            status, _, _ = client.request(role, 'POST', '/login',
+                                          {'email': ctx['emails'][role], 'password': ctx['password']})
+            if status != 201:
+                raise SystemExit(f'Could not log in as {role}: {status}')
+        for route in routes:
+            count = args.auth_requests if route[3] else args.requests
+            results['routes'][route[0]] = run_route(client, ctx, route, count, args.warmup, concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        password_hasher.shutdown()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print('regressions against', args.compare)
+            for line in regressions:
+                print('  ' + line)
+            return 1
+        print('no regressions against', args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
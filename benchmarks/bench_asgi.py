@@ -0,0 +1,189 @@
+# Concurrency benchmark: gunicorn sync workers against the ASGI entry point.
+# Seeds a throwaway database, then for each server drives GET /restaurant/<id>/order
+# with an increasing number of concurrent clients, and finally measures a probe
+# client while --slow-clients connections trickle their request headers in,
+# which is what ties up sync workers:
+#   python -m benchmarks.bench_asgi --workers 2 --levels 10,100,1000 --slow-clients 500
+# Client and servers share the host, so compare the two modes, not absolute numbers.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from benchmarks.bench_api import free_port, git_commit, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Compare sync and ASGI serving under concurrency')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn sync worker')
+    parser.add_argument('--levels', default='1,10,100,500', help='comma separated client counts')
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each level')
+    parser.add_argument('--timeout', type=float, default=5.0, help='per request timeout')
+    parser.add_argument('--slow-clients', type=int, default=200)
+    parser.add_argument('--restaurants', type=int, default=100)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--servers', default='sync,asgi')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    return parser.parse_args(argv)
+
+def server_command(kind, port, args):
+    if kind == 'sync':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(args.workers), '--log-level', 'warning', '--no-access-log']
+
+def start_server(kind, args):
+    port = free_port()
+    process = subprocess.Popen(server_command(kind, port, args), cwd=ROOT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{kind} server exited during startup')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/').read()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'{kind} server did not start within 30 s')
+
+async def fetch(port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode())
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+async def drive(port, clients, seconds, timeout, restaurants):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(n):
+        nonlocal errors
+        i = n
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await fetch(port, f'/restaurant/{1 + i % restaurants}/order', timeout)
+                if status >= 500:
+                    errors += 1
+                else:
+                    latencies.append((time.perf_counter() - started) * 1000)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                errors += 1
+            i += clients
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+async def trickle(port, stop):
+    # A slow client: sends its headers one line per second and never finishes
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return False
+    try:
+        writer.write(b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+        line = 0
+        while not stop.is_set():
+            writer.write(f'X-Slow-{line}: 1\r\n'.encode())
+            await writer.drain()
+            line += 1
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+    except OSError:
+        pass
+    finally:
+        writer.close()
+    return True
+
+async def slow_client_probe(port, slow_clients, seconds, timeout, restaurants):
+    stop = asyncio.Event()
+    holders = [asyncio.create_task(trickle(port, stop)) for _ in range(slow_clients)]
+    await asyncio.sleep(1)
+    result = await drive(port, 10, seconds, timeout, restaurants)
+    stop.set()
+    connected = sum(await asyncio.gather(*holders))
+    result['slow_clients_connected'] = connected
+    return result
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'ok': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 1),
+        'p50_ms': round(percentile(ordered, 50), 2) if ordered else None,
+        'p99_ms': round(percentile(ordered, 99), 2) if ordered else None,
+        'mean_ms': round(statistics.fmean(ordered), 2) if ordered else None,
+    }
+
+def seed(args):
+    from app import app
+    from models import db
+    from seed import seed_database
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_database(max(args.restaurants, 100), args.restaurants, args.restaurants * 10, args.orders,
+                      max_items=3, seed=42, chunk_size=10000, workers=None, password='password')
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault('DATABASE_URI', f'sqlite:///{tempfile.mkdtemp()}/bench_asgi.db')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # One client drives every request, the limiter would turn most of them away
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    seed(args)
+
+    levels = [int(level) for level in args.levels.split(',')]
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'workers': args.workers,
+            'threads': args.threads,
+            'seconds': args.seconds,
+            'timeout_s': args.timeout,
+            'database': os.environ['DATABASE_URI'].split(':', 1)[0],
+        },
+        'servers': {},
+    }
+    for kind in args.servers.split(','):
+        process, port = start_server(kind, args)
+        try:
+            server = results['servers'][kind] = {'levels': {}}
+            for level in levels:
+                row = asyncio.run(drive(port, level, args.seconds, args.timeout, args.restaurants))
+                server['levels'][str(level)] = row
+                print(f'{kind:5} {level:6} clients  {row}')
+            if args.slow_clients:
+                row = asyncio.run(slow_client_probe(port, args.slow_clients, args.seconds, args.timeout,
+                                                    args.restaurants))
+                server['slow_clients'] = dict(row, count=args.slow_clients)
+                print(f'{kind:5} probe with {args.slow_clients} slow clients  {row}')
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'results written to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Bytes on the wire and encode CPU per endpoint for the JSON modes in encoding.py.
+# Seeds a throwaway database like bench_api, records the object each endpoint
+# hands to the JSON provider, then encodes it the old way (stdlib, indented) and
+# the new ways (compact stdlib, compact orjson, compact orjson then gzip):
+#   python -m benchmarks.bench_json --orders 20000 --rounds 200
+import argparse
+import gzip
+import os
+import tempfile
+import time
+
+def parse_args(argv=None):
+    from seed import parse_count
+
+    parser = argparse.ArgumentParser(description='Compare JSON encoding and compression per endpoint')
+    parser.add_argument('--users', type=parse_count, default=1000)
+    parser.add_argument('--restaurants', type=parse_count, default=200)
+    parser.add_argument('--menu-items', type=parse_count, default=4000)
+    parser.add_argument('--orders', type=parse_count, default=10000)
+    parser.add_argument('--rounds', type=int, default=100, help='encodes timed per endpoint and mode')
+    return parser.parse_args(argv)
+
+def endpoints(ctx):
+    restaurant_id = ctx['restaurant_ids'][0]
+    return [
+        ('GET /restaurants', None, '/restaurants?limit=200'),
+        ('GET /restaurants/<id>', None, f'/restaurants/{restaurant_id}'),
+        ('GET /restaurant/<id>/menu', None, f'/restaurant/{restaurant_id}/menu'),
+        ('GET /search', None, f'/search?q={ctx["search_terms"][0]}'),
+        ('GET /user/orders', 'client', '/user/orders'),
+        ('GET /restaurant/<id>/order', 'restaurant_owner', f'/restaurant/{ctx["order_restaurant"]}/order'),
+    ]
+
+def capture(app, ctx):
+    # The object each endpoint encodes, taken at the provider so datetimes and
+    # other non-JSON values reach the encoders as they do in production
+    from encoding import FastJSONProvider
+
+    class Recorder(FastJSONProvider):
+        def dumps(self, obj, **kwargs):
+            self.last = obj
+            return super().dumps(obj, **kwargs)
+
+    app.json = recorder = Recorder(app)
+    clients = {}
+    payloads = []
+    for name, role, path in endpoints(ctx):
+        client = clients.get(role)
+        if client is None:
+            client = clients[role] = app.test_client()
+            if role is not None:
+                client.post('/login', json={'email': ctx['emails'][role], 'password': ctx['password']})
+        recorder.last = None
+        response = client.get(path)
+        if response.status_code != 200 or recorder.last is None:
+            print(f'skipping {name}: {response.status_code}')
+            continue
+        payloads.append((name, recorder.last))
+    return payloads
+
+def modes(app):
+    from encoding import FastJSONProvider
+
+    stdlib = FastJSONProvider(app)
+    stdlib.use_orjson = False
+    fast = FastJSONProvider(app)
+    level = app.config['COMPRESS_LEVEL']
+    compact = {'separators': (',', ':')}
+    return [
+        # app.json.compact = False, what every response used to be
+        ('stdlib indented', lambda obj: f'{stdlib.dumps(obj, indent=2)}\n'.encode()),
+        ('stdlib compact', lambda obj: f'{stdlib.dumps(obj, **compact)}\n'.encode()),
+        ('orjson compact', lambda obj: f'{fast.dumps(obj, **compact)}\n'.encode()),
+        (f'orjson + gzip -{level}', lambda obj: gzip.compress(f'{fast.dumps(obj, **compact)}\n'.encode(), level, mtime=0)),
+    ]
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault('DATABASE_URI', f'sqlite:///{tempfile.mkdtemp()}/bench_json.db')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # One client drives every request, the limiter would turn most of them away
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+    from app import app
+    from benchmarks.bench_api import seed_dataset
+
+    ctx = seed_dataset(app, args)
+    payloads = capture(app, ctx)
+    print(f"{'endpoint':30} {'mode':18} {'bytes':>9} {'ratio':>6} {'encode us':>10}")
+    for name, obj in payloads:
+        baseline = None
+        for label, encode in modes(app):
+            size = len(encode(obj))
+            started = time.process_time()
+            for _ in range(args.rounds):
+                encode(obj)
+            cpu_us = (time.process_time() - started) / args.rounds * 1e6
+            baseline = baseline or size
+            print(f'{name:30} {label:18} {size:9} {size / baseline:6.2f} {cpu_us:10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Search latency over a synthetic catalogue, no database needed:
+#   python -m benchmarks.bench_search [menu_items]
+# The target is p99 under 10 ms at 100k menu items.
+import random
+import sys
+import time
+from search import SearchIndex
+
+WORDS = (
+    'ugali nyama choma sukuma wiki chapati pilau biryani samosa mandazi githeri mukimo '
+    'tilapia fish chicken beef goat lamb curry stew masala tikka paneer dal rice noodles '
+    'pasta pizza margherita pepperoni burger fries salad soup sandwich wrap taco burrito '
+    'spicy grilled fried roasted smoked creamy garlic ginger lemon coconut tamarind chilli '
+    'special classic family house chef signature fresh homemade traditional street'
+).split()
+CUISINES = ('African', 'Italian', 'Chinese', 'Indian', 'Mexican', 'American')
+# Real menus follow a Zipf-like word distribution: a few words are everywhere,
+# most are rare. Pad the food words with synthetic ones to get a long tail.
+SYLLABLES = ('ka', 'ri', 'mo', 'shi', 'la', 'ta', 'nu', 'ko', 'wa', 'bi', 'ze', 'po')
+
+def vocabulary(rng, size=4000):
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    cumulative, total = [], 0.0
+    for rank in range(len(words)):
+        total += 1 / (rank + 20)
+        cumulative.append(total)
+    return words, cumulative
+
+QUERIES = ('chicken', 'nyama choma', 'spicy chicken curry', 'pil', 'ch', 'coconut ri', 'grilled tilapia',
+           'beef', 'masala t', 'family pizza')
+
+def build(menu_items, per_restaurant=20, seed=7):
+    rng = random.Random(seed)
+    words, cum_weights = vocabulary(rng)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for restaurant_id in range(1, menu_items // per_restaurant + 1):
+        name = ' '.join(rng.choices(words, cum_weights=cum_weights, k=2)).title()
+        items = [
+            (restaurant_id * per_restaurant + i, ' '.join(rng.choices(words, cum_weights=cum_weights, k=3)),
+             ' '.join(rng.choices(words, cum_weights=cum_weights, k=8)), rng.randint(50, 1500))
+            for i in range(per_restaurant)
+        ]
+        index.add_restaurant(restaurant_id, name, rng.choice(CUISINES), items)
+    return index, time.perf_counter() - started
+
+def main(menu_items=100000, rounds=50):
+    index, build_time = build(menu_items)
+    print(f'indexed {len(index.docs)} documents, {len(index.terms)} terms in {build_time:.2f} s')
+
+    latencies = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            index.search(query, limit=20)
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'{len(latencies)} queries  p50 {p50:.2f} ms  p99 {p99:.2f} ms  max {latencies[-1]:.2f} ms')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,56 @@
+# Compares SerializerMixin.to_dict with the precompiled plans in serializers.py.
+# Runs on in-memory objects, no database needed:
+#   python -m benchmarks.bench_serializers [rows]
+import sys
+import timeit
+from datetime import datetime
+from models import Menu_item, Order, Restaurant, User
+import serializers
+
+def build_restaurants(rows):
+    restaurants = []
+    for i in range(rows):
+        restaurant = Restaurant(
+            id=i, name=f'Restaurant {i}', address=f'{i} Moi Avenue', cuisine='African',
+            menu='Menu items will be defined separately', rating=str(i % 5 + 1), reviews='Great food',
+        )
+        restaurant.menu_items = [
+            Menu_item(id=i * 10 + j, name=f'Dish {j}', description='Tasty', price=10 + j, image='dish.png')
+            for j in range(5)
+        ]
+        restaurant.orders = [
+            Order(id=i * 10 + j, status='Pending', total_price=100, delivery_time=datetime(2024, 10, 28, 12, 30),
+                  delivery_address='Nairobi')
+            for j in range(3)
+        ]
+        restaurants.append(restaurant)
+    return restaurants
+
+def build_users(rows):
+    users = []
+    for i in range(rows):
+        user = User(id=i, name=f'User {i}', email=f'user{i}@example.com', role='client', phone_number='0712345678')
+        user._password_hash = 'hash'
+        users.append(user)
+    return users
+
+CASES = [
+    ('restaurant summary', build_restaurants, serializers.restaurant_summary,
+     lambda obj: obj.to_dict(rules=('-menu_items', '-orders',))),
+    ('restaurant full', build_restaurants, serializers.restaurant_full, lambda obj: obj.to_dict()),
+    ('user full', build_users, serializers.user_full, lambda obj: obj.to_dict()),
+]
+
+def main(rows=1000, repeat=5):
+    for name, build, plan, to_dict in CASES:
+        objs = build(rows)
+        for obj in objs:
+            assert plan(obj) == to_dict(obj), f'{name}: plan output differs from to_dict'
+
+        mixin = min(timeit.repeat(lambda: [to_dict(obj) for obj in objs], number=1, repeat=repeat))
+        compiled = min(timeit.repeat(lambda: plan.many(objs), number=1, repeat=repeat))
+        print(f'{name:<20} to_dict {mixin * 1000:8.2f} ms  plan {compiled * 1000:8.2f} ms  '
+              f'speedup {mixin / compiled:5.1f}x  ({rows} rows)')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
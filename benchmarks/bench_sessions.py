@@ -0,0 +1,85 @@
+# Session load and save cost: Flask's signed cookie against the server-side
+# stores in sessions.py, on a bare app, no database needed:
+#   python -m benchmarks.bench_sessions [stored_sessions]
+# stored_sessions other users' sessions are preloaded so lookups hit a full store.
+import os
+import sys
+import tempfile
+import time
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.test import EnvironBuilder
+from sessions import MemorySessionStore, ServerSessionInterface, SqliteSessionStore, new_sid
+
+TTL = 86400
+# What a logged-in client carries after a write, see replicas.py
+DATA = {'user_id': 42, 'wrote_at': 1730000000.0}
+
+def build_app():
+    app = Flask('bench_sessions')
+    app.config['SECRET_KEY'] = 'benchmark'
+    return app
+
+def cookie_for(app, interface):
+    # Runs one request that logs in and returns the cookie value it set
+    request = app.request_class(EnvironBuilder().get_environ())
+    session = interface.open_session(app, request)
+    session.update(DATA)
+    response = app.response_class()
+    interface.save_session(app, session, response)
+    header = response.headers['Set-Cookie']
+    return header.split(';', 1)[0].split('=', 1)[1]
+
+def timed(fn, rounds):
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1e6)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1]
+
+def measure(app, interface, rounds):
+    value = cookie_for(app, interface)
+    environ = EnvironBuilder(headers={'Cookie': f'{app.config["SESSION_COOKIE_NAME"]}={value}'}).get_environ()
+
+    def read():
+        # A read-only request: load, look at user_id, save (a no-op when unchanged)
+        session = interface.open_session(app, app.request_class(environ))
+        assert session.get('user_id') == DATA['user_id']
+        interface.save_session(app, session, app.response_class())
+
+    def write():
+        # A write request: replicas.py stamps wrote_at, so the session is stored again
+        session = interface.open_session(app, app.request_class(environ))
+        session['wrote_at'] = time.time()
+        interface.save_session(app, session, app.response_class())
+
+    return len(value), timed(read, rounds), timed(write, rounds)
+
+def main(stored_sessions=100000, rounds=20000):
+    app = build_app()
+    memory = MemorySessionStore(max_sessions=stored_sessions * 2)
+    sqlite = SqliteSessionStore(os.path.join(tempfile.mkdtemp(), 'bench_sessions.db'))
+    expires_at = time.time() + TTL
+    for user_id in range(stored_sessions):
+        memory.save(new_sid(), {'user_id': user_id}, expires_at)
+    sqlite._connect().execute('BEGIN')
+    for user_id in range(stored_sessions):
+        sqlite.save(new_sid(), {'user_id': user_id}, expires_at)
+    sqlite._connect().execute('COMMIT')
+
+    cases = [
+        ('signed cookie', SecureCookieSessionInterface()),
+        ('memory store', ServerSessionInterface(memory, TTL)),
+        ('sqlite store', ServerSessionInterface(sqlite, TTL)),
+    ]
+    print(f'{stored_sessions} stored sessions, {rounds} rounds, latencies in microseconds')
+    print(f'{"":<15}{"cookie bytes":>13}{"read p50":>10}{"read p99":>10}{"write p50":>11}{"write p99":>11}')
+    with app.app_context():
+        for label, interface in cases:
+            size, (read_p50, read_p99), (write_p50, write_p99) = measure(app, interface, rounds)
+            print(f'{label:<15}{size:>13}{read_p50:>10.1f}{read_p99:>10.1f}{write_p50:>11.1f}{write_p99:>11.1f}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,97 @@
+# Load test: /restaurants latency while /login is hammered.
+# Seeds a throwaway SQLite database, serves the app on a threaded local server
+# and measures /restaurants before and during a login storm:
+#   python -m benchmarks.login_storm [storm_threads] [seconds]
+# Compare PASSWORD_HASH_WORKERS=0 (inline bcrypt) with the default pool.
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{tempfile.mkdtemp()}/login_storm.db')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('RESPONSE_CACHE_ENABLED', '0')
+# The storm measures the hasher, not the limiter turning it away
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+from werkzeug.serving import make_server
+from app import app
+from models import db, Restaurant, User
+from hashing import password_hasher
+
+def seed():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(name='Storm', email='storm@example.com', role='client')
+        user.password = 'password'
+        db.session.add(user)
+        db.session.add_all(
+            Restaurant(name=f'Restaurant {i}', cuisine='African', address='Nairobi', rating='4')
+            for i in range(200)
+        )
+        db.session.commit()
+
+def request(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def sample_latency(base, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        request(f'{base}/restaurants?limit=50')
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 2),
+    }
+
+def main(storm_threads=32, seconds=5):
+    seed()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    print('workers', password_hasher.workers, 'queue', password_hasher.queue_depth, 'rounds', password_hasher.rounds)
+    print('baseline     ', sample_latency(base, seconds))
+
+    stop = threading.Event()
+    statuses = {}
+    def storm():
+        while not stop.is_set():
+            status = request(f'{base}/login', {'email': 'storm@example.com', 'password': 'password'})
+            statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=storm, daemon=True) for _ in range(storm_threads)]
+    for thread in threads:
+        thread.start()
+    print('during storm ', sample_latency(base, seconds))
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print('login statuses', statuses)
+    server.shutdown()
+    password_hasher.shutdown()
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,216 @@
+# Read-through cache for the catalog responses (restaurants and menus).
+# The default backend is an in-process LRU with a TTL. SqliteBackend stores the
+# entries in a local file so every gunicorn worker on a host shares them.
+# Any object with get/set/delete/incr/counter can be plugged in as a backend.
+# Restaurant detail and menu keys carry the restaurant's version, so a write is
+# seen by every worker whatever the backend. List pages live under a namespace
+# counter instead; with the in-process backend a bump only reaches the worker
+# that made it, the others catch up within RESPONSE_CACHE_TTL.
+import json
+import threading
+import time
+from collections import OrderedDict
+from localdb import LocalSqlite
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def to_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_entries=1024, stats=None):
+        self.max_entries = max_entries
+        self.stats = stats or CacheStats()
+        self._entries = OrderedDict()
+        # Counters are kept apart so LRU eviction never resets them
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+class SqliteBackend(LocalSqlite, CacheBackend):
+    def __init__(self, path, max_entries=10000, stats=None):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.stats = stats or CacheStats()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, touched_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= time.time():
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE cache_entries SET touched_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, touched_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now + ttl if ttl else None, now)
+        )
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM cache_entries WHERE key IN '
+                '(SELECT key FROM cache_entries ORDER BY touched_at LIMIT ?)',
+                (overflow,)
+            )
+            self.stats.evictions += overflow
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def incr(self, key):
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO cache_counters (key, value) VALUES (?, 1) '
+            'ON CONFLICT(key) DO UPDATE SET value = value + 1',
+            (key,)
+        )
+        return self.counter(key)
+
+    def counter(self, key):
+        row = self._connect().execute('SELECT value FROM cache_counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+class ResponseCache:
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.stats = backend.stats if backend is not None else CacheStats()
+        self.ttl = 60
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_ENABLED', True)
+        app.config.setdefault('RESPONSE_CACHE_TTL', 60)
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('RESPONSE_CACHE_PATH', None)
+
+        self.enabled = app.config['RESPONSE_CACHE_ENABLED']
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        if self.backend is None:
+            if app.config['RESPONSE_CACHE_PATH']:
+                self.backend = SqliteBackend(
+                    app.config['RESPONSE_CACHE_PATH'], app.config['RESPONSE_CACHE_MAX_ENTRIES'], self.stats)
+            else:
+                self.backend = MemoryBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'], self.stats)
+
+    def get_or_set(self, key, build):
+        # build() returns (body, status, headers), only 200s are stored
+        if not self.enabled:
+            return build()
+        entry = self.get(key)
+        if entry is None:
+            entry = build()
+            self.set(key, entry)
+        return entry
+
+    # get() and set() split get_or_set for callers that build asynchronously
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self.backend.get(key)
+        if entry is not None:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+        return entry
+
+    def set(self, key, entry):
+        if self.enabled and entry[1] == 200:
+            self.backend.set(key, entry, self.ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.backend.delete(key)
+
+    # Keys that cannot be listed (one per query string) live under a
+    # namespace version, bumping it orphans them until the TTL expires
+    def namespace(self, name):
+        return f'{name}:v{self.backend.counter(name)}'
+
+    def bump(self, name):
+        self.backend.incr(name)
+
+    def info(self):
+        return dict(self.stats.to_dict(), entries=len(self.backend), ttl=self.ttl, enabled=self.enabled)
+
+response_cache = ResponseCache()
@@ -0,0 +1,114 @@
+# Connection pool configuration and metrics.
+# engine_options() turns the DB_POOL_* settings into SQLALCHEMY_ENGINE_OPTIONS.
+# Connections are checked with a pre-ping before use, so a PostgreSQL restart
+# costs one reconnect instead of a failed request, and recycled before any
+# server-side idle timeout. The pool is a QueuePool that times every checkout.
+# PoolMetrics publishes those waits and the pool occupancy on the /metrics
+# endpoint, with or without PROFILING_ENABLED, and gives every forked worker
+# (gunicorn --preload) a fresh pool instead of the parent's sockets.
+import os
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from profiling import Counter, Histogram
+
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+checkout_wait = Histogram('db_pool_checkout_seconds', 'Time spent waiting for a pooled connection',
+                          ('pool',), CHECKOUT_BUCKETS)
+checkout_timeouts = Counter('db_pool_checkout_timeouts_total', 'Checkouts that gave up after pool_timeout',
+                            ('pool',))
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc((self.label,))
+            raise
+        finally:
+            checkout_wait.observe((self.label,), time.perf_counter() - started)
+
+    @property
+    def label(self):
+        return getattr(self, '_metrics_label', 'default')
+
+def engine_options(uri, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800,
+                   pre_ping=True, statement_timeout_ms=0):
+    # In-memory SQLite keeps one connection per thread, pool settings do not apply
+    if not uri or uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pre_ping,
+    }
+    if statement_timeout_ms and uri.startswith('postgres'):
+        # Set per connection, so a runaway query is cancelled by the server
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
+class PoolMetrics:
+    def __init__(self, app=None, db=None, profiler=None):
+        self.pools = {}
+        if app is not None:
+            self.init_app(app, db, profiler)
+
+    def init_app(self, app, db, profiler):
+        with app.app_context():
+            engines = dict(db.engines)
+        for key, engine in engines.items():
+            label = key or 'default'
+            engine.pool._metrics_label = label
+            self.pools[label] = engine
+
+        if hasattr(os, 'register_at_fork'):
+            # A forked worker must not share the parent's sockets, close=False
+            # leaves them to the parent and starts an empty pool
+            os.register_at_fork(after_in_child=self._after_fork)
+        profiler.add_collector(self.render)
+
+    def _after_fork(self):
+        for label, engine in self.pools.items():
+            engine.dispose(close=False)
+            engine.pool._metrics_label = label
+
+    def status(self):
+        result = {}
+        for label, engine in self.pools.items():
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            # A dispose() swaps the pool, keep the label on the new one
+            pool._metrics_label = label
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            result[label] = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'capacity': capacity,
+                'saturation': round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+            }
+        return result
+
+    def render(self):
+        status = self.status()
+        lines = []
+        for field, description in [
+            ('size', 'Configured pool size'),
+            ('checked_out', 'Connections in use'),
+            ('idle', 'Idle connections in the pool'),
+            ('overflow', 'Connections opened beyond pool_size'),
+            ('saturation', 'Connections in use over pool_size + max_overflow'),
+        ]:
+            name = f'db_pool_{field}'
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+            lines += [f'{name}{{pool="{label}"}} {values[field]}' for label, values in sorted(status.items())]
+        return lines + checkout_wait.render() + checkout_timeouts.render()
+
+pool_metrics = PoolMetrics()
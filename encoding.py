@@ -0,0 +1,108 @@
+# How responses are encoded, JSON provider and gzip.
+# FastJSONProvider encodes with orjson when it is installed and JSON_ENCODER is
+# orjson, several times faster than the stdlib. Datetimes, dataclasses and other
+# types orjson would format its own way still go through Flask's default(), and
+# keys stay sorted, so the documents are the same as DefaultJSONProvider's except
+# that non-ASCII text is sent as UTF-8 rather than \u escapes. Anything orjson
+# cannot do (integers over 64 bits, unusual dumps() arguments) falls back to the
+# stdlib encoder.
+# Compressor gzips JSON and text responses of at least COMPRESS_MIN_SIZE bytes
+# for clients that accept it. Streamed responses (SSE, NDJSON) are left alone, a
+# gzip stream would hold events back in its buffer. The stdlib has no brotli and
+# deflate gains nothing over gzip, so gzip is the only coding offered.
+import gzip
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_SEPARATORS = (',', ':')
+
+class FastJSONProvider(DefaultJSONProvider):
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson is not None and app.config.get('JSON_ENCODER', 'orjson') == 'orjson'
+
+    def _orjson_options(self, kwargs):
+        # None when only the stdlib can honour these dumps() arguments
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        for key, value in kwargs.items():
+            if key == 'indent' and value in (None, 2):
+                options |= orjson.OPT_INDENT_2 if value else 0
+            elif key != 'separators' or tuple(value) != COMPACT_SEPARATORS:
+                return None
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if self.use_orjson:
+            options = self._orjson_options(kwargs)
+            if options is not None:
+                try:
+                    return orjson.dumps(obj, default=self.default, option=options).decode()
+                except orjson.JSONEncodeError:
+                    pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        # orjson's decode error is a json.JSONDecodeError, callers catch it unchanged
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+class Compressor:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_size = 1024
+        self.level = 1
+        self.mimetypes = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 1)
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json', 'text/html', 'text/plain', 'text/csv'])
+
+        self.enabled = app.config['COMPRESS_ENABLED']
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        if not self.enabled:
+            return
+
+        app.after_request(self._after_request)
+
+    def compress(self, response, accept_encodings):
+        # accept_encodings is the request's parsed Accept-Encoding
+        if not self.enabled:
+            return response
+        # A gzipped body differs from the identity one, so its ETag can only be
+        # weak. Every response carries the weak form, 304s included, so a client
+        # sees one validator whichever representation it was sent
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers or response.mimetype not in self.mimetypes):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not accept_encodings['gzip']:
+            return response
+        response.set_data(gzip.compress(data, self.level, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    def _after_request(self, response):
+        return self.compress(response, request.accept_encodings)
+
+compressor = Compressor()
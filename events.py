@@ -0,0 +1,253 @@
+# Order events pushed to clients and restaurant owners instead of polled.
+# publish() appends an event to a log under its channels (user:<id> and
+# restaurant:<id>) and wakes the readers. /events streams them as Server-Sent
+# Events and /events/poll long-polls. Event ids only grow, so a client that
+# reconnects with Last-Event-ID receives what it missed; when those events have
+# already been dropped from the log it gets one reset event and re-fetches instead.
+# MemoryEventLog serves a single worker. SqliteEventLog keeps the log in a local
+# file so every worker on a host sees every event, the local stand-in for a
+# shared broker. Any object with publish/read/wait/latest_id can be plugged in.
+# A stream holds its connection open, so under gunicorn sync workers each one
+# ties up a worker; asgi.py serves both endpoints on the event loop instead.
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+from localdb import LocalSqlite
+
+READ_BATCH = 500
+
+class EventLog:
+    def publish(self, channels, event_type, data):
+        raise NotImplementedError
+
+    # read() returns (events, scanned_id, reset): the matching events after
+    # after_id, the last id looked at, and whether events after after_id are gone
+    def read(self, channels, after_id, limit=READ_BATCH):
+        raise NotImplementedError
+
+    def wait(self, after_id, timeout):
+        raise NotImplementedError
+
+    def latest_id(self):
+        raise NotImplementedError
+
+class MemoryEventLog(EventLog):
+    def __init__(self, max_events=10000):
+        self.max_events = max_events
+        self._events = []
+        self._first_id = 1
+        self._next_id = 1
+        self._changed = threading.Condition()
+
+    def publish(self, channels, event_type, data):
+        with self._changed:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, frozenset(channels), event_type, data))
+            if len(self._events) > self.max_events:
+                # Drop a tenth at a time so trimming stays amortised
+                drop = len(self._events) - self.max_events + self.max_events // 10
+                del self._events[:drop]
+                self._first_id += drop
+            self._changed.notify_all()
+        return event_id
+
+    def read(self, channels, after_id, limit=READ_BATCH):
+        with self._changed:
+            reset = after_id + 1 < self._first_id
+            start = max(after_id + 1 - self._first_id, 0)
+            events = []
+            scanned = max(after_id, self._first_id - 1)
+            for event_id, event_channels, event_type, data in self._events[start:start + limit]:
+                scanned = event_id
+                if not channels.isdisjoint(event_channels):
+                    events.append({'id': event_id, 'type': event_type, 'data': data})
+        return events, scanned, reset
+
+    def wait(self, after_id, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._next_id - 1 > after_id, timeout)
+
+    def latest_id(self):
+        return self._next_id - 1
+
+class SqliteEventLog(LocalSqlite, EventLog):
+    def __init__(self, path, max_events=10000, poll_interval=0.2):
+        super().__init__(path)
+        self.max_events = max_events
+        self.poll_interval = poll_interval
+        self._published = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'channels TEXT NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+
+    def publish(self, channels, event_type, data):
+        conn = self._connect()
+        event_id = conn.execute(
+            'INSERT INTO events (channels, type, data, created_at) VALUES (?, ?, ?, ?)',
+            (' '.join(channels), event_type, json.dumps(data), time.time())
+        ).lastrowid
+        self._published += 1
+        if self._published % 100 == 0:
+            conn.execute('DELETE FROM events WHERE id <= ?', (event_id - self.max_events,))
+        return event_id
+
+    def read(self, channels, after_id, limit=READ_BATCH):
+        conn = self._connect()
+        first_id = conn.execute('SELECT MIN(id) FROM events').fetchone()[0]
+        reset = first_id is not None and after_id + 1 < first_id
+        rows = conn.execute(
+            'SELECT id, channels, type, data FROM events WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit)
+        ).fetchall()
+        events = [
+            {'id': event_id, 'type': event_type, 'data': json.loads(data)}
+            for event_id, event_channels, event_type, data in rows
+            if not channels.isdisjoint(event_channels.split(' '))
+        ]
+        return events, rows[-1][0] if rows else after_id, reset
+
+    def wait(self, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while self.latest_id() <= after_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+        return True
+
+    def latest_id(self):
+        row = self._connect().execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+ORDER_FIELDS = ('id', 'user_id', 'restaurant_id', 'status', 'version', 'total_price', 'delivery_time')
+
+def order_payload(order):
+    if not isinstance(order, dict):
+        order = {field: getattr(order, field) for field in ORDER_FIELDS}
+    delivery_time = order['delivery_time']
+    return {
+        'order_id': order['id'],
+        'user_id': order['user_id'],
+        'restaurant_id': order['restaurant_id'],
+        'status': order['status'],
+        'version': order['version'],
+        'total_price': order['total_price'],
+        'delivery_time': delivery_time.isoformat() if isinstance(delivery_time, datetime) else delivery_time,
+    }
+
+def sse(event_id, event_type, data):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+def reset_event(event_id):
+    # Carries the id just before the oldest event still held, so a reconnect resumes after it
+    return sse(event_id, 'reset', {'reason': 'Missed events are no longer available, re-fetch orders'})
+
+class EventBroker:
+    def __init__(self, app=None, log=None):
+        self.log = log
+        self.heartbeat_seconds = 15
+        self.stream_seconds = 300
+        self.poll_seconds = 25
+        self.retry_ms = 3000
+        self.poll_interval = 0.2
+        self.closing = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_PATH', None)
+        app.config.setdefault('EVENTS_MAX', 10000)
+        app.config.setdefault('EVENTS_HEARTBEAT_SECONDS', 15)
+        app.config.setdefault('EVENTS_STREAM_SECONDS', 300)
+        app.config.setdefault('EVENTS_POLL_SECONDS', 25)
+
+        self.heartbeat_seconds = app.config['EVENTS_HEARTBEAT_SECONDS']
+        self.stream_seconds = app.config['EVENTS_STREAM_SECONDS']
+        self.poll_seconds = app.config['EVENTS_POLL_SECONDS']
+        if self.log is None:
+            if app.config['EVENTS_PATH']:
+                self.log = SqliteEventLog(app.config['EVENTS_PATH'], app.config['EVENTS_MAX'])
+            else:
+                self.log = MemoryEventLog(app.config['EVENTS_MAX'])
+
+    def publish(self, channels, event_type, data):
+        return self.log.publish(channels, event_type, data)
+
+    def order_event(self, event_type, order, **extra):
+        # order: an Order or a mapping of its columns, published to its user and restaurant
+        payload = dict(order_payload(order), **extra)
+        return self.publish(
+            [f"user:{payload['user_id']}", f"restaurant:{payload['restaurant_id']}"], event_type, payload
+        )
+
+    def poll(self, channels, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events, after_id, reset = self.log.read(channels, after_id)
+            remaining = deadline - time.monotonic()
+            if events or reset or remaining <= 0:
+                return events, after_id, reset
+            self.log.wait(after_id, remaining)
+
+    def stream(self, channels, after_id):
+        # Runs for stream_seconds at most, EventSource reconnects with Last-Event-ID
+        deadline = time.monotonic() + self.stream_seconds
+        yield f'retry: {self.retry_ms}\n\n'
+        while True:
+            events, after_id, reset = self.log.read(channels, after_id)
+            if reset:
+                yield reset_event(events[0]['id'] - 1 if events else after_id)
+            for event in events:
+                yield sse(event['id'], event['type'], event['data'])
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not events and not self.log.wait(after_id, min(self.heartbeat_seconds, remaining)):
+                yield ': keep-alive\n\n'
+
+    # Coroutine flavours for the ASGI app, which check the log every poll_interval
+    # rather than block a thread in wait(). The log itself may block (SqliteEventLog),
+    # so it is read from a worker thread, never on the event loop
+
+    def close(self):
+        # Open streams and polls end within poll_interval instead of holding up a shutdown
+        self.closing = True
+
+    async def _wait(self, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.closing and await asyncio.to_thread(self.log.latest_id) <= after_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.poll_interval, remaining))
+        return True
+
+    async def apoll(self, channels, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events, after_id, reset = await asyncio.to_thread(self.log.read, channels, after_id)
+            remaining = deadline - time.monotonic()
+            if events or reset or remaining <= 0 or self.closing:
+                return events, after_id, reset
+            await self._wait(after_id, remaining)
+
+    async def astream(self, channels, after_id):
+        deadline = time.monotonic() + self.stream_seconds
+        yield f'retry: {self.retry_ms}\n\n'
+        while True:
+            events, after_id, reset = await asyncio.to_thread(self.log.read, channels, after_id)
+            if reset:
+                yield reset_event(events[0]['id'] - 1 if events else after_id)
+            for event in events:
+                yield sse(event['id'], event['type'], event['data'])
+            remaining = deadline - time.monotonic()
+            # Closing: EventSource reconnects with Last-Event-ID, to a worker still up
+            if remaining <= 0 or self.closing:
+                return
+            if not events and not await self._wait(after_id, min(self.heartbeat_seconds, remaining)):
+                yield ': keep-alive\n\n'
+
+order_events = EventBroker()
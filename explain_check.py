@@ -0,0 +1,76 @@
+# Verifies that the endpoint queries are served by indexes.
+# Each endpoint is requested once with the response cache off, every SELECT it
+# ran is re-run under EXPLAIN, and any full scan of a large table fails the check:
+#   python explain_check.py
+from cache import response_cache
+from query_budget import count_queries
+
+# Tables that grow with traffic and must never be scanned
+INDEXED_TABLES = ('orders', 'menu_items', 'order_items')
+
+ENDPOINTS = (
+    '/restaurant/{restaurant_id}/menu',
+    '/restaurant/{restaurant_id}/order',
+    '/user/orders',
+)
+
+class FullScanError(AssertionError):
+    pass
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).fetchall()
+    return [row[0] for row in rows]
+
+def full_scans(plan):
+    scans = []
+    for line in plan:
+        # SQLite says "SCAN orders", PostgreSQL says "Seq Scan on orders"
+        words = line.replace('Seq Scan on', 'SCAN').split()
+        for i, word in enumerate(words[:-1]):
+            if word == 'SCAN' and words[i + 1] in INDEXED_TABLES and 'INDEX' not in words:
+                scans.append(line)
+    return scans
+
+def check_endpoints(app, engine, restaurant_id, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    enabled, response_cache.enabled = response_cache.enabled, False
+    try:
+        report = {}
+        for route in ENDPOINTS:
+            url = route.format(restaurant_id=restaurant_id)
+            with count_queries(engine) as counter:
+                client.get(url)
+            plans = []
+            with engine.connect() as connection:
+                for statement, parameters in zip(counter.statements, counter.parameters):
+                    if statement.lstrip().upper().startswith('SELECT'):
+                        plans.extend(explain(connection, statement, parameters))
+            scans = full_scans(plans)
+            if scans:
+                raise FullScanError(f"{url} scans without an index: {scans}")
+            report[url] = plans
+        return report
+    finally:
+        response_cache.enabled = enabled
+
+if __name__ == '__main__':
+    from app import app
+    from models import db, Order
+
+    with app.app_context():
+        order = Order.query.first()
+        if order is None:
+            raise SystemExit("Seed the database first (python seed.py)")
+        restaurant_id, user_id = order.restaurant_id, order.user_id
+        engine = db.engine
+
+    for url, plans in check_endpoints(app, engine, restaurant_id, user_id).items():
+        print(url)
+        for line in plans:
+            print(f'    {line}')
@@ -0,0 +1,171 @@
+# Nearby restaurant search.
+# Restaurants carry latitude/longitude, filled in from their address by
+# OfflineGeocoder, a deterministic stand-in for a geocoding service: the same
+# address always lands on the same point inside GEOCODER_CENTER/GEOCODER_RADIUS_KM.
+# GeoIndex buckets restaurants into a grid of GEO_CELL_KM cells held in memory, so
+# a "within R km" query only looks at the cells its circle overlaps, however many
+# restaurants there are. It is kept current like the search index: restaurant
+# writes re-index the restaurant they touched, and every GEO_REFRESH_SECONDS each
+# worker re-reads rows whose updated_at moved.
+# Existing rows get coordinates with `python geo.py backfill`.
+import hashlib
+import math
+import sys
+from datetime import datetime
+from heapq import nsmallest
+from models import db, Restaurant
+from indexsync import SyncedIndex
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1.0))
+
+def point_in_area(u, v, center, radius_km):
+    # Maps u, v in [0, 1) uniformly onto the disc around center
+    distance = radius_km * math.sqrt(u)
+    bearing = 2 * math.pi * v
+    lat = center[0] + distance * math.cos(bearing) / KM_PER_DEGREE
+    lon = center[1] + distance * math.sin(bearing) / (KM_PER_DEGREE * math.cos(math.radians(center[0])))
+    return round(lat, 6), round(lon, 6)
+
+def valid_coordinates(lat, lon):
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+class OfflineGeocoder:
+    def __init__(self, app=None):
+        self.center = (-1.2864, 36.8172)
+        self.radius_km = 25.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GEOCODER_CENTER', self.center)
+        app.config.setdefault('GEOCODER_RADIUS_KM', self.radius_km)
+        self.center = tuple(app.config['GEOCODER_CENTER'])
+        self.radius_km = app.config['GEOCODER_RADIUS_KM']
+
+    def geocode(self, address):
+        normalized = ' '.join(address.lower().split()) if isinstance(address, str) else ''
+        if not normalized:
+            return None
+        digest = hashlib.sha1(normalized.encode()).digest()
+        u = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        v = int.from_bytes(digest[8:16], 'big') / 2 ** 64
+        return point_in_area(u, v, self.center, self.radius_km)
+
+class GeoIndex(SyncedIndex):
+    def __init__(self, app=None):
+        super().__init__()
+        self.cell_km = 2.0
+        self.cells = {}
+        self.points = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GEO_CELL_KM', 2.0)
+        app.config.setdefault('GEO_REFRESH_SECONDS', 5)
+        self.cell_km = app.config['GEO_CELL_KM']
+        self.refresh_seconds = app.config['GEO_REFRESH_SECONDS']
+
+    # Index maintenance
+
+    def _cell(self, lat, lon):
+        # Square cells in degrees, narrower in km away from the equator
+        step = self.cell_km / KM_PER_DEGREE
+        return math.floor(lat / step), math.floor(lon / step)
+
+    def add(self, restaurant_id, lat, lon, cuisine):
+        with self._lock:
+            self.remove(restaurant_id)
+            cell = self._cell(lat, lon)
+            self.points[restaurant_id] = (lat, lon, cuisine, cell)
+            self.cells.setdefault(cell, {})[restaurant_id] = (lat, lon, cuisine)
+
+    def remove(self, restaurant_id):
+        with self._lock:
+            point = self.points.pop(restaurant_id, None)
+            if point is not None:
+                cell = self.cells[point[3]]
+                del cell[restaurant_id]
+                if not cell:
+                    del self.cells[point[3]]
+
+    # Database sync
+
+    def _load(self, restaurant_ids=None):
+        rows = db.session.query(Restaurant.id, Restaurant.latitude, Restaurant.longitude, Restaurant.cuisine)
+        if restaurant_ids is not None:
+            rows = rows.filter(Restaurant.id.in_(restaurant_ids))
+        found = set()
+        for restaurant_id, lat, lon, cuisine in rows.yield_per(1000):
+            if lat is None or lon is None:
+                continue
+            found.add(restaurant_id)
+            self.add(restaurant_id, lat, lon, cuisine)
+        for restaurant_id in set(restaurant_ids or ()) - found:
+            self.remove(restaurant_id)
+
+    # Queries
+
+    def nearby(self, lat, lon, radius_km, limit, cuisine=None):
+        # [(distance_km, restaurant_id)] closest first. Circles crossing the
+        # antimeridian are not wrapped.
+        step = self.cell_km / KM_PER_DEGREE
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        rows = range(math.floor((lat - dlat) / step), math.floor((lat + dlat) / step) + 1)
+        cols = range(math.floor((lon - dlon) / step), math.floor((lon + dlon) / step) + 1)
+        with self._lock:
+            if len(rows) * len(cols) > len(self.cells):
+                # A circle wider than the populated grid, walking the cells is cheaper
+                cells = list(self.cells.values())
+            else:
+                cells = [cell for cell in (self.cells.get((row, col)) for row in rows for col in cols) if cell]
+            hits = []
+            for cell in cells:
+                for restaurant_id, (point_lat, point_lon, point_cuisine) in cell.items():
+                    if cuisine and point_cuisine != cuisine:
+                        continue
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if distance <= radius_km:
+                        hits.append((distance, restaurant_id))
+        return nsmallest(limit, hits)
+
+geocoder = OfflineGeocoder()
+geo_index = GeoIndex()
+
+def backfill(batch_size=1000):
+    # Geocodes restaurants that have an address but no coordinates yet
+    from sqlalchemy import update
+
+    total = 0
+    while True:
+        rows = db.session.query(Restaurant.id, Restaurant.address).filter(
+            Restaurant.latitude.is_(None), Restaurant.address.isnot(None)
+        ).order_by(Restaurant.id).limit(batch_size).all()
+        points = [(row.id, geocoder.geocode(row.address)) for row in rows]
+        points = [(restaurant_id, point) for restaurant_id, point in points if point]
+        if not points:
+            return total
+        # updated_at moves so running workers pick the rows up
+        db.session.execute(update(Restaurant), [
+            {'id': restaurant_id, 'latitude': lat, 'longitude': lon, 'updated_at': datetime.utcnow()}
+            for restaurant_id, (lat, lon) in points
+        ])
+        db.session.commit()
+        total += len(points)
+        if len(rows) < batch_size:
+            return total
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['backfill']:
+        raise SystemExit('usage: python geo.py backfill')
+    from app import app
+
+    with app.app_context():
+        print(f'Geocoded {backfill()} restaurant(s)')
@@ -0,0 +1,108 @@
+# Password hashing off the request thread.
+# bcrypt is deliberately slow, so hashing runs on a small dedicated process pool.
+# At most PASSWORD_HASH_WORKERS hashes burn CPU at once and at most
+# PASSWORD_HASH_QUEUE requests wait for one. Past that HasherBusy is raised
+# straight away and the auth endpoints answer 503 instead of tying up every worker.
+# A hash that times out keeps its slot until the pool has actually finished or
+# dropped it, so abandoned hashes cannot pile up behind the limit.
+import multiprocessing
+import os
+import threading
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from profiling import phase
+
+class HasherBusy(Exception):
+    pass
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check_password(password_hash, password):
+    return bcrypt.checkpw(password, password_hash)
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 0
+        self.queue_depth = 0
+        self.timeout = None
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # BCRYPT_LOG_ROUNDS is the Flask-Bcrypt setting, so both stay in step
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.queue_depth = app.config['PASSWORD_HASH_QUEUE']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth) if self.workers else None
+
+    def _get_executor(self):
+        # Pools do not survive a fork, each gunicorn worker builds its own on first use
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # Not fork: the children would inherit the parent's threads, locks and connections
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        with phase('hash'):
+            if not self.workers:
+                return fn(*args)
+            slots = self._slots
+            if not slots.acquire(blocking=False):
+                raise HasherBusy("Password hashing is saturated, try again shortly")
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                slots.release()
+                self._discard(executor)
+                raise HasherBusy("Password hashing is restarting, try again shortly")
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _: slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise HasherBusy("Password hashing timed out")
+            except BrokenProcessPool:
+                self._discard(executor)
+                raise HasherBusy("Password hashing is restarting, try again shortly")
+
+    def _discard(self, executor):
+        # A worker died (OOM kill, failed bootstrap) and the pool refuses all work
+        # from then on, the next call builds a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        return self._run(_hash_password, password.encode('utf-8'), self.rounds)
+
+    def check(self, password_hash, password):
+        return self._run(_check_password, password_hash.encode('utf-8'), password.encode('utf-8'))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+password_hasher = PasswordHasher()
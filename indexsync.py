@@ -0,0 +1,46 @@
+# In-process indexes over the restaurants table (search, geo).
+# Each worker builds its index on first use and then, every refresh_seconds,
+# reloads the restaurants whose updated_at moved past its watermark, which picks
+# up writes made by other workers. Subclasses implement _load(restaurant_ids),
+# None meaning all of them.
+import threading
+import time
+from datetime import datetime, timedelta
+from models import db, Restaurant
+from replicas import replica_router
+
+class SyncedIndex:
+    def __init__(self):
+        self.refresh_seconds = 5
+        self.built = False
+        self.synced_at = None
+        self.checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def _load(self, restaurant_ids=None):
+        raise NotImplementedError
+
+    def reindex_restaurant(self, restaurant_id):
+        if self.built:
+            with self._lock, replica_router.primary():
+                self._load([restaurant_id])
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.built and now - self.checked_at < self.refresh_seconds:
+            return
+        # From the primary: a lagging replica would let the watermark pass rows
+        # it has not received yet, and they would never be indexed
+        with self._lock, replica_router.primary():
+            started = datetime.utcnow()
+            if not self.built:
+                self._load()
+                self.built = True
+            else:
+                # Overlap the window a little to allow for clock skew between workers
+                changed = [row.id for row in db.session.query(Restaurant.id).filter(
+                    Restaurant.updated_at >= self.synced_at - timedelta(seconds=1))]
+                if changed:
+                    self._load(changed)
+            self.synced_at = started
+            self.checked_at = now
@@ -0,0 +1,19 @@
+# Local SQLite files shared by the workers on a host.
+# The Sqlite* stores (response cache, rate limit buckets, sessions, order events)
+# all keep one connection per thread in autocommit mode, explicit BEGINs aside,
+# with WAL so readers in other workers are not blocked while one writes.
+import sqlite3
+import threading
+
+class LocalSqlite:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,140 @@
+# Bulk menu import.
+# An upload (JSON array or CSV) is diffed against the restaurant's current menu:
+# rows match existing items by id, or else by name, and only real changes are
+# written. Every row is validated before anything is applied, with the same
+# rules as Menu_item's validators, and the inserts, updates and deletes run as
+# executemany statements in one transaction.
+import csv
+import io
+from sqlalchemy import delete, insert, update
+from models import db, Menu_item, Order_Item
+from stats import forget_order_lines
+
+MAX_MENU_SIZE = 2000
+FIELDS = ('name', 'description', 'price', 'image')
+CSV_COLUMNS = ('id',) + FIELDS
+
+class MenuImportError(Exception):
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    if reader.fieldnames is None or 'name' not in reader.fieldnames:
+        raise MenuImportError("CSV needs a header row with at least a name column")
+    unknown = set(reader.fieldnames) - set(CSV_COLUMNS)
+    if unknown:
+        raise MenuImportError(f"Unknown CSV columns: {', '.join(sorted(unknown))}")
+    # Empty cells mean "not given", as a missing key does in JSON
+    return [{key: value for key, value in row.items() if value not in (None, '')} for row in reader]
+
+def as_int(value):
+    # CSV cells arrive as strings, JSON numbers as ints
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, str):
+        return int(value.strip())
+    if isinstance(value, int):
+        return value
+    raise ValueError
+
+def validate_rows(rows):
+    errors = []
+    clean = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({'index': index, 'error': "Each menu item must be an object"})
+            continue
+        item = {}
+        try:
+            if row.get('id') is not None:
+                item['id'] = as_int(row['id'])
+        except ValueError:
+            errors.append({'index': index, 'error': "id must be an integer"})
+            continue
+        name = row.get('name')
+        if not isinstance(name, str) or not name.strip():
+            errors.append({'index': index, 'error': "Missing required field: name"})
+            continue
+        item['name'] = name.strip()
+        try:
+            item['price'] = as_int(row.get('price'))
+        except (ValueError, TypeError):
+            errors.append({'index': index, 'error': "price must be an integer"})
+            continue
+        if item['price'] < 1:
+            errors.append({'index': index, 'error': "Prices must be positive"})
+            continue
+        if not row.get('image'):
+            errors.append({'index': index, 'error': "Meal image must be present for integrity"})
+            continue
+        item['image'] = str(row['image'])
+        # Left out, an existing description is kept
+        if row.get('description') is not None:
+            item['description'] = str(row['description'])
+        clean.append(item)
+    return clean, errors
+
+def diff_menu(current, items, replace):
+    # current: {id: row} of the restaurant's items. Returns (inserts, updates, deletes, unchanged)
+    by_name = {}
+    for row in current.values():
+        by_name.setdefault(row.name, []).append(row.id)
+    matched = set()
+    inserts, updates, errors = [], [], []
+    for index, item in enumerate(items):
+        item_id = item.pop('id', None)
+        if item_id is None:
+            # First not yet matched item of that name, if any
+            item_id = next((candidate for candidate in by_name.get(item['name'], ()) if candidate not in matched), None)
+        elif item_id not in current:
+            errors.append({'index': index, 'error': f"Menu item {item_id} is not on this restaurant's menu"})
+            continue
+        if item_id is None:
+            item.setdefault('description', None)
+            inserts.append(item)
+            continue
+        if item_id in matched:
+            errors.append({'index': index, 'error': f"Menu item {item_id} appears more than once"})
+            continue
+        matched.add(item_id)
+        item.setdefault('description', current[item_id].description)
+        if any(getattr(current[item_id], field) != item[field] for field in FIELDS):
+            updates.append(dict(item, id=item_id))
+    if errors:
+        raise MenuImportError("Invalid menu", errors)
+    deletes = sorted(set(current) - matched) if replace else []
+    return inserts, updates, deletes, len(matched) - len(updates)
+
+def import_menu(restaurant_id, rows, replace=True, dry_run=False):
+    # replace=True makes the upload the whole menu, items missing from it are deleted
+    if not isinstance(rows, list):
+        raise MenuImportError("The menu must be a list of items")
+    if len(rows) > MAX_MENU_SIZE:
+        raise MenuImportError(f"A menu holds at most {MAX_MENU_SIZE} items")
+    items, errors = validate_rows(rows)
+    if errors:
+        raise MenuImportError("Invalid menu", errors)
+
+    current = {
+        row.id: row for row in db.session.query(
+            Menu_item.id, Menu_item.name, Menu_item.description, Menu_item.price, Menu_item.image
+        ).filter(Menu_item.restaurant_id == restaurant_id)
+    }
+    inserts, updates, deletes, unchanged = diff_menu(current, items, replace)
+    summary = {'created': len(inserts), 'updated': len(updates), 'deleted': len(deletes), 'unchanged': unchanged}
+    if dry_run or not (inserts or updates or deletes):
+        return summary
+
+    if inserts:
+        db.session.execute(insert(Menu_item), [dict(item, restaurant_id=restaurant_id) for item in inserts])
+    if updates:
+        # ORM bulk UPDATE by primary key, one executemany
+        db.session.execute(update(Menu_item), updates)
+    if deletes:
+        # Same as the delete-orphan cascade a single item delete goes through
+        forget_order_lines(Order_Item.menu_item_id.in_(deletes))
+        db.session.execute(delete(Order_Item).where(Order_Item.menu_item_id.in_(deletes)))
+        db.session.execute(delete(Menu_item).where(Menu_item.id.in_(deletes)))
+    return summary
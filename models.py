@@ -6,8 +6,12 @@ from sqlalchemy import MetaData, func
 from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask_bcrypt import Bcrypt
+from hashing import password_hasher
+from replicas import RoutingSession
+from datetime import datetime
 metadata = MetaData()
-db = SQLAlchemy(metadata=metadata)
+# Reads can be routed to replicas, see replicas.py
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 
 class Menu_item(db.Model, SerializerMixin):
@@ -32,7 +36,7 @@ class Menu_item(db.Model, SerializerMixin):
             return ValueError("Meal image must be present for integrity")
         return value
     
-    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'))
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), index=True)
     
     restaurant = db.relationship("Restaurant", back_populates="menu_items")
     order_items = db.relationship('Order_Item', back_populates="menu_item", cascade="all, delete-orphan")
@@ -45,8 +49,8 @@ class Order_Item(db.Model, SerializerMixin):
     quantity = db.Column(db.Integer)
     price = db.Column(db.Integer)
     
-    menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_items.id'))
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'))
+    menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_items.id'), index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), index=True)
     
     order = db.relationship("Order", back_populates="order_items")
     menu_item = db.relationship("Menu_item", back_populates="order_items")
@@ -59,16 +63,22 @@ class Order_Item(db.Model, SerializerMixin):
 
 class Order(db.Model, SerializerMixin):
     __tablename__ = 'orders'
-    serialize_rules = ('id', 'status', 'total_price', 'delivery_time', 'delivery_address')
+    serialize_only = ('id', 'status', 'version', 'total_price', 'delivery_time', 'delivery_address')
+    # Leads with restaurant_id, so it also serves plain per-restaurant lookups
+    __table_args__ = (
+        db.Index('ix_orders_restaurant_id_status_delivery_time', 'restaurant_id', 'status', 'delivery_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     status = db.Column(db.String)
+    # Bumped by every status change, writers compare-and-swap on it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     total_price = db.Column(db.Integer)
     # validation
     delivery_time = db.Column(db.DateTime, default=func.datetime('now', '+1 hour'))
     delivery_address = db.Column(db.String)
     
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'))
     
     user = db.relationship("User", back_populates="orders")
@@ -84,19 +94,44 @@ class Order(db.Model, SerializerMixin):
 class Restaurant(db.Model, SerializerMixin):
     __tablename__ = 'restaurants'
     
-    serialize_rules = ('-orders.restaurant', '-menu_items.restaurant',)
+    serialize_rules = ('-orders.restaurant', '-menu_items.restaurant', '-version', '-updated_at',)
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     address = db.Column(db.String)
-    cuisine = db.Column(db.String, nullable=False)
+    cuisine = db.Column(db.String, nullable=False, index=True)
     menu = db.Column(db.String)
-    rating = db.Column(db.String)
+    rating = db.Column(db.String, index=True)
     reviews = db.Column(db.String)
+    # Geocoded from address, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Bumped on every change to the restaurant or its menu, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     orders = db.relationship("Order", back_populates="restaurant", cascade="all, delete-orphan")
     menu_items = db.relationship("Menu_item", back_populates="restaurant", cascade="all, delete-orphan")
     
+# Rollups maintained as orders are written, so dashboards read buckets not orders
+class Daily_Order_Stat(db.Model):
+    __tablename__ = 'daily_order_stats'
+
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+class Daily_Item_Stat(db.Model):
+    __tablename__ = 'daily_item_stats'
+
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    menu_item_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
 class User(db.Model, SerializerMixin):
     __tablename__ = 'users'
     serialize_rules = ('-orders.user',)
@@ -116,11 +151,10 @@ class User(db.Model, SerializerMixin):
     def password_hash(self):
         raise Exception('Password hashes may not be viewed.')
 
+    # Hashing runs on the password_hasher pool and may raise HasherBusy
     @password_hash.setter
     def password_hash(self, password):
-        password_hash = bcrypt.generate_password_hash(
-            password.encode('utf-8'))
-        self._password_hash = password_hash.decode('utf-8')
+        self._password_hash = password_hasher.hash(password)
         
     @property
     def password(self):
@@ -131,8 +165,7 @@ class User(db.Model, SerializerMixin):
         self.password_hash = password
 
     def authenticate(self, password):
-        return bcrypt.check_password_hash(
-            self._password_hash, password.encode('utf-8'))
+        return password_hasher.check(self._password_hash, password)
         
     @validates('_password_hash')
     def validate_password_hash(self, key, password_hash):
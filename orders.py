@@ -0,0 +1,185 @@
+# Batch order placement.
+# Every order in a batch is validated up front, prices come from the menu in a
+# single query, and all Order and Order_Item rows are written with executemany
+# inserts inside one transaction, together with the dashboard rollups. Once it
+# commits, each new order is published to the order event stream.
+# Status changes follow TRANSITIONS and are written with a compare-and-swap on
+# Order.version, so concurrent writers never hold row locks or overwrite each other.
+from datetime import datetime
+from sqlalchemy import insert, update
+from models import db, Menu_item, Order, Order_Item
+from stats import record_orders, record_status_change
+from events import order_events
+
+MAX_BATCH_SIZE = 500
+# The columns an order's row is told apart by, user_id and status are the same for a whole batch
+ORDER_KEY = ('restaurant_id', 'delivery_time', 'delivery_address', 'total_price')
+
+# Order status state machine, Completed and Cancelled are final
+TRANSITIONS = {
+    'Pending': ('Preparing', 'Cancelled'),
+    'Preparing': ('Dispatched', 'Cancelled'),
+    'Dispatched': ('Completed', 'Cancelled'),
+}
+# Clients may only call off an order the kitchen has not started
+CLIENT_TRANSITIONS = {
+    'Pending': ('Cancelled',),
+}
+
+class BatchError(Exception):
+    pass
+
+class InvalidTransition(Exception):
+    pass
+
+class VersionConflict(Exception):
+    def __init__(self, current):
+        super().__init__("The order was changed by someone else")
+        self.current = current
+
+def parse_delivery_time(value):
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        raise ValueError("delivery_time must be an ISO 8601 string")
+    return datetime.fromisoformat(value)
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# The batch is written with Core inserts, which skip the models' @validates
+# hooks, so every column it writes is checked here
+def validate_order(data, menu):
+    if not isinstance(data, dict):
+        raise ValueError("Each order must be an object")
+    for field in ['restaurant_id', 'delivery_time', 'delivery_address', 'items']:
+        if field not in data:
+            raise ValueError(f"Missing required field: {field}")
+    if not is_id(data['restaurant_id']):
+        raise ValueError("restaurant_id must be an integer")
+    address = data['delivery_address']
+    if not isinstance(address, str) or not address.strip():
+        raise ValueError("delivery_address must be a non-empty string")
+    items = data['items']
+    if not isinstance(items, list) or not items:
+        raise ValueError("An order needs at least one item")
+
+    lines = []
+    for item in items:
+        menu_item_id = item.get('menu_item_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            raise ValueError(f"Invalid quantity for menu item {menu_item_id}")
+        if not is_id(menu_item_id):
+            raise ValueError("menu_item_id must be an integer")
+        row = menu.get(menu_item_id)
+        if row is None or row.restaurant_id != data['restaurant_id']:
+            raise ValueError(f"Menu item {menu_item_id} is not on restaurant {data['restaurant_id']}'s menu")
+        if row.price is None or row.price < 1:
+            raise ValueError(f"Menu item {menu_item_id} has no valid price")
+        lines.append((menu_item_id, quantity, row.price))
+
+    return {
+        'restaurant_id': data['restaurant_id'],
+        'delivery_time': parse_delivery_time(data['delivery_time']),
+        'delivery_address': data['delivery_address'],
+        'total_price': sum(quantity * price for _, quantity, price in lines),
+    }, lines
+
+def place_orders(user_id, orders_data):
+    if not isinstance(orders_data, list) or not orders_data:
+        raise BatchError("orders must be a non-empty list")
+    if len(orders_data) > MAX_BATCH_SIZE:
+        raise BatchError(f"A batch holds at most {MAX_BATCH_SIZE} orders")
+
+    # One query for every menu item referenced anywhere in the batch
+    menu_item_ids = {
+        item['menu_item_id']
+        for data in orders_data if isinstance(data, dict) and isinstance(data.get('items'), list)
+        for item in data['items'] if isinstance(item, dict) and is_id(item.get('menu_item_id'))
+    }
+    menu = {
+        row.id: row for row in db.session.query(Menu_item.id, Menu_item.restaurant_id, Menu_item.price)
+        .filter(Menu_item.id.in_(menu_item_ids))
+    } if menu_item_ids else {}
+
+    results = []
+    valid = []
+    for index, data in enumerate(orders_data):
+        try:
+            order, lines = validate_order(data, menu)
+        except ValueError as e:
+            results.append({'index': index, 'error': str(e)})
+            continue
+        order.update(user_id=user_id, status='Pending')
+        results.append({'index': index, 'total_price': order['total_price']})
+        valid.append((results[-1], order, lines))
+
+    if not valid:
+        return results, []
+
+    # RETURNING rows come back in no particular order, and asking for parameter
+    # order makes SQLite send one INSERT per row. Rows are matched back to their
+    # orders on the columns that vary instead; orders equal on all of them are
+    # interchangeable, so whichever id each one gets is consistent
+    returned = {}
+    for row in db.session.execute(
+        insert(Order).returning(Order.id, *(getattr(Order, column) for column in ORDER_KEY)),
+        [order for _, order, _ in valid]
+    ):
+        returned.setdefault(tuple(row[1:]), []).append(row[0])
+    order_ids = [returned[tuple(order[column] for column in ORDER_KEY)].pop() for _, order, _ in valid]
+    db.session.execute(insert(Order_Item), [
+        {'order_id': order_id, 'menu_item_id': menu_item_id, 'quantity': quantity, 'price': price}
+        for order_id, (_, _, lines) in zip(order_ids, valid)
+        for menu_item_id, quantity, price in lines
+    ])
+    record_orders(
+        [(order['restaurant_id'], order['delivery_time'], order['status'], order['total_price']) for _, order, _ in valid],
+        [
+            (order['restaurant_id'], order['delivery_time'], menu_item_id, quantity, quantity * price)
+            for _, order, lines in valid
+            for menu_item_id, quantity, price in lines
+        ]
+    )
+    db.session.commit()
+
+    for order_id, (result, order, _) in zip(order_ids, valid):
+        result['order_id'] = order_id
+        result['status'] = 'Pending'
+        order_events.order_event('order.created', dict(order, id=order_id, version=1))
+    return results, order_ids
+
+def order_state(order_id):
+    return db.session.query(
+        Order.id, Order.user_id, Order.restaurant_id, Order.status, Order.version,
+        Order.total_price, Order.delivery_time
+    ).filter(Order.id == order_id).first()
+
+def change_status(order_id, new_status, expected_version=None, transitions=TRANSITIONS, user_id=None):
+    # Returns the updated order as a dict, or None when there is no such order
+    # (or, with user_id, no such order for that user)
+    order = order_state(order_id)
+    if order is None or (user_id is not None and order.user_id != user_id):
+        return None
+    if expected_version is not None and expected_version != order.version:
+        raise VersionConflict(order)
+    if new_status not in transitions.get(order.status, ()):
+        raise InvalidTransition(f"Cannot change an order from {order.status} to {new_status}")
+
+    # The read above takes no lock, the version check makes the write safe
+    changed = db.session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.version == order.version)
+        .values(status=new_status, version=Order.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not changed:
+        db.session.rollback()
+        raise VersionConflict(order_state(order_id))
+    record_status_change(order_id, order.restaurant_id, order.delivery_time, order.status, new_status, order.total_price)
+    db.session.commit()
+
+    updated = dict(order._mapping, status=new_status, version=order.version + 1)
+    order_events.order_event('order.status', updated, previous_status=order.status)
+    return updated
@@ -0,0 +1,277 @@
+# Opt-in request profiling.
+# With PROFILING_ENABLED every request's duration lands in a per-route histogram,
+# a streamed one's once its body has been sent and closed.
+# A PROFILING_SAMPLE_RATE fraction of requests is also broken down by phase
+# (sql, hash, serialize, json, app for the rest), answered with a Server-Timing
+# header and checked for statements run PROFILING_N_PLUS_ONE times or more, the
+# usual sign of an N+1. Unsampled requests only pay for two clock reads, which
+# keeps the overhead well under 1%. Metrics are served in Prometheus text format
+# at PROFILING_METRICS_PATH; every worker process keeps and serves its own. The
+# endpoint is there whenever METRICS_ENABLED is, so the collectors other modules
+# add (pool occupancy, rate limiting) can be scraped without profiling requests.
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from flask import Response, g, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_profile', default=None)
+_noop = nullcontext()
+
+class RequestProfile:
+    # Phases are timed exclusively: SQL run while serializing counts as sql only
+    def __init__(self):
+        self.phases = {}
+        self.stack = []
+        self.queries = 0
+        self.statements = {}
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            parent = self.stack[-1]
+            self.phases[parent[0]] = self.phases.get(parent[0], 0.0) + now - parent[1]
+        self.stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        name, started = self.stack.pop()
+        self.phases[name] = self.phases.get(name, 0.0) + now - started
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def repeated(self, threshold):
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+    def server_timing(self, total):
+        parts = []
+        for name, seconds in sorted(self.phases.items()):
+            entry = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'sql':
+                entry += f';desc="{self.queries} queries"'
+            parts.append(entry)
+        parts.append(f'app;dur={max(total - sum(self.phases.values()), 0) * 1000:.2f}')
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+class _Phase:
+    __slots__ = ('profile', 'name')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.profile.exit()
+
+def phase(name):
+    # Times a block as `name` when the current request is sampled, a no-op otherwise
+    profile = _current.get()
+    return _noop if profile is None else _Phase(profile, name)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is not None:
+        profile.queries += 1
+        profile.statements[statement] = profile.statements.get(statement, 0) + 1
+        profile.enter('sql')
+
+def _after_cursor_execute(*args):
+    profile = _current.get()
+    if profile is not None and profile.stack and profile.stack[-1][0] == 'sql':
+        profile.exit()
+
+class Histogram:
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in sorted(self.series.items())]
+        for labels, counts, total in snapshot:
+            label_text = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{{{label_text},{le}}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+class Counter:
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = sorted(self.values.items())
+        for labels, value in snapshot:
+            lines.append(f'{self.name}{{{_labels(self.label_names, labels)}}} {value}')
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+class ProfiledJSONProvider(DefaultJSONProvider):
+    # Times the app's own provider when given one, so it keeps doing the encoding
+    def __init__(self, app, provider=None):
+        super().__init__(app)
+        self.provider = provider
+
+    def dumps(self, obj, **kwargs):
+        with phase('json'):
+            if self.provider is not None:
+                return self.provider.dumps(obj, **kwargs)
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.provider is not None:
+            return self.provider.loads(s, **kwargs)
+        return super().loads(s, **kwargs)
+
+class Profiler:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.n_plus_one = 5
+        self.metrics_path = '/metrics'
+        self.logger = None
+        self.collectors = []
+        self.durations = Histogram('http_request_duration_seconds', 'Request duration',
+                                   ('route', 'method'), DURATION_BUCKETS)
+        self.requests = Counter('http_requests_total', 'Requests by status', ('route', 'method', 'status'))
+        self.phases = Histogram('http_request_phase_seconds', 'Time per phase of sampled requests',
+                                ('route', 'phase'), DURATION_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', 'SQL statements per sampled request',
+                                 ('route',), QUERY_BUCKETS)
+        self.repeats = Counter('db_repeated_statements_total',
+                               'Sampled requests that repeated a statement, likely N+1', ('route',))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.01)
+        app.config.setdefault('PROFILING_N_PLUS_ONE', 5)
+        app.config.setdefault('PROFILING_METRICS_PATH', '/metrics')
+        app.config.setdefault('METRICS_ENABLED', True)
+
+        self.enabled = app.config['PROFILING_ENABLED']
+        self.sample_rate = app.config['PROFILING_SAMPLE_RATE']
+        self.n_plus_one = app.config['PROFILING_N_PLUS_ONE']
+        self.metrics_path = app.config['PROFILING_METRICS_PATH']
+        self.logger = app.logger
+        if app.config['METRICS_ENABLED']:
+            app.add_url_rule(self.metrics_path, 'metrics', self.metrics)
+        if not self.enabled:
+            return
+
+        # Keep whatever the app configured on its JSON provider
+        previous = app.json
+        app.json = ProfiledJSONProvider(app, previous)
+        for attr in ('ensure_ascii', 'sort_keys', 'compact', 'mimetype'):
+            setattr(app.json, attr, getattr(previous, attr))
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _after_cursor_execute)
+
+        # Registered first so the timing covers the other request hooks
+        app.before_request_funcs.setdefault(None, []).insert(0, self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        g.profile_started = time.perf_counter()
+        if self.sample_rate and random.random() < self.sample_rate:
+            _current.set(RequestProfile())
+
+    def _after_request(self, response):
+        started = g.get('profile_started')
+        if started is None or request.path == self.metrics_path:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = (route, request.method, response.status_code)
+        if response.is_streamed:
+            # The body is generated after this hook, the request ends when it is closed
+            response.call_on_close(lambda: self._observe(labels, time.perf_counter() - started))
+        else:
+            self._observe(labels, elapsed)
+
+        profile = _current.get()
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.server_timing(elapsed)
+            for name, seconds in profile.phases.items():
+                self.phases.observe((route, name), seconds)
+            self.queries.observe((route,), profile.queries)
+            repeated = profile.repeated(self.n_plus_one)
+            if repeated:
+                self.repeats.inc((route,))
+                statement, count = max(repeated.items(), key=lambda item: item[1])
+                self.logger.warning("%s %s ran the same statement %d times (possible N+1): %s",
+                                    request.method, route, count, statement)
+        return response
+
+    def _observe(self, labels, elapsed):
+        route, method, status = labels
+        self.durations.observe((route, method), elapsed)
+        self.requests.inc(labels)
+
+    def _teardown_request(self, exc):
+        _current.set(None)
+
+    def add_collector(self, render):
+        # render() returns extra metric lines for the metrics endpoint
+        self.collectors.append(render)
+
+    def metrics(self):
+        lines = []
+        if self.enabled:
+            for metric in (self.durations, self.requests, self.phases, self.queries, self.repeats):
+                lines.extend(metric.render())
+        for render in self.collectors:
+            lines.extend(render())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+profiler = Profiler()
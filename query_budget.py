@@ -0,0 +1,114 @@
+# Counts the SQL statements an endpoint runs so N+1 regressions get caught.
+# Use it from a test or run it directly against the configured database:
+#   python query_budget.py
+# The response cache is switched off while counting, otherwise a warm entry
+# would hide the queries. The authenticated budgets need logged-in clients and
+# are checked from tests/test_query_budget.py.
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Maximum number of statements each read endpoint may run, {id} is filled
+# with an existing restaurant id. Detail and menu include the version read
+# that keys their cache entries
+ENDPOINT_BUDGETS = {
+    '/restaurants': 1,
+    '/restaurants/{id}': 2,
+    '/restaurant/{id}/menu': 3,
+    '/restaurant/{id}/order': 2,
+}
+
+# Counted with a client logged in as the role. {menu_item_id} is filled with an
+# item of the restaurant, and the client is expected to have ordered there
+AUTHENTICATED_BUDGETS = [
+    # (method, route, role, json body, budget)
+    ('GET', '/check_session', 'client', None, 2),
+    ('GET', '/user/orders', 'client', None, 1),
+    ('PATCH', '/restaurants/{id}', 'restaurant_owner', {'reviews': 'Still great'}, 7),
+    ('PATCH', '/menu/item/{menu_item_id}', 'restaurant_owner', {'price': 250}, 8),
+    ('PATCH', '/restaurant/{id}/menu', 'restaurant_owner',
+     [{'name': 'Budget dish', 'price': 300, 'image': 'dish.png'}], 5),
+]
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+@contextmanager
+def query_budget(engine, budget, label='block'):
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > budget:
+        statements = '\n'.join(counter.statements)
+        raise QueryBudgetExceeded(f"{label} ran {counter.count} queries, budget is {budget}:\n{statements}")
+
+@contextmanager
+def response_cache_disabled():
+    from cache import response_cache
+    enabled = response_cache.enabled
+    response_cache.enabled = False
+    try:
+        yield
+    finally:
+        response_cache.enabled = enabled
+
+def check_budgets(client, engine, restaurant_id, budgets=ENDPOINT_BUDGETS):
+    results = {}
+    with response_cache_disabled():
+        for route, budget in budgets.items():
+            url = route.format(id=restaurant_id)
+            with query_budget(engine, budget, label=url) as counter:
+                response = client.get(url)
+            if response.status_code >= 400:
+                raise QueryBudgetExceeded(f"{url} returned {response.status_code}")
+            results[url] = counter.count
+    return results
+
+def check_authenticated_budgets(clients, engine, restaurant_id, menu_item_id, budgets=AUTHENTICATED_BUDGETS):
+    # clients maps a role to a test client logged in with it
+    results = {}
+    with response_cache_disabled():
+        for method, route, role, body, budget in budgets:
+            url = route.format(id=restaurant_id, menu_item_id=menu_item_id)
+            label = f'{method} {url} as {role}'
+            with query_budget(engine, budget, label=label) as counter:
+                response = clients[role].open(url, method=method, json=body)
+            if response.status_code >= 400:
+                raise QueryBudgetExceeded(f"{label} returned {response.status_code}")
+            results[label] = counter.count
+    return results
+
+if __name__ == '__main__':
+    from app import app
+    from models import db, Restaurant
+
+    with app.app_context():
+        restaurant = Restaurant.query.first()
+        if restaurant is None:
+            raise SystemExit("Seed the database first (python seed.py)")
+        restaurant_id = restaurant.id
+        engine = db.engine
+
+    results = check_budgets(app.test_client(), engine, restaurant_id)
+    for url, count in results.items():
+        print(f"{url}: {count} queries")
@@ -0,0 +1,166 @@
+# Token-bucket rate limiting.
+# Every client has one bucket, keyed by session user_id or, before login, by
+# client IP. It holds up to RATE_LIMIT_BURST tokens and refills at
+# RATE_LIMIT_PER_SECOND. Each request spends its route's cost (RATE_LIMIT_COSTS,
+# keyed by "METHOD endpoint" or endpoint, 1 otherwise), so bcrypt-bound logins
+# and heavy writes drain it faster than cached reads. An empty bucket gets a 429
+# with Retry-After before the view runs.
+# MemoryBucketStore limits per worker. SqliteBucketStore keeps the buckets in a
+# local file so all workers on a host share them, the stand-in for a shared
+# store. Any object with take() can be plugged in.
+# Behind a proxy, wrap the app in werkzeug's ProxyFix so remote_addr is the client.
+import math
+import threading
+import time
+from flask import make_response, request, session
+from profiling import Counter
+from localdb import LocalSqlite
+
+rejections = Counter('rate_limited_requests_total', 'Requests refused by the rate limiter', ('endpoint',))
+
+class BucketStore:
+    # take() spends cost tokens if the bucket has them. Returns 0.0 when
+    # admitted, else the seconds until cost tokens will be available
+    def take(self, key, cost, rate, burst):
+        raise NotImplementedError
+
+def refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + (now - updated_at) * rate)
+
+class MemoryBucketStore(BucketStore):
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else refill(bucket[0], bucket[1], now, rate, burst)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (cost - tokens) / rate
+            if len(self._buckets) > self.max_keys:
+                self._sweep(now, rate, burst)
+        return wait
+
+    def _sweep(self, now, rate, burst):
+        # Full buckets carry no state, dropping them is free
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            if refill(tokens, updated_at, now, rate, burst) >= burst:
+                del self._buckets[key]
+        # Still too many active clients, forget the oldest inserted, with some
+        # headroom so the next new client does not sweep again
+        for key in list(self._buckets)[:len(self._buckets) - self.max_keys * 9 // 10]:
+            del self._buckets[key]
+
+class SqliteBucketStore(LocalSqlite, BucketStore):
+    def __init__(self, path, prune_every=1000):
+        super().__init__(path)
+        self.prune_every = prune_every
+        self._takes = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+
+    def take(self, key, cost, rate, burst):
+        conn = self._connect()
+        # The wall clock, monotonic clocks are not comparable between processes
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else refill(row[0], row[1], now, rate, burst)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (key, tokens - cost if not wait else tokens, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._takes += 1
+        if self._takes % self.prune_every == 0:
+            self.prune(rate, burst)
+        return wait
+
+    def prune(self, rate, burst):
+        # Rows whose bucket has refilled completely
+        self._connect().execute(
+            'DELETE FROM rate_buckets WHERE tokens + (? - updated_at) * ? >= ?', (time.time(), rate, burst)
+        )
+
+class RateLimiter:
+    def __init__(self, app=None, store=None):
+        self.store = store
+        self.enabled = True
+        self.rate = 10.0
+        self.burst = 50.0
+        self.costs = {}
+        # The metrics endpoint is scraped, never throttled
+        self.exempt = {'metrics'}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, profiler=None):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_PER_SECOND', 10.0)
+        app.config.setdefault('RATE_LIMIT_BURST', 50.0)
+        app.config.setdefault('RATE_LIMIT_COSTS', {})
+        app.config.setdefault('RATE_LIMIT_PATH', None)
+        app.config.setdefault('RATE_LIMIT_MAX_KEYS', 100000)
+
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.rate = app.config['RATE_LIMIT_PER_SECOND']
+        self.burst = app.config['RATE_LIMIT_BURST']
+        self.costs = dict(app.config['RATE_LIMIT_COSTS'])
+        if self.store is None:
+            if app.config['RATE_LIMIT_PATH']:
+                self.store = SqliteBucketStore(app.config['RATE_LIMIT_PATH'])
+            else:
+                self.store = MemoryBucketStore(app.config['RATE_LIMIT_MAX_KEYS'])
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        if profiler is not None:
+            profiler.add_collector(rejections.render)
+
+    def cost(self, method, endpoint):
+        cost = self.costs.get(f'{method} {endpoint}')
+        if cost is None:
+            cost = self.costs.get(endpoint, 1)
+        # A cost above the burst could never be paid
+        return min(cost, self.burst)
+
+    def admit(self, user_id, remote_addr, method, endpoint):
+        # Returns None when admitted, else the seconds the client should wait
+        cost = self.cost(method, endpoint)
+        if not cost:
+            return None
+        key = f'user:{user_id}' if user_id is not None else f'ip:{remote_addr}'
+        wait = self.store.take(key, cost, self.rate, self.burst)
+        if not wait:
+            return None
+        rejections.inc((endpoint,))
+        return wait
+
+    @staticmethod
+    def retry_after(wait):
+        return str(max(math.ceil(wait), 1))
+
+    def _before_request(self):
+        # Preflights carry no cookies, and static or unknown routes cost nothing to serve
+        if request.method == 'OPTIONS' or request.endpoint is None or request.endpoint in self.exempt:
+            return None
+        wait = self.admit(session.get('user_id'), request.remote_addr, request.method, request.endpoint)
+        if wait is None:
+            return None
+        return make_response({"error": "Too many requests, slow down"}, 429, {'Retry-After': self.retry_after(wait)})
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,155 @@
+# Read-replica routing.
+# DATABASE_REPLICA_URIS adds one bind per replica. GET and HEAD requests pick a
+# replica (round_robin or least_connections on this worker's pools) and their
+# SELECTs go there, anything else runs on the primary. The first write in a
+# request pins the rest of it to the primary, and a client that wrote keeps
+# reading from the primary for READ_YOUR_WRITES_SECONDS, tracked in its session,
+# so it sees its own orders straight after placing them.
+# A replica that refuses a connection is skipped for REPLICA_RETRY_SECONDS, with
+# every replica down reads fall back to the primary.
+# Locally, point DATABASE_URI and DATABASE_REPLICA_URIS at two SQLite files and
+# copy the primary over with `python replicas.py sync` to stand in for replication.
+import itertools
+import sys
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import DBAPIError
+
+READ_METHODS = ('GET', 'HEAD')
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.keys = []
+        self.strategy = 'round_robin'
+        self.window = 5
+        self.retry_seconds = 30
+        self.down = {}
+        self._turn = itertools.count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Must run before db.init_app, the replicas are registered as binds
+        app.config.setdefault('DATABASE_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STRATEGY', 'round_robin')
+        app.config.setdefault('READ_YOUR_WRITES_SECONDS', 5)
+        app.config.setdefault('REPLICA_RETRY_SECONDS', 30)
+
+        if app.config['REPLICA_STRATEGY'] not in ('round_robin', 'least_connections'):
+            raise ValueError(f"Unknown REPLICA_STRATEGY {app.config['REPLICA_STRATEGY']!r}")
+        self.strategy = app.config['REPLICA_STRATEGY']
+        self.window = app.config['READ_YOUR_WRITES_SECONDS']
+        self.retry_seconds = app.config['REPLICA_RETRY_SECONDS']
+        self.down = {}
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        self.keys = []
+        for index, uri in enumerate(app.config['DATABASE_REPLICA_URIS']):
+            key = f'replica_{index}'
+            binds[key] = uri
+            self.keys.append(key)
+        if not self.keys:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def choose(self, engines):
+        # None when every replica is marked down
+        now = time.monotonic()
+        keys = [key for key in self.keys if self.down.get(key, 0) <= now]
+        if not keys:
+            return None
+        turn = next(self._turn)
+        if self.strategy == 'least_connections':
+            # Start the scan at a rotating offset so ties still spread out
+            keys = keys[turn % len(keys):] + keys[:turn % len(keys)]
+            return min(keys, key=lambda key: engines[key].pool.checkedout())
+        return keys[turn % len(keys)]
+
+    def mark_down(self, key):
+        self.down[key] = time.monotonic() + self.retry_seconds
+
+    def connect(self, engines):
+        # Chooses a replica that accepts a connection, marking the ones that refuse down.
+        # The probe is a pool checkout, so it only reaches the server for a new connection
+        while True:
+            key = self.choose(engines)
+            if key is None:
+                return None
+            try:
+                engines[key].connect().close()
+            except DBAPIError:
+                self.mark_down(key)
+            else:
+                return key
+
+    def _before_request(self):
+        if request.method not in READ_METHODS:
+            return
+        wrote_at = session.get('wrote_at')
+        if wrote_at is not None and time.time() - wrote_at < self.window:
+            return
+        g.read_replica = True
+
+    def _after_request(self, response):
+        if g.get('db_wrote') and self.window:
+            session['wrote_at'] = time.time()
+        return response
+
+    @contextmanager
+    def primary(self):
+        # Reads that feed a shared cache must not pick up a lagging replica
+        previous = g.get('read_replica')
+        g.read_replica = None
+        try:
+            yield
+        finally:
+            g.read_replica = previous
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replica_router.keys and has_app_context():
+            if getattr(clause, 'is_select', False) and not self._flushing:
+                replica = g.get('read_replica')
+                if replica is True:
+                    # Chosen on the first read, one replica serves the whole request
+                    replica = g.read_replica = replica_router.connect(self._db.engines)
+                if replica is not None:
+                    return self._db.engines[replica]
+            else:
+                g.read_replica = None
+                g.db_wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+replica_router = ReplicaRouter()
+
+def sync_sqlite(primary, replicas):
+    # Copies the primary SQLite file over each replica with the online backup API
+    import sqlite3
+
+    source = sqlite3.connect(primary)
+    try:
+        for replica in replicas:
+            target = sqlite3.connect(replica)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['sync']:
+        raise SystemExit('usage: python replicas.py sync')
+    from app import app
+
+    def sqlite_path(uri):
+        if not uri.startswith('sqlite:///'):
+            raise SystemExit(f'sync only copies SQLite files, got {uri}')
+        return uri[len('sqlite:///'):]
+
+    sync_sqlite(sqlite_path(app.config['SQLALCHEMY_DATABASE_URI']),
+                [sqlite_path(uri) for uri in app.config['DATABASE_REPLICA_URIS']])
+    print(f"Copied the primary to {len(app.config['DATABASE_REPLICA_URIS'])} replica(s)")
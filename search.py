@@ -0,0 +1,263 @@
+# In-process search over restaurants and menu items.
+# An inverted index (term -> {doc: weight}) is built on first use and kept current
+# two ways: the write handlers re-index the restaurant they touched, and every
+# SEARCH_REFRESH_SECONDS each worker re-indexes restaurants whose updated_at moved,
+# which picks up writes made by other workers. Menu writes bump the restaurant's
+# updated_at, so a restaurant is always re-indexed together with its menu.
+# The last query word is matched as a prefix for typeahead. A word that matches
+# nothing is retried against the terms within one typo of it (two from eight
+# letters up) that share its first letter; words under four letters are not.
+import math
+import re
+from bisect import bisect_left, insort
+from heapq import merge, nlargest, nsmallest
+from models import db, Menu_item, Restaurant
+from indexsync import SyncedIndex
+
+TOKEN = re.compile(r'\w+')
+MAX_PREFIX_TERMS = 64
+PREFIX_PENALTY = 0.8
+MAX_FUZZY_TERMS = 16
+# Per typo, a corrected word counts less than one spelled right
+FUZZY_PENALTY = 0.5
+
+# Field weights, a hit in a name counts more than one in a description
+RESTAURANT_FIELDS = (('name', 3.0), ('cuisine', 2.0))
+MENU_ITEM_FIELDS = (('name', 3.0), ('description', 1.0))
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+def max_typos(word):
+    return 0 if len(word) < 4 else 1 if len(word) < 8 else 2
+
+def edit_distance(a, b, bound):
+    # Insertions, deletions, substitutions and swaps of adjacent letters, or
+    # bound + 1 as soon as the distance is known to be over bound
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = previous[j - 1] + (a[i - 1] != b[j - 1])
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(min(previous[j] + 1, current[j - 1] + 1, cost))
+        if min(current) > bound:
+            return bound + 1
+        before, previous = previous, current
+    return previous[-1]
+
+# Documents are keyed by plain ints, which hash far faster than tuples:
+# menu items by their id, restaurants by their negated id
+def restaurant_key(restaurant_id):
+    return -restaurant_id
+
+def _is_type(key, doc_type):
+    return (key < 0) == (doc_type == 'restaurant')
+
+class SearchIndex(SyncedIndex):
+    def __init__(self, app=None):
+        super().__init__()
+        self.postings = {}
+        self.ranked = {}
+        self.terms = []
+        self.docs = {}
+        self.doc_terms = {}
+        self.restaurant_items = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_REFRESH_SECONDS', 5)
+        self.refresh_seconds = app.config['SEARCH_REFRESH_SECONDS']
+
+    # Index maintenance
+
+    def _add_doc(self, key, doc, fields):
+        weights = {}
+        for field, weight in fields:
+            for term in tokenize(doc.get(field)):
+                weights[term] = weights.get(term, 0.0) + weight
+        self.docs[key] = doc
+        self.doc_terms[key] = list(weights)
+        for term, weight in weights.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                insort(self.terms, term)
+            postings[key] = weight
+            self.ranked.pop(term, None)
+
+    def _remove_doc(self, key):
+        for term in self.doc_terms.pop(key, ()):
+            postings = self.postings[term]
+            postings.pop(key, None)
+            self.ranked.pop(term, None)
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+        self.docs.pop(key, None)
+
+    def add_restaurant(self, restaurant_id, name, cuisine, menu_items=()):
+        with self._lock:
+            self.remove_restaurant(restaurant_id)
+            self._add_doc(restaurant_key(restaurant_id), {
+                'type': 'restaurant', 'id': restaurant_id, 'name': name, 'cuisine': cuisine,
+            }, RESTAURANT_FIELDS)
+            self.restaurant_items[restaurant_id] = []
+            for item_id, item_name, description, price in menu_items:
+                self.add_menu_item(item_id, restaurant_id, name, item_name, description, price)
+
+    def add_menu_item(self, item_id, restaurant_id, restaurant_name, name, description, price):
+        with self._lock:
+            self._add_doc(item_id, {
+                'type': 'menu_item', 'id': item_id, 'name': name, 'description': description,
+                'price': price, 'restaurant_id': restaurant_id, 'restaurant_name': restaurant_name,
+            }, MENU_ITEM_FIELDS)
+            self.restaurant_items.setdefault(restaurant_id, []).append(item_id)
+
+    def remove_restaurant(self, restaurant_id):
+        with self._lock:
+            for item_id in self.restaurant_items.pop(restaurant_id, ()):
+                self._remove_doc(item_id)
+            self._remove_doc(restaurant_key(restaurant_id))
+
+    # Database sync
+
+    def _load(self, restaurant_ids=None):
+        restaurants = db.session.query(Restaurant.id, Restaurant.name, Restaurant.cuisine)
+        items = db.session.query(
+            Menu_item.id, Menu_item.restaurant_id, Menu_item.name, Menu_item.description, Menu_item.price
+        )
+        if restaurant_ids is not None:
+            restaurants = restaurants.filter(Restaurant.id.in_(restaurant_ids))
+            items = items.filter(Menu_item.restaurant_id.in_(restaurant_ids))
+
+        menus = {}
+        for item_id, restaurant_id, name, description, price in items.yield_per(1000):
+            menus.setdefault(restaurant_id, []).append((item_id, name, description, price))
+        found = set()
+        for restaurant_id, name, cuisine in restaurants.yield_per(1000):
+            found.add(restaurant_id)
+            self.add_restaurant(restaurant_id, name, cuisine, menus.get(restaurant_id, ()))
+        for restaurant_id in set(restaurant_ids or ()) - found:
+            self.remove_restaurant(restaurant_id)
+
+    # Queries
+
+    def _ranked(self, term):
+        # Postings sorted by weight, rebuilt lazily after a write touches the term
+        ranked = self.ranked.get(term)
+        if ranked is None:
+            ranked = self.ranked[term] = sorted(
+                ((weight, key) for key, weight in self.postings[term].items()), reverse=True)
+        return ranked
+
+    def _sources(self, token, prefix):
+        # (term, score multiplier) pairs a query word matches
+        if not prefix:
+            return [(token, self._idf(token))] if token in self.postings else self._fuzzy(token)
+        sources = []
+        start = bisect_left(self.terms, token)
+        for term in self.terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(token):
+                break
+            # Exact hits score full weight, longer completions a little less
+            factor = 1.0 if term == token else PREFIX_PENALTY
+            sources.append((term, self._idf(term) * factor))
+        return sources or self._fuzzy(token)
+
+    def _fuzzy(self, token):
+        # Closest first. Only the terms sharing the first letter are compared,
+        # a contiguous run of the sorted vocabulary
+        bound = max_typos(token)
+        if not bound:
+            return []
+        matches = []
+        for i in range(bisect_left(self.terms, token[0]), len(self.terms)):
+            term = self.terms[i]
+            if term[0] != token[0]:
+                break
+            distance = edit_distance(token, term, bound)
+            if distance <= bound:
+                matches.append((distance, term))
+        return [(term, self._idf(term) * FUZZY_PENALTY ** distance)
+                for distance, term in nsmallest(MAX_FUZZY_TERMS, matches)]
+
+    def _idf(self, term):
+        return math.log(1 + len(self.docs) / len(self.postings[term]))
+
+    def _scored(self, term, multiplier):
+        for weight, key in self._ranked(term):
+            yield -weight * multiplier, key
+
+    def _top(self, sources, limit, doc_type):
+        # One query word: merge the sorted postings and stop after `limit` documents
+        streams = [self._scored(term, multiplier) for term, multiplier in sources]
+        seen = set()
+        results = []
+        for negative_score, key in merge(*streams):
+            if key in seen or (doc_type and not _is_type(key, doc_type)):
+                continue
+            seen.add(key)
+            results.append((key, -negative_score))
+            if len(results) == limit:
+                break
+        return results
+
+    def _intersect(self, token_sources, limit, doc_type):
+        # Several words: every one must match. The exact words are intersected with
+        # set operations, rarest first, then the prefix word narrows and scores the
+        # survivors. Only the last word is a prefix, the others count their first
+        # source only, the word itself or its closest correction.
+        exact = sorted((sources[0] for sources in token_sources[:-1]), key=lambda source: len(self.postings[source[0]]))
+        candidates = set(self.postings[exact[0][0]].keys())
+        for term, _ in exact[1:]:
+            candidates.intersection_update(self.postings[term].keys())
+            if not candidates:
+                return []
+
+        scores = {}
+        for term, multiplier in token_sources[-1]:
+            postings = self.postings[term]
+            if len(postings) < len(candidates):
+                hits = postings.keys() & candidates
+            else:
+                hits = [key for key in candidates if key in postings]
+            for key in hits:
+                score = postings[key] * multiplier
+                if score > scores.get(key, 0.0):
+                    scores[key] = score
+
+        lookups = [(self.postings[term], multiplier) for term, multiplier in exact]
+        scored = []
+        for key, score in scores.items():
+            if doc_type and not _is_type(key, doc_type):
+                continue
+            for postings, multiplier in lookups:
+                score += postings[key] * multiplier
+            scored.append((key, score))
+        return nlargest(limit, scored, key=lambda pair: pair[1])
+
+    def search(self, query, limit=20, doc_type=None):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            token_sources = []
+            for i, token in enumerate(tokens):
+                # The last word is still being typed, match it as a prefix
+                sources = self._sources(token, prefix=i == len(tokens) - 1)
+                if not sources:
+                    return []
+                token_sources.append(sources)
+
+            if len(token_sources) == 1:
+                best = self._top(token_sources[0], limit, doc_type)
+            else:
+                best = self._intersect(token_sources, limit, doc_type)
+            return [dict(self.docs[key], score=round(score, 4)) for key, score in best]
+
+search_index = SearchIndex()
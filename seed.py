@@ -1,115 +1,251 @@
 from faker import Faker
-from models import db, User, Restaurant, Menu_item, Order, Order_Item, bcrypt
+from models import db, bcrypt
+from stats import rebuild_rollups
+from geo import geocoder, point_in_area
+from multiprocessing import Pool
+from datetime import datetime, timedelta
+from sqlalchemy import insert, text
+import argparse
+import csv
+import io
 import random
-
-# Initializes the Faker
-fake = Faker()
+import time
+import zlib
+
+# Synthetic data generator, small by default and scalable for load tests:
+#   python seed.py --users 1e6 --restaurants 50k --menu-items 1M --orders 10M
+# Rows are generated in chunks on a process pool, each chunk with its own seed,
+# so the same --seed always gives the same dataset. Chunks are written with Core
+# executemany inserts, or COPY on PostgreSQL. Every user shares one password hash.
+
+CUISINES = ['African', 'Italian', 'Chinese', 'Indian', 'Mexican', 'American']
+STATUSES = ['Pending', 'Preparing', 'Dispatched', 'Completed', 'Cancelled']
+# I decided not to have an admin as  part of the generation
+ROLES = ['client', 'restaurant_owner']
+TABLE_COLUMNS = {
+    'users': ['id', 'name', 'email', '_password_hash', 'address', 'phone_number', 'payment_information', 'role'],
+    'restaurants': ['id', 'name', 'address', 'cuisine', 'menu', 'rating', 'reviews', 'latitude', 'longitude',
+                    'version', 'updated_at'],
+    'menu_items': ['id', 'name', 'description', 'price', 'image', 'restaurant_id'],
+    'orders': ['id', 'status', 'total_price', 'delivery_time', 'delivery_address', 'user_id', 'restaurant_id'],
+    'order_items': ['quantity', 'price', 'menu_item_id', 'order_id'],
+}
+
+def parse_count(value):
+    # Accepts 20, 1e6, 50k, 10M
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+# Menu items are spread evenly, so an item's restaurant and price follow from its id
+# and orders can reference them without reading anything back
+def menu_range(restaurant_id, num_restaurants, num_menu_items):
+    per_restaurant = max(num_menu_items // num_restaurants, 1)
+    first = (restaurant_id - 1) * per_restaurant + 1
+    return first, min(first + per_restaurant - 1, num_menu_items)
+
+def item_restaurant(item_id, num_restaurants, num_menu_items):
+    per_restaurant = max(num_menu_items // num_restaurants, 1)
+    return min((item_id - 1) // per_restaurant + 1, num_restaurants)
+
+def item_price(item_id, seed):
+    return 5 + (item_id * 2654435761 + seed) % 46
+
+def chunk_faker(seed, table, start):
+    # str hashes are salted per process, crc32 gives every worker the same chunk seed
+    chunk_seed = zlib.crc32(f'{seed}:{table}:{start}'.encode())
+    fake = Faker()
+    fake.seed_instance(chunk_seed)
+    return fake, random.Random(chunk_seed)
+
+def pool(fake, method, size):
+    # Faker calls cost tens of microseconds each, chunks draw from a small pool instead
+    return [getattr(fake, method)() for _ in range(size)]
 
 # Function to create the fake users
-def create_fake_users(num):
-    roles = ['client', 'restaurant_owner']
-    # I decided not to have an admin as  part of the generation 
-    for _ in range(num):
-        # Generate a random password
-        password = fake.password()
-        
-        user = User(
-            name=fake.name(),
-            email=fake.unique.email(),
-            address=fake.address(),
-            phone_number=fake.phone_number(),
-            payment_information=fake.credit_card_number(),
-            role=random.choice(roles)
-        )
-        user.password = password
-        db.session.add(user)
-    db.session.commit()
+def generate_users(task):
+    seed, start, stop, password_hash = task
+    fake, rng = chunk_faker(seed, 'users', start)
+    size = min(stop - start, 200)
+    first_names, last_names = pool(fake, 'first_name', size), pool(fake, 'last_name', size)
+    addresses, domains = pool(fake, 'address', size), pool(fake, 'free_email_domain', 10)
+    users = []
+    for user_id in range(start, stop):
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        users.append({
+            'id': user_id,
+            'name': f'{first} {last}',
+            # The id keeps emails unique without Faker's unique proxy
+            'email': f'{first}.{last}{user_id}@{rng.choice(domains)}'.lower(),
+            '_password_hash': password_hash,
+            'address': rng.choice(addresses),
+            'phone_number': '07' + str(rng.randrange(10 ** 8)).zfill(8),
+            'payment_information': fake.credit_card_number(),
+            'role': rng.choice(ROLES),
+        })
+    return 'users', users
 
 # Function to create fake restaurants
-def create_fake_restaurants(num):
-    for _ in range(num):
-        restaurant = Restaurant(
-            name=fake.company(),
-            address=fake.address(),
-            cuisine=random.choice(['African','Italian', 'Chinese', 'Indian', 'Mexican', 'American']),
-            menu='Menu items will be defined separately',
-            rating=str(random.randint(1, 5)),
-            reviews=fake.text(max_nb_chars=200)
-        )
-        db.session.add(restaurant)
-    db.session.commit()
+def generate_restaurants(task):
+    seed, start, stop, now, center, radius_km = task
+    fake, rng = chunk_faker(seed, 'restaurants', start)
+    addresses = pool(fake, 'address', min(stop - start, 200))
+    restaurants = []
+    for restaurant_id in range(start, stop):
+        # Addresses repeat within a chunk, so points are drawn over the geocoder's area instead
+        latitude, longitude = point_in_area(rng.random(), rng.random(), center, radius_km)
+        restaurants.append({
+            'id': restaurant_id,
+            'name': fake.company(),
+            'address': rng.choice(addresses),
+            'cuisine': rng.choice(CUISINES),
+            'menu': 'Menu items will be defined separately',
+            'rating': str(rng.randint(1, 5)),
+            'reviews': fake.text(max_nb_chars=200),
+            'latitude': latitude,
+            'longitude': longitude,
+            'version': 1,
+            'updated_at': now,
+        })
+    return 'restaurants', restaurants
 
 # Function to create fake menu items
-def create_fake_menu_items(num, restaurant_ids):
-    for _ in range(num):
-        menu_item = Menu_item(
-            name=fake.word(),
-            description=fake.sentence(),
-            price=random.randint(5, 50),
-            image=fake.image_url(),
-            restaurant_id=random.choice(restaurant_ids)
-        )
-        db.session.add(menu_item)
+def generate_menu_items(task):
+    seed, start, stop, num_restaurants, num_menu_items = task
+    fake, rng = chunk_faker(seed, 'menu_items', start)
+    return 'menu_items', [{
+        'id': item_id,
+        'name': fake.word(),
+        'description': fake.sentence(),
+        'price': item_price(item_id, seed),
+        'image': fake.image_url(),
+        'restaurant_id': item_restaurant(item_id, num_restaurants, num_menu_items),
+    } for item_id in range(start, stop)]
+
+# Function to create fake orders together with their order items
+def generate_orders(task):
+    seed, start, stop, num_users, num_restaurants, num_menu_items, max_items, now = task
+    fake, rng = chunk_faker(seed, 'orders', start)
+    addresses = pool(fake, 'address', min(stop - start, 200))
+    orders, order_items = [], []
+    for order_id in range(start, stop):
+        restaurant_id = rng.randint(1, num_restaurants)
+        first, last = menu_range(restaurant_id, num_restaurants, num_menu_items)
+        total = 0
+        if num_menu_items and first <= last:
+            for _ in range(rng.randint(1, max_items)):
+                item_id = rng.randint(first, last)
+                quantity = rng.randint(1, 5)
+                price = item_price(item_id, seed)
+                total += quantity * price
+                order_items.append({'quantity': quantity, 'price': price, 'menu_item_id': item_id, 'order_id': order_id})
+        orders.append({
+            'id': order_id,
+            'status': rng.choice(STATUSES),
+            'total_price': total or rng.randint(20, 200),
+            'delivery_time': now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600)),
+            'delivery_address': rng.choice(addresses),
+            'user_id': rng.randint(1, num_users),
+            'restaurant_id': restaurant_id,
+        })
+    return 'orders', (orders, order_items)
+
+def chunks(total, chunk_size):
+    for start in range(1, total + 1, chunk_size):
+        yield start, min(start + chunk_size, total + 1)
+
+def copy_rows(table, rows):
+    # PostgreSQL COPY is several times faster than INSERT for bulk loads
+    columns = TABLE_COLUMNS[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    connection = db.session.connection().connection
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+def write_rows(table, rows):
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(table, rows)
+    else:
+        db.session.execute(insert(db.metadata.tables[table]), rows)
+
+def load(pool, generator, tasks, label):
+    started = time.perf_counter()
+    count = 0
+    # imap keeps chunk order, so ids are inserted in sequence
+    for table, rows in pool.imap(generator, tasks):
+        if table == 'orders':
+            orders, order_items = rows
+            write_rows('orders', orders)
+            write_rows('order_items', order_items)
+            count += len(orders)
+        else:
+            write_rows(table, rows)
+            count += len(rows)
+        db.session.commit()
+    print(f'{label}: {count} rows in {time.perf_counter() - started:.1f} s')
+
+def reset_sequences():
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in ['users', 'restaurants', 'menu_items', 'orders']:
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"))
     db.session.commit()
 
-# Function to create fake orders
-def create_fake_orders(num, user_ids, restaurant_ids):
-    orders = []  
-    for _ in range(num):
-        order = Order(
-            status=random.choice(['Pending', 'Completed', 'Cancelled']),
-            total_price=random.randint(20, 200),
-            delivery_time=fake.date_time_this_month(),
-            delivery_address=fake.address(),
-            user_id=random.choice(user_ids),
-            restaurant_id=random.choice(restaurant_ids)
-        )
-        db.session.add(order)
-        orders.append(order)  
-    db.session.commit()  
-    return [order.id for order in orders]  
-
-# Function to create fake order items
-def create_fake_order_items(num, order_ids, menu_item_ids):
-    for _ in range(num):
-        order_item = Order_Item(
-            quantity=random.randint(1, 5),
-            price=random.randint(5, 50),
-            order_id=random.choice(order_ids),
-            menu_item_id=random.choice(menu_item_ids)
-        )
-        db.session.add(order_item)
-    db.session.commit()
+def seed_database(users, restaurants, menu_items, orders, max_items, seed, chunk_size, workers, password):
+    now = datetime.utcnow().replace(microsecond=0)
+    # Hashing once is enough, bcrypt per fake user would dominate the run
+    password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+
+    with Pool(workers) as pool:
+        load(pool, generate_users, [(seed, start, stop, password_hash) for start, stop in chunks(users, chunk_size)], 'users')
+        load(pool, generate_restaurants, [
+            (seed, start, stop, now, geocoder.center, geocoder.radius_km) for start, stop in chunks(restaurants, chunk_size)
+        ], 'restaurants')
+        load(pool, generate_menu_items, [
+            (seed, start, stop, restaurants, menu_items) for start, stop in chunks(menu_items, chunk_size)
+        ], 'menu items')
+        load(pool, generate_orders, [
+            (seed, start, stop, users, restaurants, menu_items, max_items, now)
+            for start, stop in chunks(orders, chunk_size)
+        ], 'orders')
+    reset_sequences()
+
+    # Dashboard rollups are normally maintained on write, build them for the seeded orders
+    rebuild_rollups()
 
 if __name__ == '__main__':
-    from app import app 
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Seed the database with synthetic data')
+    parser.add_argument('--users', type=parse_count, default=20)
+    parser.add_argument('--restaurants', type=parse_count, default=15)
+    parser.add_argument('--menu-items', type=parse_count, default=60)
+    parser.add_argument('--orders', type=parse_count, default=15)
+    parser.add_argument('--max-items-per-order', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=parse_count, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of CPUs')
+    parser.add_argument('--password', default='password', help='shared password of every seeded user')
+    args = parser.parse_args()
+    if args.users < 1 or args.restaurants < 1:
+        parser.error('at least one user and one restaurant are needed')
 
     with app.app_context():
         db.drop_all()
         # Create the database and tables
         db.create_all()
 
-        # Creates the fake data
-        num_users = 20
-        num_restaurants = 15
-        num_menu_items = 60
-        num_orders = 15
-        num_order_items = 30  
-
-        create_fake_users(num_users)
-
-        user_ids = [user.id for user in User.query.all()]
-
-        create_fake_restaurants(num_restaurants)
-
-        restaurant_ids = [restaurant.id for restaurant in Restaurant.query.all()]
-
-        create_fake_menu_items(num_menu_items, restaurant_ids)
-
-        order_ids = create_fake_orders(num_orders, user_ids, restaurant_ids)
-
-        menu_item_ids = [menu_item.id for menu_item in Menu_item.query.all()]
-
-        create_fake_order_items(num_order_items, order_ids, menu_item_ids)
+        seed_database(args.users, args.restaurants, args.menu_items, args.orders, args.max_items_per_order,
+                      args.seed, args.chunk_size, args.workers, args.password)
 
     print("Database seeded successfully!")
@@ -0,0 +1,94 @@
+# Precompiled serializers for the hot endpoints.
+# SerializerMixin.to_dict re-parses serialize_rules and inspects the mapper on every
+# call. A plan walks the same rules once, at import time, and remembers which
+# attributes to read and how to convert them, so serializing a row is a plain loop.
+# Plans produce the same dicts as to_dict() for the same rules.
+from datetime import date, datetime, time
+from decimal import Decimal
+from sqlalchemy import inspect
+from sqlalchemy.orm import ColumnProperty, RelationshipProperty
+from sqlalchemy_serializer.lib.schema import Schema
+from models import Menu_item, Order, Order_Item, Restaurant, User
+from profiling import phase
+
+def _converter(model, column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+
+    # Same formats SerializerMixin would use for this model
+    if issubclass(python_type, datetime):
+        fmt = model.datetime_format
+    elif issubclass(python_type, date):
+        fmt = model.date_format
+    elif issubclass(python_type, time):
+        fmt = model.time_format
+    elif issubclass(python_type, Decimal):
+        decimal_format = model.decimal_format
+        return lambda value: None if value is None else decimal_format.format(value)
+    else:
+        return None
+    return lambda value: None if value is None else value.strftime(fmt)
+
+class SerializerPlan:
+    def __init__(self, model, schema):
+        self.model = model
+        self.fields = []
+        self.relations = []
+
+        schema.update(only=model.serialize_only, extend=model.serialize_rules)
+        mapper = inspect(model)
+        keys = set(schema.keys)
+        if schema.is_greedy:
+            keys.update(attr.key for attr in mapper.attrs)
+
+        # Mapper order keeps the plan deterministic, to_dict iterates a set
+        ordered = [attr.key for attr in mapper.attrs if attr.key in keys]
+        ordered += sorted(keys.difference(ordered))
+
+        for key in ordered:
+            if not schema.is_included(key):
+                continue
+            prop = mapper.attrs.get(key)
+            if isinstance(prop, RelationshipProperty):
+                nested = SerializerPlan(prop.mapper.class_, schema.fork(key))
+                self.relations.append((key, nested, prop.uselist))
+            elif isinstance(prop, ColumnProperty):
+                self.fields.append((key, _converter(model, prop.columns[0])))
+            else:
+                self.fields.append((key, None))
+
+    def __call__(self, obj):
+        with phase('serialize'):
+            return self._serialize(obj)
+
+    def _serialize(self, obj):
+        res = {}
+        for key, convert in self.fields:
+            value = getattr(obj, key)
+            res[key] = convert(value) if convert else value
+        for key, nested, uselist in self.relations:
+            value = getattr(obj, key)
+            if uselist:
+                res[key] = [nested._serialize(item) for item in value]
+            else:
+                res[key] = None if value is None else nested._serialize(value)
+        return res
+
+    def many(self, objs):
+        with phase('serialize'):
+            return [self._serialize(obj) for obj in objs]
+
+def compile_plan(model, only=(), rules=()):
+    schema = Schema()
+    schema.update(only=only, extend=rules)
+    return SerializerPlan(model, schema)
+
+# Plans for the rule sets app.py serializes with
+restaurant_summary = compile_plan(Restaurant, rules=('-menu_items', '-orders',))
+restaurant_full = compile_plan(Restaurant)
+menu_item_full = compile_plan(Menu_item)
+order_full = compile_plan(Order)
+order_item_full = compile_plan(Order_Item)
+user_full = compile_plan(User)
@@ -0,0 +1,218 @@
+# Server-side sessions.
+# With SESSION_BACKEND=memory or sqlite the cookie only carries a random session
+# id and the data lives in a store, so nothing is re-signed or re-verified per
+# request, unchanged sessions are never written back, and all of a user's
+# sessions can be revoked at once. Sessions expire SESSION_TTL seconds after their
+# last write; the expiry slides forward once more than half of it has passed.
+# The id is replaced whenever the user behind a session changes (login, logout),
+# so an id planted before login is worthless after it.
+# MemorySessionStore serves one worker, SqliteSessionStore at SESSION_PATH is
+# shared by every worker on a host, the stand-in for a shared store. Any object
+# with get/save/delete/delete_user can be plugged in. The default, cookie, keeps
+# Flask's signed cookie sessions.
+import re
+import secrets
+import threading
+import time
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from localdb import LocalSqlite
+
+SID_PATTERN = re.compile(r'[A-Za-z0-9_-]{32}')
+
+def new_sid():
+    # 24 random bytes, 32 url-safe characters
+    return secrets.token_urlsafe(24)
+
+class SessionStore:
+    # get() returns (data, expires_at) or None for a missing or expired session
+    def get(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, expires_at):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    # Removes every session of the user, returns how many there were
+    def delete_user(self, user_id):
+        raise NotImplementedError
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions=100000):
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= time.time():
+                self._drop(sid)
+                return None
+            return dict(data), expires_at
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._drop(sid)
+            self._sessions[sid] = (dict(data), expires_at)
+            if data.get('user_id') is not None:
+                self._by_user.setdefault(data['user_id'], set()).add(sid)
+            if len(self._sessions) > self.max_sessions:
+                self._sweep()
+
+    def delete(self, sid):
+        with self._lock:
+            self._drop(sid)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = list(self._by_user.get(user_id, ()))
+            for sid in sids:
+                self._drop(sid)
+            return len(sids)
+
+    def _drop(self, sid):
+        entry = self._sessions.pop(sid, None)
+        if entry is not None and entry[0].get('user_id') is not None:
+            sids = self._by_user.get(entry[0]['user_id'])
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._by_user[entry[0]['user_id']]
+
+    def _sweep(self):
+        now = time.time()
+        for sid in [sid for sid, (_, expires_at) in self._sessions.items() if expires_at <= now]:
+            self._drop(sid)
+        # Still full, forget the oldest written, with headroom so the next save does not sweep again
+        for sid in list(self._sessions)[:len(self._sessions) - self.max_sessions * 9 // 10]:
+            self._drop(sid)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class SqliteSessionStore(LocalSqlite, SessionStore):
+    def __init__(self, path, prune_every=1000):
+        super().__init__(path)
+        self.prune_every = prune_every
+        self._saves = 0
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions '
+            '(sid TEXT PRIMARY KEY, user_id INTEGER, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)')
+
+    def get(self, sid):
+        row = self._connect().execute(
+            'SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?', (sid, time.time())
+        ).fetchone()
+        return (session_json_serializer.loads(row[0]), row[1]) if row else None
+
+    def save(self, sid, data, expires_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (sid, user_id, data, expires_at) VALUES (?, ?, ?, ?)',
+            (sid, data.get('user_id'), session_json_serializer.dumps(dict(data)), expires_at)
+        )
+        self._saves += 1
+        if self._saves % self.prune_every == 0:
+            conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+
+    def delete(self, sid):
+        self._connect().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def delete_user(self, user_id):
+        return self._connect().execute('DELETE FROM sessions WHERE user_id = ?', (user_id,)).rowcount
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        # The user as loaded, a change means a login or logout
+        self.loaded_user_id = self.get('user_id')
+        self.accessed = False
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SID_PATTERN.fullmatch(sid):
+            found = self.store.get(sid)
+            if found is not None:
+                return ServerSession(found[0], sid, found[1])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Emptied, drop it on both sides. A session that never existed sets nothing
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite)
+                response.vary.add('Cookie')
+            return
+
+        now = time.time()
+        stale = session.sid is not None and session.expires_at - now < self.ttl / 2
+        if not (session.modified or stale):
+            return
+        if session.sid is None or session.get('user_id') != session.loaded_user_id:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = new_sid()
+        session.expires_at = now + self.ttl
+        self.store.save(session.sid, session, session.expires_at)
+        response.set_cookie(
+            name, session.sid, max_age=int(self.ttl), domain=domain, path=path,
+            httponly=self.get_cookie_httponly(app), secure=secure, samesite=samesite,
+        )
+        response.vary.add('Cookie')
+
+class ServerSessions:
+    def __init__(self, app=None, store=None):
+        self.store = store
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_BACKEND', 'cookie')
+        app.config.setdefault('SESSION_TTL', 86400)
+        app.config.setdefault('SESSION_PATH', None)
+        app.config.setdefault('SESSION_MAX_ENTRIES', 100000)
+
+        backend = app.config['SESSION_BACKEND']
+        if backend not in ('cookie', 'memory', 'sqlite'):
+            raise ValueError(f'Unknown SESSION_BACKEND {backend!r}')
+        if self.store is None:
+            if backend == 'cookie':
+                return
+            if backend == 'sqlite':
+                if not app.config['SESSION_PATH']:
+                    raise ValueError('SESSION_BACKEND=sqlite needs SESSION_PATH')
+                self.store = SqliteSessionStore(app.config['SESSION_PATH'])
+            else:
+                self.store = MemorySessionStore(app.config['SESSION_MAX_ENTRIES'])
+        app.session_interface = ServerSessionInterface(self.store, app.config['SESSION_TTL'])
+
+    def revoke_user(self, user_id):
+        # Signed cookies cannot be recalled, only stored sessions can
+        return self.store.delete_user(user_id) if self.store is not None else 0
+
+server_sessions = ServerSessions()
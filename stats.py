@@ -0,0 +1,176 @@
+# Restaurant dashboard statistics.
+# daily_order_stats and daily_item_stats hold per-day rollups that are updated in
+# the same transaction as the orders they count. Dashboard reads aggregate those
+# buckets with GROUP BY, so their cost follows the number of days, not of orders.
+# Deleting orders or order lines takes them back out first (forget_orders,
+# forget_order_lines); rebuild_rollups() recomputes everything from scratch.
+# Lines of orders in a NON_REVENUE_STATUSES state are left out of the item buckets.
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, insert, or_, select
+from models import db, Daily_Item_Stat, Daily_Order_Stat, Menu_item, Order, Order_Item
+
+# Orders in these states do not count towards revenue
+NON_REVENUE_STATUSES = ('Cancelled',)
+LINES_COUNTED = or_(Order.status.is_(None), Order.status.notin_(NON_REVENUE_STATUSES))
+
+def bucket(delivery_time):
+    if delivery_time is None:
+        return datetime.utcnow().date()
+    return delivery_time.date() if isinstance(delivery_time, datetime) else delivery_time
+
+def _upsert_add(model, keys, amounts, rows):
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    table = model.__table__
+    if dialect_insert is None:
+        for row in rows:
+            existing = db.session.get(model, tuple(row[key] for key in keys))
+            if existing is None:
+                db.session.add(model(**row))
+            else:
+                for amount in amounts:
+                    setattr(existing, amount, getattr(existing, amount) + row[amount])
+        return
+
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={amount: table.c[amount] + stmt.excluded[amount] for amount in amounts}
+    )
+    db.session.execute(stmt, rows)
+
+def record_orders(orders, items=(), sign=1):
+    # orders: (restaurant_id, delivery_time, status, total_price)
+    # items: (restaurant_id, delivery_time, menu_item_id, quantity, line_total)
+    # sign=-1 subtracts them instead
+    order_buckets = defaultdict(lambda: [0, 0])
+    for restaurant_id, delivery_time, status, total_price in orders:
+        counts = order_buckets[(restaurant_id, bucket(delivery_time), status or 'Unknown')]
+        counts[0] += sign
+        counts[1] += sign * (total_price or 0)
+
+    item_buckets = defaultdict(lambda: [0, 0])
+    for restaurant_id, delivery_time, menu_item_id, quantity, line_total in items:
+        counts = item_buckets[(restaurant_id, bucket(delivery_time), menu_item_id)]
+        counts[0] += sign * quantity
+        counts[1] += sign * line_total
+
+    _upsert_add(Daily_Order_Stat, ['restaurant_id', 'day', 'status'], ['order_count', 'revenue'], [
+        {'restaurant_id': key[0], 'day': key[1], 'status': key[2], 'order_count': count, 'revenue': revenue}
+        for key, (count, revenue) in order_buckets.items()
+    ])
+    _upsert_add(Daily_Item_Stat, ['restaurant_id', 'day', 'menu_item_id'], ['quantity', 'revenue'], [
+        {'restaurant_id': key[0], 'day': key[1], 'menu_item_id': key[2], 'quantity': quantity, 'revenue': revenue}
+        for key, (quantity, revenue) in item_buckets.items()
+    ])
+
+def record_status_change(order_id, restaurant_id, delivery_time, old_status, new_status, total_price):
+    # Moves one order from its old status bucket to the new one, and its lines
+    # out of the item buckets when it stops counting (or back in)
+    counted = old_status not in NON_REVENUE_STATUSES
+    if counted != (new_status not in NON_REVENUE_STATUSES):
+        record_orders((), _order_lines(Order_Item.order_id == order_id), sign=-1 if counted else 1)
+    day = bucket(delivery_time)
+    _upsert_add(Daily_Order_Stat, ['restaurant_id', 'day', 'status'], ['order_count', 'revenue'], [
+        {'restaurant_id': restaurant_id, 'day': day, 'status': old_status or 'Unknown',
+         'order_count': -1, 'revenue': -(total_price or 0)},
+        {'restaurant_id': restaurant_id, 'day': day, 'status': new_status,
+         'order_count': 1, 'revenue': total_price or 0},
+    ])
+
+def _order_lines(condition):
+    return db.session.query(
+        Order.restaurant_id, Order.delivery_time, Order_Item.menu_item_id,
+        func.coalesce(Order_Item.quantity, 0), func.coalesce(Order_Item.quantity * Order_Item.price, 0),
+    ).join(Order, Order.id == Order_Item.order_id).filter(condition).all()
+
+def forget_orders(condition):
+    # Subtracts the orders matching condition, and their lines, before they are deleted
+    orders = db.session.query(Order.restaurant_id, Order.delivery_time, Order.status, Order.total_price).filter(
+        condition).all()
+    record_orders(orders, _order_lines(condition & LINES_COUNTED), sign=-1)
+
+def forget_order_lines(condition):
+    # Same for order lines deleted on their own, the orders keep counting
+    record_orders((), _order_lines(condition & LINES_COUNTED), sign=-1)
+
+def rebuild_rollups():
+    # Recomputes every bucket from orders, for seeded or imported data
+    db.session.query(Daily_Item_Stat).delete()
+    db.session.query(Daily_Order_Stat).delete()
+    day = func.date(Order.delivery_time)
+    db.session.execute(insert(Daily_Order_Stat).from_select(
+        ['restaurant_id', 'day', 'status', 'order_count', 'revenue'],
+        select(Order.restaurant_id, day, func.coalesce(Order.status, 'Unknown'),
+               func.count(Order.id), func.coalesce(func.sum(Order.total_price), 0))
+        .where(Order.restaurant_id.isnot(None), Order.delivery_time.isnot(None))
+        .group_by(Order.restaurant_id, day, func.coalesce(Order.status, 'Unknown'))
+    ))
+    db.session.execute(insert(Daily_Item_Stat).from_select(
+        ['restaurant_id', 'day', 'menu_item_id', 'quantity', 'revenue'],
+        select(Order.restaurant_id, day, Order_Item.menu_item_id,
+               func.coalesce(func.sum(Order_Item.quantity), 0),
+               func.coalesce(func.sum(Order_Item.quantity * Order_Item.price), 0))
+        .join(Order, Order.id == Order_Item.order_id)
+        .where(Order.restaurant_id.isnot(None), Order.delivery_time.isnot(None), Order_Item.menu_item_id.isnot(None),
+               LINES_COUNTED)
+        .group_by(Order.restaurant_id, day, Order_Item.menu_item_id)
+    ))
+    db.session.commit()
+
+def restaurant_stats(restaurant_id, start, end, top=5):
+    by_status = db.session.query(
+        Daily_Order_Stat.status,
+        func.sum(Daily_Order_Stat.order_count),
+        func.sum(Daily_Order_Stat.revenue),
+    ).filter(
+        Daily_Order_Stat.restaurant_id == restaurant_id,
+        Daily_Order_Stat.day.between(start, end),
+    ).group_by(Daily_Order_Stat.status).all()
+
+    # Status changes and deletions can leave emptied buckets behind
+    counts = {status: int(count) for status, count, _ in by_status if count}
+    revenue_orders = sum(int(count) for status, count, _ in by_status if status not in NON_REVENUE_STATUSES)
+    revenue = sum(int(total) for status, _, total in by_status if status not in NON_REVENUE_STATUSES)
+
+    quantity = func.sum(Daily_Item_Stat.quantity).label('quantity')
+    top_items = db.session.query(
+        Daily_Item_Stat.menu_item_id,
+        Menu_item.name,
+        quantity,
+        func.sum(Daily_Item_Stat.revenue),
+    ).outerjoin(Menu_item, Menu_item.id == Daily_Item_Stat.menu_item_id).filter(
+        Daily_Item_Stat.restaurant_id == restaurant_id,
+        Daily_Item_Stat.day.between(start, end),
+    ).group_by(Daily_Item_Stat.menu_item_id, Menu_item.name).having(quantity > 0).order_by(
+        quantity.desc()).limit(top).all()
+
+    return {
+        'restaurant_id': restaurant_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'revenue': revenue,
+        'order_count': sum(counts.values()),
+        'orders_by_status': counts,
+        'average_ticket': round(revenue / revenue_orders, 2) if revenue_orders else 0,
+        'top_items': [
+            {'menu_item_id': menu_item_id, 'name': name, 'quantity': int(qty), 'revenue': int(total)}
+            for menu_item_id, name, qty, total in top_items
+        ],
+    }
+
+def default_window(days=30):
+    end = datetime.utcnow().date()
+    return end - timedelta(days=days - 1), end
+
+def parse_day(value):
+    return date.fromisoformat(value)
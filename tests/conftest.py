@@ -0,0 +1,102 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URI'] = f'sqlite:///{tempfile.mkdtemp()}/test.db'
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+# Tests log in over and over from one address
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import pytest
+from app import app as flask_app, role_cache
+from cache import MemoryBackend, response_cache
+from models import db, bcrypt, Menu_item, Restaurant, User
+
+PASSWORD = 'password'
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    response_cache.backend = MemoryBackend(flask_app.config['RESPONSE_CACHE_MAX_ENTRIES'], response_cache.stats)
+    role_cache._entries.clear()
+    yield flask_app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def users(app):
+    # One user per role, by role
+    with app.app_context():
+        password_hash = bcrypt.generate_password_hash(PASSWORD, 4).decode()
+        created = {}
+        for role in ('client', 'restaurant_owner', 'admin'):
+            user = User(name=role, email=f'{role}@example.com', role=role)
+            user._password_hash = password_hash
+            db.session.add(user)
+            created[role] = user
+        db.session.commit()
+        return {role: {'id': user.id, 'email': user.email} for role, user in created.items()}
+
+@pytest.fixture
+def restaurant(app):
+    # A restaurant with a three item menu, as {'id', 'menu_item_ids'}
+    with app.app_context():
+        restaurant = Restaurant(name='Mama Oliech', address='Marcus Garvey Road', cuisine='African',
+                                menu='Fish', rating='5', reviews='Great')
+        db.session.add(restaurant)
+        db.session.flush()
+        items = [
+            Menu_item(name=f'Dish {i}', description='Tasty', price=100 + i, image='dish.png', restaurant_id=restaurant.id)
+            for i in range(3)
+        ]
+        db.session.add_all(items)
+        db.session.commit()
+        return {'id': restaurant.id, 'menu_item_ids': [item.id for item in items]}
+
+@pytest.fixture
+def login(users):
+    def login(client, role):
+        response = client.post('/login', json={'email': users[role]['email'], 'password': PASSWORD})
+        assert response.status_code == 201, response.get_json()
+        return response
+    return login
+
+@pytest.fixture
+def asgi_get(app):
+    # Runs one GET through asgi.application, returns (status, headers, body).
+    # The async engine is disposed in the same event loop it was used from
+    import asyncio
+    from asgi import application, database
+
+    def asgi_get(path, headers=None):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+            'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+            'client': ('127.0.0.1', 50000),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            try:
+                await application(scope, receive, send)
+            finally:
+                await database.stop()
+
+        asyncio.run(run())
+        start = messages[0]
+        response_headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+        return start['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+    return asgi_get
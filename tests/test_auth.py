@@ -0,0 +1,16 @@
+from models import db, User
+
+def test_deleted_user_is_refused_at_once_by_default(app, client, login, users, restaurant):
+    order = {
+        'restaurant_id': restaurant['id'], 'total_price': 100, 'delivery_time': '2024-10-28T12:30:00',
+        'delivery_address': 'Moi Avenue',
+    }
+    login(client, 'client')
+    assert client.post('/user/orders', json=order).status_code == 201
+    # Deleted "in another worker": straight in the database, this process's
+    # role cache is never told
+    with app.app_context():
+        db.session.delete(db.session.get(User, users['client']['id']))
+        db.session.commit()
+
+    assert client.post('/user/orders', json=order).status_code == 401
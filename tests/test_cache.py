@@ -0,0 +1,53 @@
+from app import RestaurantMenu, RestaurantResource
+
+def test_fill_racing_a_patch_is_not_served_after_it(app, client, login, restaurant, monkeypatch):
+    # A menu fill reads the old rows, a PATCH commits and invalidates, then the
+    # fill stores what it built. The next reader must still see the new menu.
+    owner = app.test_client()
+    login(owner, 'restaurant_owner')
+    item_id = restaurant['menu_item_ids'][0]
+    build = RestaurantMenu.menu
+
+    def racing_menu(self, restaurant_id):
+        entry = build(self, restaurant_id)
+        response = owner.patch(f'/menu/item/{item_id}', json={'name': 'Renamed'})
+        assert response.status_code == 200
+        return entry
+
+    monkeypatch.setattr(RestaurantMenu, 'menu', racing_menu)
+    first = client.get(f'/restaurant/{restaurant["id"]}/menu')
+    assert first.get_json()['menu_items'][0]['name'] == 'Dish 0'
+    monkeypatch.setattr(RestaurantMenu, 'menu', build)
+
+    second = client.get(f'/restaurant/{restaurant["id"]}/menu')
+    assert second.get_json()['menu_items'][0]['name'] == 'Renamed'
+    assert second.headers['ETag'] != first.headers['ETag']
+
+def test_detail_fill_racing_a_patch_is_not_served_after_it(app, client, login, restaurant, monkeypatch):
+    owner = app.test_client()
+    login(owner, 'restaurant_owner')
+    build = RestaurantResource.detail
+
+    def racing_detail(self, id):
+        entry = build(self, id)
+        assert owner.patch(f'/restaurants/{id}', json={'name': 'Renamed'}).status_code == 200
+        return entry
+
+    monkeypatch.setattr(RestaurantResource, 'detail', racing_detail)
+    assert client.get(f'/restaurants/{restaurant["id"]}').get_json()['name'] == 'Mama Oliech'
+    monkeypatch.setattr(RestaurantResource, 'detail', build)
+
+    assert client.get(f'/restaurants/{restaurant["id"]}').get_json()['name'] == 'Renamed'
+
+def test_cached_menu_is_served_until_the_version_moves(app, client, restaurant, monkeypatch):
+    calls = []
+    build = RestaurantMenu.menu
+
+    def counting_menu(self, restaurant_id):
+        calls.append(restaurant_id)
+        return build(self, restaurant_id)
+
+    monkeypatch.setattr(RestaurantMenu, 'menu', counting_menu)
+    for _ in range(3):
+        assert client.get(f'/restaurant/{restaurant["id"]}/menu').status_code == 200
+    assert len(calls) == 1
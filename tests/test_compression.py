@@ -0,0 +1,36 @@
+import gzip
+import json
+import pytest
+from encoding import compressor
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+@pytest.fixture
+def compress_everything(monkeypatch):
+    monkeypatch.setattr(compressor, 'min_size', 0)
+
+def test_gzipped_then_not_modified_keeps_the_weak_etag(client, restaurant, compress_everything):
+    url = f'/restaurant/{restaurant["id"]}/menu'
+    first = client.get(url, headers=GZIP)
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(first.data))['menu_items']
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+
+    second = client.get(url, headers=dict(GZIP, **{'If-None-Match': etag}))
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    # An identity response carries the same validator
+    assert client.get(url).headers['ETag'] == etag
+
+def test_asgi_gzipped_then_not_modified_keeps_the_weak_etag(restaurant, asgi_get, compress_everything):
+    url = f'/restaurant/{restaurant["id"]}/menu'
+    status, headers, body = asgi_get(url, GZIP)
+    assert status == 200 and headers['content-encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body))['menu_items']
+    etag = headers['etag']
+    assert etag.startswith('W/')
+
+    status, headers, _ = asgi_get(url, dict(GZIP, **{'If-None-Match': etag}))
+    assert status == 304
+    assert headers['etag'] == etag
@@ -0,0 +1,30 @@
+from models import db, Restaurant
+
+ORIGIN = {'Origin': 'https://app.example.com'}
+
+def add_restaurants(app, count):
+    with app.app_context():
+        db.session.add_all([
+            Restaurant(name=f'Restaurant {i}', address='Moi Avenue', cuisine='African', menu='Fish', rating='4',
+                       reviews='Good')
+            for i in range(count)
+        ])
+        db.session.commit()
+
+def exposed(value):
+    return {name.strip().lower() for name in value.split(',')}
+
+def test_cross_origin_clients_can_read_the_cursor(app, client):
+    add_restaurants(app, 3)
+    response = client.get('/restaurants?limit=2', headers=ORIGIN)
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN['Origin']
+    assert response.headers['X-Next-Cursor']
+    assert {'x-next-cursor', 'etag', 'server-timing'} <= exposed(response.headers['Access-Control-Expose-Headers'])
+
+def test_asgi_exposes_the_cursor_too(app, asgi_get):
+    add_restaurants(app, 3)
+    status, headers, _ = asgi_get('/restaurants?limit=2', ORIGIN)
+    assert status == 200
+    assert headers['x-next-cursor']
+    assert {'x-next-cursor', 'etag', 'server-timing'} <= exposed(headers['access-control-expose-headers'])
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+import time
+from events import EventBroker, MemoryEventLog
+
+class ThreadRecordingLog(MemoryEventLog):
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def read(self, channels, after_id, limit=500):
+        self.threads.add(threading.get_ident())
+        return super().read(channels, after_id, limit)
+
+    def latest_id(self):
+        self.threads.add(threading.get_ident())
+        return super().latest_id()
+
+def test_event_log_is_never_read_on_the_event_loop():
+    broker = EventBroker(log=ThreadRecordingLog())
+    broker.poll_interval = 0.01
+    broker.log.publish(['user:1'], 'order_created', {'order_id': 1})
+
+    async def run():
+        assert (await broker.apoll({'user:1'}, 0, 1))[0]
+        assert (await broker.apoll({'user:2'}, 0, 0.05))[0] == []
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert broker.log.threads and loop_thread not in broker.log.threads
+
+def test_close_ends_open_streams_and_polls():
+    broker = EventBroker(log=MemoryEventLog())
+    broker.poll_interval = 0.01
+
+    async def run():
+        stream = broker.astream({'user:1'}, 0)
+        assert (await stream.__anext__()).startswith('retry:')
+        poll = asyncio.ensure_future(broker.apoll({'user:1'}, 0, 30))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        broker.close()
+        assert await asyncio.wait_for(poll, 1) == ([], 0, False)
+        assert [chunk async for chunk in stream] == []
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 1
@@ -0,0 +1,39 @@
+import time
+import pytest
+from flask import Flask
+from hashing import HasherBusy, PasswordHasher
+
+@pytest.fixture
+def hasher():
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0, PASSWORD_HASH_TIMEOUT=None)
+    hasher = PasswordHasher(app)
+    # Start the pool before timing anything
+    assert hasher._run(abs, -1) == 1
+    yield hasher
+    hasher.shutdown()
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes(hasher):
+    hasher.timeout = 0.2
+    with pytest.raises(HasherBusy, match='timed out'):
+        hasher._run(time.sleep, 1)
+    # Still running in the pool, so the only slot is taken
+    with pytest.raises(HasherBusy, match='saturated'):
+        hasher._run(abs, -2)
+    time.sleep(1.5)
+    assert hasher._run(abs, -3) == 3
+
+def test_pool_does_not_fork(hasher):
+    assert hasher._executor._mp_context.get_start_method() != 'fork'
+
+def test_broken_pool_is_replaced(hasher):
+    # As if a worker had been OOM-killed mid-hash
+    for process in list(hasher._executor._processes.values()):
+        process.kill()
+        process.join()
+    deadline = time.monotonic() + 5
+    while not hasher._executor._broken and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(HasherBusy, match='restarting'):
+        hasher._run(abs, -1)
+    assert hasher._run(abs, -4) == 4
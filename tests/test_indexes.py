@@ -0,0 +1,17 @@
+import pytest
+from flask import g
+from geo import geo_index
+from search import search_index
+
+@pytest.mark.parametrize('index', [search_index, geo_index], ids=['search', 'geo'])
+def test_refresh_reads_the_primary(app, restaurant, monkeypatch, index):
+    # Requests routed to a replica still refresh the index from the primary
+    seen = []
+    monkeypatch.setattr(index, 'built', False)
+    monkeypatch.setattr(index, '_load', lambda restaurant_ids=None: seen.append(g.get('read_replica')))
+    with app.test_request_context('/search'):
+        g.read_replica = 'replica_0'
+        index.refresh()
+        index.reindex_restaurant(restaurant['id'])
+        assert g.read_replica == 'replica_0'
+    assert seen == [None, None]
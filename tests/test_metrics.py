@@ -0,0 +1,44 @@
+import time
+from flask import Flask, Response
+from profiling import Profiler
+
+def test_pool_metrics_are_served_without_profiling(app, client, login):
+    assert not app.config['PROFILING_ENABLED']
+    login(client, 'admin')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'db_pool_checked_out{pool="default"}' in body
+    assert 'db_pool_checkout_seconds' in body
+    assert 'http_request_duration_seconds' not in body
+
+def test_metrics_need_an_admin_or_the_token(app, client, login, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+    login(client, 'client')
+    assert client.get('/metrics').status_code == 403
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    scraper = app.test_client()
+    assert scraper.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert scraper.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+def test_streamed_response_is_timed_until_closed():
+    app = Flask(__name__)
+    app.config.update(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0)
+    profiler = Profiler(app)
+
+    @app.route('/slow')
+    def slow():
+        def generate():
+            yield 'a'
+            time.sleep(0.05)
+            yield 'b'
+        return Response(generate())
+
+    response = app.test_client().get('/slow')
+    assert response.data == b'ab'
+    assert not profiler.durations.series
+    # The server closes the body once it has been sent
+    response.close()
+    (_, total), = profiler.durations.series.values()
+    assert total >= 0.05
@@ -0,0 +1,60 @@
+import pytest
+from geo import KM_PER_DEGREE, geo_index
+from models import db, Restaurant
+
+CENTER = (-1.2864, 36.8172)
+
+@pytest.fixture
+def places(app, monkeypatch):
+    # Restaurants due north of CENTER at 1, 3 and 8 km, the index rebuilt for this database
+    monkeypatch.setattr(geo_index, 'cells', {})
+    monkeypatch.setattr(geo_index, 'points', {})
+    monkeypatch.setattr(geo_index, 'built', False)
+    with app.app_context():
+        restaurants = [
+            Restaurant(name=f'{km} km', address='Moi Avenue', cuisine=cuisine, menu='Fish', rating='4', reviews='Good',
+                       latitude=CENTER[0] + km / KM_PER_DEGREE, longitude=CENTER[1])
+            for km, cuisine in ((3, 'African'), (1, 'Italian'), (8, 'African'))
+        ]
+        db.session.add_all(restaurants)
+        db.session.commit()
+        return {restaurant.name: restaurant.id for restaurant in restaurants}
+
+def nearby(client, **args):
+    args.setdefault('lat', CENTER[0])
+    args.setdefault('lon', CENTER[1])
+    return client.get('/restaurants/nearby', query_string=args)
+
+def test_closest_first_within_the_radius(client, places):
+    response = nearby(client, radius_km=5)
+    assert response.status_code == 200
+    found = response.get_json()['restaurants']
+    assert [restaurant['name'] for restaurant in found] == ['1 km', '3 km']
+    assert [round(restaurant['distance_km']) for restaurant in found] == [1, 3]
+
+    assert [r['name'] for r in nearby(client, radius_km=10).get_json()['restaurants']] == ['1 km', '3 km', '8 km']
+    assert nearby(client, radius_km=0.5).get_json()['restaurants'] == []
+
+def test_limit_and_cuisine_narrow_the_results(client, places):
+    assert [r['name'] for r in nearby(client, radius_km=10, limit=1).get_json()['restaurants']] == ['1 km']
+    found = nearby(client, radius_km=10, cuisine='African').get_json()['restaurants']
+    assert [r['name'] for r in found] == ['3 km', '8 km']
+
+@pytest.mark.parametrize('args', [
+    {'lat': CENTER[0], 'lon': None},
+    {'lat': 'north', 'lon': CENTER[1]},
+    {'lat': 'nan', 'lon': CENTER[1]},
+    {'lat': CENTER[0], 'lon': 'NaN'},
+    {'lat': 91, 'lon': CENTER[1]},
+    {'radius_km': 'far'},
+    {'radius_km': 'nan'},
+    {'radius_km': 'inf'},
+    {'radius_km': 0},
+    {'radius_km': 51},
+    {'lat': None, 'lon': None},
+])
+def test_bad_coordinates_and_radius_are_422(client, places, args):
+    query = {'lat': CENTER[0], 'lon': CENTER[1]}
+    query.update(args)
+    query = {key: value for key, value in query.items() if value is not None}
+    assert client.get('/restaurants/nearby', query_string=query).status_code == 422
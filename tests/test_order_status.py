@@ -0,0 +1,109 @@
+from datetime import date
+from sqlalchemy import update
+import orders
+from models import db, Order
+from stats import restaurant_stats
+
+ORDER = {
+    'total_price': 100, 'delivery_time': '2024-10-28T12:30:00', 'delivery_address': 'Moi Avenue',
+}
+
+def place_order(client, login, restaurant):
+    login(client, 'client')
+    response = client.post('/user/orders', json=dict(ORDER, restaurant_id=restaurant['id']))
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def owner_client(app, login):
+    owner = app.test_client()
+    login(owner, 'restaurant_owner')
+    return owner
+
+def test_kitchen_flow_moves_forward_and_bumps_the_version(app, client, login, restaurant):
+    order_id = place_order(client, login, restaurant)
+    owner = owner_client(app, login)
+    for version, status in enumerate(('Preparing', 'Dispatched', 'Completed'), 1):
+        response = owner.patch(f'/orders/{order_id}', json={'status': status, 'version': version})
+        assert response.status_code == 200
+        assert response.get_json() == {'id': order_id, 'status': status, 'version': version + 1}
+
+def test_moves_outside_the_state_machine_are_refused(app, client, login, restaurant):
+    order_id = place_order(client, login, restaurant)
+    owner = owner_client(app, login)
+    # Skipping a step, going back, and leaving a final state
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Completed'}).status_code == 422
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Preparing'}).status_code == 200
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Pending'}).status_code == 422
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Cancelled'}).status_code == 200
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Preparing'}).status_code == 422
+    assert owner.patch(f'/orders/{order_id}', json={}).status_code == 422
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Cancelled', 'version': '3'}).status_code == 422
+
+def test_clients_may_only_cancel_their_own_pending_orders(app, client, login, users, restaurant):
+    order_id = place_order(client, login, restaurant)
+    assert client.patch(f'/orders/{order_id}', json={'status': 'Preparing'}).status_code == 422
+
+    stranger = app.test_client()
+    assert stranger.patch(f'/orders/{order_id}', json={'status': 'Cancelled'}).status_code == 401
+    with app.app_context():
+        db.session.execute(update(Order).where(Order.id == order_id).values(user_id=users['admin']['id']))
+        db.session.commit()
+    # Someone else's order looks like no order at all
+    assert client.patch(f'/orders/{order_id}', json={'status': 'Cancelled'}).status_code == 404
+    with app.app_context():
+        db.session.execute(update(Order).where(Order.id == order_id).values(user_id=users['client']['id']))
+        db.session.commit()
+
+    assert client.patch(f'/orders/{order_id}', json={'status': 'Cancelled'}).status_code == 200
+    owner = owner_client(app, login)
+    second = place_order(client, login, restaurant)
+    assert owner.patch(f'/orders/{second}', json={'status': 'Preparing'}).status_code == 200
+    # Started in the kitchen, too late for the client
+    assert client.patch(f'/orders/{second}', json={'status': 'Cancelled'}).status_code == 422
+
+def test_unknown_order_is_404(app, login):
+    owner = owner_client(app, login)
+    assert owner.patch('/orders/999', json={'status': 'Preparing'}).status_code == 404
+
+def test_stale_version_is_409_with_the_current_state(app, client, login, restaurant):
+    order_id = place_order(client, login, restaurant)
+    owner = owner_client(app, login)
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Preparing', 'version': 1}).status_code == 200
+    response = owner.patch(f'/orders/{order_id}', json={'status': 'Dispatched', 'version': 1})
+    assert response.status_code == 409
+    assert response.get_json()['status'] == 'Preparing' and response.get_json()['version'] == 2
+
+def test_write_landing_between_read_and_swap_loses_nothing(app, client, login, restaurant, monkeypatch):
+    # Another worker moves the order after change_status read it but before its
+    # UPDATE: the compare-and-swap matches no row and the request gets a 409
+    order_id = place_order(client, login, restaurant)
+    owner = owner_client(app, login)
+    read = orders.order_state
+
+    def racing_read(order_id):
+        state = read(order_id)
+        monkeypatch.setattr(orders, 'order_state', read)
+        db.session.execute(update(Order).where(Order.id == order_id).values(status='Cancelled', version=Order.version + 1))
+        db.session.commit()
+        return state
+
+    monkeypatch.setattr(orders, 'order_state', racing_read)
+    response = owner.patch(f'/orders/{order_id}', json={'status': 'Preparing'})
+    assert response.status_code == 409
+    assert response.get_json()['status'] == 'Cancelled' and response.get_json()['version'] == 2
+    with app.app_context():
+        assert db.session.get(Order, order_id).status == 'Cancelled'
+
+def test_status_change_moves_the_order_between_rollup_buckets(app, client, login, restaurant):
+    order_id = place_order(client, login, restaurant)
+    owner = owner_client(app, login)
+    day = date(2024, 10, 28)
+    with app.app_context():
+        before = restaurant_stats(restaurant['id'], day, day)
+    assert before['orders_by_status'] == {'Pending': 1} and before['revenue'] == 100
+
+    assert owner.patch(f'/orders/{order_id}', json={'status': 'Cancelled'}).status_code == 200
+    with app.app_context():
+        after = restaurant_stats(restaurant['id'], day, day)
+    assert after['orders_by_status'] == {'Cancelled': 1}
+    assert after['order_count'] == 1 and after['revenue'] == 0
@@ -0,0 +1,75 @@
+def batch(restaurant, **overrides):
+    order = {
+        'restaurant_id': restaurant['id'],
+        'delivery_time': '2024-10-28T12:30:00',
+        'delivery_address': 'Moi Avenue',
+        'items': [{'menu_item_id': restaurant['menu_item_ids'][0], 'quantity': 2}],
+    }
+    order.update(overrides)
+    return order
+
+def test_malformed_menu_item_id_fails_only_its_order(client, login, restaurant):
+    login(client, 'client')
+    orders = [
+        batch(restaurant),
+        batch(restaurant, items=[{'menu_item_id': [1, 2]}]),
+        batch(restaurant, items=[{'menu_item_id': {'id': 1}}]),
+        batch(restaurant, items=[{'menu_item_id': True}]),
+    ]
+    response = client.post('/user/orders/batch', json={'orders': orders})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['created'] == 1
+    assert body['results'][0]['total_price'] == 200
+    assert [result['error'] for result in body['results'][1:]] == ["menu_item_id must be an integer"] * 3
+
+def test_invalid_delivery_address_fails_only_its_order(client, login, restaurant):
+    login(client, 'client')
+    orders = [
+        batch(restaurant, delivery_address={'street': 'Moi Avenue'}),
+        batch(restaurant),
+        batch(restaurant, delivery_address='   '),
+        batch(restaurant, delivery_address=None),
+    ]
+    response = client.post('/user/orders/batch', json={'orders': orders})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['created'] == 1
+    assert 'order_id' in body['results'][1]
+    for index in (0, 2, 3):
+        assert body['results'][index]['error'] == "delivery_address must be a non-empty string"
+
+def test_non_integer_restaurant_id_is_rejected(client, login, restaurant):
+    login(client, 'client')
+    response = client.post('/user/orders/batch', json={'orders': [batch(restaurant, restaurant_id=str(restaurant['id']))]})
+    assert response.status_code == 422
+    assert response.get_json()['results'][0]['error'] == "restaurant_id must be an integer"
+
+def test_batch_writes_each_table_in_one_statement(app, client, login, restaurant):
+    from models import db, Order, Order_Item
+    from query_budget import count_queries
+    login(client, 'client')
+    item_ids = restaurant['menu_item_ids']
+    orders = [
+        batch(restaurant, delivery_address=f'Moi Avenue {i % 3}',
+              items=[{'menu_item_id': item_ids[i % 3], 'quantity': 1 + i % 2}])
+        for i in range(10)
+    ]
+    with app.app_context():
+        engine = db.engine
+    with count_queries(engine) as counter:
+        response = client.post('/user/orders/batch', json={'orders': orders})
+    assert response.status_code == 201
+    inserts = [statement for statement in counter.statements if statement.startswith('INSERT')]
+    assert [statement.split(' (')[0] for statement in inserts if 'daily_' not in statement] == [
+        'INSERT INTO orders', 'INSERT INTO order_items']
+
+    # Every reported id carries its own order's address and lines
+    with app.app_context():
+        for data, result in zip(orders, response.get_json()['results']):
+            order = db.session.get(Order, result['order_id'])
+            assert order.delivery_address == data['delivery_address']
+            assert order.total_price == result['total_price']
+            lines = db.session.query(Order_Item.menu_item_id, Order_Item.quantity).filter(
+                Order_Item.order_id == order.id).all()
+            assert lines == [(data['items'][0]['menu_item_id'], data['items'][0]['quantity'])]
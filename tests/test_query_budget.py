@@ -0,0 +1,22 @@
+from models import db
+from query_budget import check_authenticated_budgets, check_budgets
+
+def test_read_endpoints_stay_within_budget(app, client, restaurant):
+    with app.app_context():
+        engine = db.engine
+    # Twice: the second round would be served from a warm cache if it were on
+    for _ in range(2):
+        check_budgets(client, engine, restaurant['id'])
+
+def test_authenticated_endpoints_stay_within_budget(app, login, restaurant):
+    clients = {role: app.test_client() for role in ('client', 'restaurant_owner')}
+    for role, client in clients.items():
+        login(client, role)
+    order = {
+        'restaurant_id': restaurant['id'], 'total_price': 100, 'delivery_time': '2024-10-28T12:30:00',
+        'delivery_address': 'Moi Avenue',
+    }
+    assert clients['client'].post('/user/orders', json=order).status_code == 201
+    with app.app_context():
+        engine = db.engine
+    check_authenticated_budgets(clients, engine, restaurant['id'], restaurant['menu_item_ids'][0])
@@ -0,0 +1,87 @@
+import pytest
+from flask import Flask
+import ratelimit
+from ratelimit import MemoryBucketStore, RateLimiter, SqliteBucketStore
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+@pytest.fixture
+def limited():
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_ENABLED=True, RATE_LIMIT_PER_SECOND=1.0, RATE_LIMIT_BURST=5.0,
+                      RATE_LIMIT_COSTS={'POST login': 3, 'search': 2})
+    app.secret_key = 'test'
+    RateLimiter(app, store=MemoryBucketStore())
+    app.add_url_rule('/login', 'login', lambda: 'ok', methods=['GET', 'POST'])
+    app.add_url_rule('/search', 'search', lambda: 'ok')
+    app.add_url_rule('/metrics', 'metrics', lambda: 'ok')
+    return app.test_client()
+
+def test_empty_bucket_gets_429_with_retry_after(limited, clock):
+    for _ in range(5):
+        assert limited.get('/login').status_code == 200
+    response = limited.get('/login')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json()['error']
+
+def test_routes_spend_their_cost(limited, clock):
+    # "METHOD endpoint" first, then endpoint, 1 otherwise
+    assert limited.post('/login').status_code == 200
+    response = limited.post('/login')
+    assert response.status_code == 429
+    # 2 tokens left, 3 needed at 1 per second
+    assert response.headers['Retry-After'] == '1'
+    assert limited.get('/search').status_code == 200
+    assert limited.get('/search').status_code == 429
+    clock.now += 0.5
+    response = limited.post('/login')
+    assert response.status_code == 429 and response.headers['Retry-After'] == '3'
+
+def test_bucket_refills_with_time_up_to_the_burst(limited, clock):
+    for _ in range(5):
+        limited.get('/login')
+    assert limited.get('/login').status_code == 429
+    clock.now += 2
+    assert limited.get('/login').status_code == 200
+    assert limited.get('/login').status_code == 200
+    assert limited.get('/login').status_code == 429
+    # A long idle spell refills to the burst and no further
+    clock.now += 3600
+    assert [limited.get('/login').status_code for _ in range(6)] == [200] * 5 + [429]
+
+def test_exempt_and_unknown_routes_and_preflights_are_free(limited, clock):
+    for _ in range(5):
+        limited.get('/login')
+    assert limited.get('/login').status_code == 429
+    assert limited.get('/metrics').status_code == 200
+    assert limited.get('/nowhere').status_code == 404
+    assert limited.options('/login').status_code == 200
+
+def test_clients_have_their_own_buckets(limited, clock):
+    for _ in range(5):
+        limited.get('/login')
+    assert limited.get('/login').status_code == 429
+    assert limited.get('/login', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+def test_sqlite_store_refills_like_the_memory_store(tmp_path, clock):
+    store = SqliteBucketStore(str(tmp_path / 'buckets.db'))
+    assert store.take('ip:1', 3, 1.0, 5.0) == 0.0
+    assert store.take('ip:1', 3, 1.0, 5.0) == 1.0
+    clock.now += 1
+    assert store.take('ip:1', 3, 1.0, 5.0) == 0.0
+    assert store.take('ip:2', 5, 1.0, 5.0) == 0.0
@@ -0,0 +1,72 @@
+import time
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+import replicas
+from models import db, Restaurant
+from replicas import replica_router
+
+@pytest.fixture
+def routed(tmp_path, monkeypatch):
+    # A primary and one replica holding different data, so each response tells where it read from
+    for attr in ('keys', 'strategy', 'window', 'retry_seconds', 'down'):
+        monkeypatch.setattr(replica_router, attr, getattr(replica_router, attr))
+    # init_app registers the replica bind on db, keep it away from the other tests
+    monkeypatch.setattr(db, 'metadatas', dict(db.metadatas))
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/primary.db',
+                      DATABASE_REPLICA_URIS=[f'sqlite:///{tmp_path}/replica.db'])
+    replica_router.init_app(app)
+    db.init_app(app)
+
+    @app.get('/name')
+    def name():
+        return db.session.query(Restaurant.name).scalar()
+
+    @app.post('/name')
+    def rename():
+        db.session.query(Restaurant).update({'name': 'renamed'})
+        db.session.commit()
+        return db.session.query(Restaurant.name).scalar()
+
+    with app.app_context():
+        for key in (None, 'replica_0'):
+            engine = db.engines[key]
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Restaurant.__table__.insert(), {'name': key or 'primary', 'cuisine': 'Swahili'})
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+def test_gets_read_the_replica(routed):
+    client = routed.test_client()
+    assert client.get('/name').text == 'replica_0'
+    assert client.head('/name').status_code == 200
+
+def test_writes_and_the_reads_right_after_go_to_the_primary(routed, monkeypatch):
+    client = routed.test_client()
+    # The write pins the rest of its own request to the primary too
+    assert client.post('/name').text == 'renamed'
+    with client.session_transaction() as session:
+        wrote_at = session['wrote_at']
+    assert client.get('/name').text == 'renamed'
+
+    later = SimpleNamespace(time=lambda: wrote_at + replica_router.window, monotonic=time.monotonic)
+    monkeypatch.setattr(replicas, 'time', later)
+    assert client.get('/name').text == 'replica_0'
+
+def test_reads_fall_back_to_the_primary_with_every_replica_down(routed, tmp_path, monkeypatch):
+    with routed.app_context():
+        db.engines['replica_0'].dispose()
+    (tmp_path / 'replica.db').unlink()
+    (tmp_path / 'replica.db').mkdir()
+    client = routed.test_client()
+    assert client.get('/name').text == 'primary'
+    assert 'replica_0' in replica_router.down
+
+    # Still down, skipped without trying to connect again
+    monkeypatch.setattr(replica_router, 'mark_down', lambda key: pytest.fail('probed a replica marked down'))
+    assert client.get('/name').text == 'primary'
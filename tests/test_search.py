@@ -0,0 +1,37 @@
+from search import SearchIndex, edit_distance
+
+def index():
+    index = SearchIndex()
+    index.add_restaurant(1, 'Mama Oliech', 'African', [
+        (10, 'Fried tilapia', 'Whole fish with ugali', 900),
+        (11, 'Chicken stew', 'Slow cooked', 700),
+    ])
+    index.add_restaurant(2, 'Java House', 'Coffee', [(20, 'Chocolate muffin', 'Baked daily', 250)])
+    return index
+
+def names(results):
+    return [result['name'] for result in results]
+
+def test_edit_distance_stops_at_the_bound():
+    assert edit_distance('chiken', 'chicken', 2) == 1
+    assert edit_distance('tilapia', 'tilapai', 2) == 1
+    assert edit_distance('stew', 'stwe', 1) == 1
+    assert edit_distance('coffee', 'chocolate', 1) == 2
+
+def test_a_typo_still_finds_the_term():
+    assert names(index().search('chiken')) == ['Chicken stew']
+    assert names(index().search('tilapai', doc_type='menu_item')) == ['Fried tilapia']
+    # Every word of a query may be corrected
+    assert names(index().search('chikcen stwe')) == ['Chicken stew']
+
+def test_corrections_are_only_tried_when_nothing_matches():
+    index_ = index()
+    index_.add_menu_item(12, 1, 'Mama Oliech', 'Samosas', 'Beef', 500)
+    index_.add_menu_item(13, 1, 'Mama Oliech', 'Samosa', 'Beef', 500)
+    # Spelled right, the near miss is not pulled in; misspelled, both are close
+    assert names(index_.search('samosas apple')) == []
+    assert names(index_.search('beef samosas')) == ['Samosas']
+    assert set(names(index_.search('beef samoas'))) == {'Samosas', 'Samosa'}
+    # Short words and strangers are left alone
+    assert index_.search('jav') and not index_.search('jsv')
+    assert not index_.search('zzzzzz')
@@ -0,0 +1,34 @@
+import pytest
+import serializers
+from models import db, Menu_item, Order, Order_Item, Restaurant, User
+
+# (plan, model, rules app.py would otherwise pass to to_dict)
+PLANS = [
+    ('restaurant_summary', Restaurant, ('-menu_items', '-orders',)),
+    ('restaurant_full', Restaurant, ()),
+    ('menu_item_full', Menu_item, ()),
+    ('order_full', Order, ()),
+    ('order_item_full', Order_Item, ()),
+    ('user_full', User, ()),
+]
+
+@pytest.fixture
+def ordered(client, login, users, restaurant):
+    login(client, 'client')
+    first, second, _ = restaurant['menu_item_ids']
+    orders = [
+        {'restaurant_id': restaurant['id'], 'delivery_time': '2024-10-28T12:30:00', 'delivery_address': 'Moi Avenue',
+         'items': [{'menu_item_id': first, 'quantity': 2}, {'menu_item_id': second, 'quantity': 1}]},
+        {'restaurant_id': restaurant['id'], 'delivery_time': '2024-10-28T18:00:00', 'delivery_address': 'Moi Avenue'},
+    ]
+    assert client.post('/user/orders/batch', json={'orders': orders}).status_code == 201
+
+@pytest.mark.parametrize('name, model, rules', PLANS, ids=[name for name, _, _ in PLANS])
+def test_plan_matches_to_dict(app, ordered, name, model, rules):
+    plan = getattr(serializers, name)
+    with app.app_context():
+        rows = db.session.query(model).all()
+        assert rows
+        for row in rows:
+            assert plan(row) == row.to_dict(rules=rules)
+        assert plan.many(rows) == [row.to_dict(rules=rules) for row in rows]
@@ -0,0 +1,51 @@
+import pytest
+from sessions import MemorySessionStore, ServerSessionInterface, server_sessions
+
+@pytest.fixture
+def store(app, monkeypatch):
+    # SESSION_BACKEND=memory, as init_app would set it up
+    store = MemorySessionStore()
+    monkeypatch.setattr(server_sessions, 'store', store)
+    monkeypatch.setattr(app, 'session_interface', ServerSessionInterface(store, 3600))
+    return store
+
+def sid(client, app):
+    name = app.config['SESSION_COOKIE_NAME']
+    return next((cookie.value for cookie in client.cookie_jar if cookie.name == name), None)
+
+def test_login_rotates_the_session_id(app, client, login, store):
+    # A session started before login (a planted id) is worthless afterwards
+    with client.session_transaction() as session:
+        session['cart'] = [1]
+    planted = sid(client, app)
+    assert store.get(planted) is not None
+
+    login(client, 'client')
+    current = sid(client, app)
+    assert current != planted
+    assert store.get(planted) is None
+    assert store.get(current)[0]['user_id'] is not None
+    assert client.get('/check_session').status_code == 200
+
+def test_deleting_a_user_revokes_all_their_sessions(app, login, users, store):
+    phone, laptop = app.test_client(), app.test_client()
+    login(phone, 'client')
+    login(laptop, 'client')
+    admin = app.test_client()
+    login(admin, 'admin')
+    assert len(store) == 3
+
+    assert admin.delete(f'/admin/user/{users["client"]["id"]}').status_code == 204
+    assert store.get(sid(phone, app)) is None and store.get(sid(laptop, app)) is None
+    assert store.get(sid(admin, app)) is not None
+    assert phone.get('/check_session').status_code == 401
+    assert laptop.get('/check_session').status_code == 401
+
+def test_clear_session_drops_the_stored_session_and_the_cookie(app, client, login, store):
+    login(client, 'client')
+    current = sid(client, app)
+    response = client.delete('/clear_session')
+    assert response.status_code == 204
+    assert store.get(current) is None
+    assert sid(client, app) is None
+    assert client.get('/check_session').status_code == 401
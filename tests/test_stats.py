@@ -0,0 +1,69 @@
+from datetime import date
+from models import db, Daily_Item_Stat
+from stats import rebuild_rollups, restaurant_stats
+
+DAY = date(2024, 10, 28)
+
+def place_orders(client, login, restaurant):
+    login(client, 'client')
+    first, second, _ = restaurant['menu_item_ids']
+    orders = [
+        {'restaurant_id': restaurant['id'], 'delivery_time': '2024-10-28T12:30:00', 'delivery_address': 'Moi Avenue',
+         'items': [{'menu_item_id': first, 'quantity': 2}, {'menu_item_id': second, 'quantity': 1}]},
+        {'restaurant_id': restaurant['id'], 'delivery_time': '2024-10-28T18:00:00', 'delivery_address': 'Moi Avenue',
+         'items': [{'menu_item_id': second, 'quantity': 3}]},
+    ]
+    response = client.post('/user/orders/batch', json={'orders': orders})
+    assert response.status_code == 201
+    return [result['order_id'] for result in response.get_json()['results']]
+
+def stats(app, restaurant):
+    with app.app_context():
+        return restaurant_stats(restaurant['id'], DAY, DAY)
+
+def rebuilt(app, restaurant):
+    with app.app_context():
+        rebuild_rollups()
+    return stats(app, restaurant)
+
+def test_deleting_a_user_takes_their_orders_out_of_the_rollups(app, client, login, users, restaurant):
+    place_orders(client, login, restaurant)
+    assert stats(app, restaurant)['order_count'] == 2
+
+    admin = app.test_client()
+    login(admin, 'admin')
+    assert admin.delete(f'/admin/user/{users["client"]["id"]}').status_code == 204
+    after = stats(app, restaurant)
+    assert after['order_count'] == 0 and after['revenue'] == 0
+    assert after == rebuilt(app, restaurant)
+
+def test_deleting_menu_items_takes_their_lines_out_of_the_rollups(app, client, login, restaurant):
+    place_orders(client, login, restaurant)
+    owner = app.test_client()
+    login(owner, 'restaurant_owner')
+    first, second, third = restaurant['menu_item_ids']
+    assert owner.delete(f'/menu/item/{first}').status_code == 204
+    # A menu import that leaves the second item out deletes it too
+    menu = [{'id': third, 'name': 'Dish 2', 'price': 102, 'image': 'dish.png'}]
+    assert owner.put(f'/restaurant/{restaurant["id"]}/menu', json=menu).status_code == 200
+
+    after = stats(app, restaurant)
+    assert after['top_items'] == []
+    assert after['order_count'] == 2
+    assert after == rebuilt(app, restaurant)
+
+def test_cancelling_an_order_takes_its_lines_out_of_top_items(app, client, login, users, restaurant):
+    first_order, _ = place_orders(client, login, restaurant)
+    assert client.patch(f'/orders/{first_order}', json={'status': 'Cancelled'}).status_code == 200
+
+    after = stats(app, restaurant)
+    assert after['orders_by_status'] == {'Cancelled': 1, 'Pending': 1}
+    assert [(item['name'], item['quantity'], item['revenue']) for item in after['top_items']] == [('Dish 1', 3, 303)]
+    assert after == rebuilt(app, restaurant)
+
+    # Deleting the user afterwards must not take the cancelled lines out a second time
+    admin = app.test_client()
+    login(admin, 'admin')
+    assert admin.delete(f'/admin/user/{users["client"]["id"]}').status_code == 204
+    with app.app_context():
+        assert db.session.query(Daily_Item_Stat).filter(Daily_Item_Stat.quantity != 0).count() == 0
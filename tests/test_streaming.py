@@ -0,0 +1,41 @@
+import json
+import pytest
+from encoding import compressor
+
+NDJSON = {'Accept': 'application/x-ndjson'}
+
+@pytest.fixture
+def orders(client, login, restaurant):
+    login(client, 'client')
+    batch = [
+        {'restaurant_id': restaurant['id'], 'delivery_time': f'2024-10-28T1{i}:30:00', 'delivery_address': f'Moi Avenue {i}',
+         'items': [{'menu_item_id': restaurant['menu_item_ids'][0], 'quantity': i + 1}]}
+        for i in range(5)
+    ]
+    assert client.post('/user/orders/batch', json={'orders': batch}).status_code == 201
+
+@pytest.fixture(params=['/user/orders', '/restaurant/{id}/order'])
+def url(request, restaurant):
+    return request.param.format(id=restaurant['id'])
+
+def test_streamed_json_matches_the_plain_body(client, orders, url):
+    plain = client.get(url)
+    streamed = client.get(url, query_string={'stream': 1})
+    assert streamed.is_streamed and streamed.mimetype == 'application/json'
+    assert len(plain.get_json()['orders']) == 5
+    assert json.loads(streamed.get_data()) == plain.get_json()
+
+def test_ndjson_is_one_order_per_line(client, orders, url):
+    plain = client.get(url)
+    streamed = client.get(url, headers=NDJSON)
+    assert streamed.mimetype == 'application/x-ndjson'
+    lines = streamed.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == plain.get_json()['orders']
+
+def test_streamed_responses_are_not_gzipped(client, orders, url, monkeypatch):
+    monkeypatch.setattr(compressor, 'min_size', 0)
+    assert client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+    for headers, args in ((NDJSON, {}), ({}, {'stream': 1})):
+        response = client.get(url, headers=dict(headers, **{'Accept-Encoding': 'gzip'}), query_string=args)
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_data()